@@ -63,6 +63,14 @@ class MainWindowActionsMixin:
                                  'Ctrl+O', 'open', get_str('openFileDetail'))
         self.open_dir_action = action(get_str('openDir'), self.open_dir_dialog,
                                      'Ctrl+u', 'open', get_str('openDir'))
+        self.open_archive_action = action(get_str('openArchive'), self.open_archive_dialog,
+                                         None, 'open', get_str('openArchiveDetail'))
+        self.open_video_action = action(get_str('openVideo'), self.open_video_dialog,
+                                        None, 'open', get_str('openVideoDetail'))
+        self.open_bucket_action = action(get_str('openBucket'), self.open_bucket_dialog,
+                                        None, 'open', get_str('openBucketDetail'))
+        self.work_queue_action = action(get_str('connectWorkQueue'), self.toggle_work_queue,
+                                       None, 'open', get_str('workQueueDetail'))
         self.change_save_dir_action = action(get_str('changeSaveDir'), self.change_save_dir_dialog,
                                             'Ctrl+r', 'open', get_str('changeSavedAnnotationDir'))
         self.open_annotation_action = action(get_str('openAnnotation'), self.open_annotation_dialog,
@@ -73,6 +81,10 @@ class MainWindowActionsMixin:
                                             'd', 'next', get_str('nextImgDetail'))
         self.open_prev_image_action = action(get_str('prevImg'), self.open_prev_image,
                                             'a', 'prev', get_str('prevImgDetail'))
+        self.open_next_unlabeled_action = action(get_str('nextUnlabeled'), self.open_next_unlabeled_image,
+                                                'Shift+D', 'next', get_str('nextUnlabeledDetail'))
+        self.open_next_unverified_action = action(get_str('nextUnverified'), self.open_next_unverified_image,
+                                                 'Shift+V', 'verify', get_str('nextUnverifiedDetail'))
         self.verify_action = action(get_str('verifyImg'), self.verify_image,
                                    'space', 'verify', get_str('verifyImgDetail'))
         self.save_action = action(get_str('save'), self.save_file,
@@ -86,6 +98,8 @@ class MainWindowActionsMixin:
                 return '&YOLO', 'format_yolo'
             elif format == LabelFileFormat.CREATE_ML:
                 return '&CreateML', 'format_createml'
+            elif format == LabelFileFormat.PACKED:
+                return '&Packed', 'labels'
 
         self.save_format_action = action(get_format_meta(self.label_file_format)[0],
                                         self.change_format, 'Ctrl+Y',
@@ -100,9 +114,17 @@ class MainWindowActionsMixin:
                                          'Ctrl+Shift+D', 'close', get_str('deleteImgDetail'))
         self.reset_all_action = action(get_str('resetAll'), self.reset_all, 
                                       None, 'resetall', get_str('resetAllDetail'))
+        self.import_packed_action = action(get_str('importPacked'), self.import_to_packed_store,
+                                          None, 'labels', get_str('importPackedDetail'))
+        self.export_packed_action = action(get_str('exportPacked'), self.export_packed_store,
+                                          None, 'labels', get_str('exportPackedDetail'))
+        self.shard_save_dir_action = action(get_str('shardSaveDir'), self.shard_save_dir,
+                                           None, 'open', get_str('shardSaveDirDetail'))
 
     def _create_edit_actions(self, action, get_str):
         """Create edit-related actions."""
+        self.predict_image_action = action(get_str('predictImage'), self.predict_current_image,
+                                          'Ctrl+P', 'new', get_str('predictImageDetail'), enabled=False)
         self.create_action = action(get_str('crtBox'), self.create_shape,
                                    'w', 'new', get_str('crtBoxDetail'), enabled=False)
         self.delete_action = action(get_str('delBox'), self.delete_selected_shape,
@@ -130,6 +152,13 @@ class MainWindowActionsMixin:
         self.single_class_mode.setCheckable(True)
         self.single_class_mode.setChecked(self.settings.get(SETTING_SINGLE_CLASS, False))
         
+        # Order the file list by the uncertainty scores of the model
+        self.order_by_uncertainty_action = QAction(get_str('orderByUncertainty'), self)
+        self.order_by_uncertainty_action.setCheckable(True)
+        self.order_by_uncertainty_action.setStatusTip(get_str('orderByUncertaintyDetail'))
+        self.order_by_uncertainty_action.setChecked(self.settings.get(SETTING_ORDER_BY_UNCERTAINTY, False))
+        self.order_by_uncertainty_action.toggled.connect(self.apply_image_order)
+        
         # Display label option
         self.display_label_option = QAction(get_str('displayLabel'), self)
         self.display_label_option.setShortcut("Ctrl+Shift+P")
@@ -152,6 +181,8 @@ class MainWindowActionsMixin:
                                       None, 'help', get_str('info'))
         self.show_shortcut_action = action(get_str('shortcut'), self.show_shortcuts_dialog, 
                                           None, 'help', get_str('shortcut'))
+        self.show_cache_stats_action = action(get_str('cacheStats'), self.show_cache_stats_dialog,
+                                             None, 'help', get_str('cacheStatsDetail'))
 
     def _create_zoom_actions(self, action, get_str):
         """Create zoom-related actions."""
@@ -251,7 +282,7 @@ class MainWindowActionsMixin:
                 self.open_action, self.open_dir_action, self.save_action, self.save_as_action, 
                 self.close_action, self.reset_all_action, self.quit_action),
             beginner=(), advanced=(),
-            editMenu=(self.edit_action, self.copy_action, self.delete_action,
+            editMenu=(self.edit_action, self.copy_action, self.delete_action, self.predict_image_action,
                      None, self.color1_action, self.draw_squares_option),
             beginnerContext=(self.create_action, self.edit_action, self.copy_action, self.delete_action),
             advancedContext=(self.create_mode_action, self.edit_mode_action, self.edit_action, 
@@ -288,16 +319,20 @@ class MainWindowActionsMixin:
 
         # Populate menus
         add_actions(self.menus.file,
-                   (self.open_action, self.open_dir_action, self.change_save_dir_action, 
-                    self.open_annotation_action, self.copy_prev_bounding_action, self.menus.recentFiles, 
-                    self.save_action, self.save_format_action, self.save_as_action, self.close_action, 
+                   (self.open_action, self.open_dir_action, self.open_archive_action, self.open_video_action,
+                    self.open_bucket_action, self.work_queue_action, self.change_save_dir_action, self.open_annotation_action, self.copy_prev_bounding_action, self.menus.recentFiles, 
+                    self.open_next_unlabeled_action, self.open_next_unverified_action,
+                    self.save_action, self.save_format_action, self.save_as_action,
+                    self.import_packed_action, self.export_packed_action, self.shard_save_dir_action, self.close_action,
                     self.reset_all_action, self.delete_image_action, self.quit_action))
         
-        add_actions(self.menus.help, (self.help_default_action, self.show_info_action, self.show_shortcut_action))
+        add_actions(self.menus.help, (self.help_default_action, self.show_info_action, self.show_shortcut_action,
+                                      self.show_cache_stats_action))
         
         add_actions(self.menus.view, (
             self.auto_saving,
             self.single_class_mode,
+            self.order_by_uncertainty_action,
             self.display_label_option,
             labels, self.advanced_mode_action, None,
             self.hide_all_action, self.show_all_action, None,
@@ -386,6 +386,35 @@ class MainWindowCanvasMixin:
         """Add light increment."""
         self.set_light(self.light_widget.value() + increment)
 
+    def update_window_level_controls(self):
+        """Show the window/level sliders for 16-bit images and hide them otherwise."""
+        hdr = self.hdr_image
+        self.window_level_widget.setVisible(hdr is not None)
+        if hdr is not None:
+            self.window_level_widget.set_range(hdr.max_value)
+            self.window_level_widget.set_window(hdr.level, hdr.window)
+
+    def set_window_level(self, level, window):
+        """Request a new window/level for the current 16-bit image."""
+        self.pending_window_level = (level, window)
+        self.window_level_timer.start()
+
+    def auto_window_level(self):
+        """Fit the window to the value range of the current 16-bit image."""
+        if self.hdr_image is None:
+            return
+        level, window = self.hdr_image.auto_window()
+        self.window_level_widget.set_window(level, window)
+        self.set_window_level(level, window)
+
+    def _render_window_level(self):
+        if self.hdr_image is None or self.pending_window_level is None:
+            return
+        level, window = self.pending_window_level
+        self.pending_window_level = None
+        if self.hdr_image.set_window(level, window):
+            self.canvas.update()
+
     def set_fit_window(self, value=True):
         """Set fit window mode."""
         if value:
@@ -26,8 +26,13 @@ from libs.shape import Shape, DEFAULT_LINE_COLOR, DEFAULT_FILL_COLOR
 from libs.utils import *
 from libs.toolBar import ToolBar
 from libs.ustr import ustr
-from libs.yolo_inference import YOLOModelDetector, YOLOInferenceEngine
+from libs.yolo_inference import BACKEND_ONNX, BACKEND_PYTORCH, DEFAULT_TILE_OVERLAP, YOLOModelDetector, YOLOInferenceEngine
 from libs.labelFile import LabelFileFormat
+from libs.create_ml_io import CreateMLStore
+from libs.annotation_index import LabelCacheWorker
+from libs.storage import SourceWorker
+from libs.image_status import ImageStatusTracker
+from libs.cache_manager import CacheManager, DEFAULT_BUDGET, PRIORITY_HIGH
 
 __appname__ = 'RedLabel'
 
@@ -110,8 +115,18 @@ class MainWindowCore(QMainWindow, WindowMixin):
         # YOLO inference components
         self.yolo_model_detector = YOLOModelDetector()
         self.yolo_inference_engine = YOLOInferenceEngine()
+        self.yolo_inference_engine.tile_size = self.settings.get(SETTING_YOLO_TILE_SIZE, 0)
+        self.yolo_inference_engine.tile_overlap = self.settings.get(SETTING_YOLO_TILE_OVERLAP, DEFAULT_TILE_OVERLAP)
+        backend = self.settings.get(SETTING_YOLO_BACKEND, BACKEND_PYTORCH)
+        if backend != BACKEND_ONNX or self.yolo_inference_engine.is_onnxruntime_available:
+            self.yolo_inference_engine.backend = backend
         self.yolo_worker = None
         self.selected_yolo_model = None
+        # Background model loads; superseded ones are kept until they finish.
+        self.yolo_model_loader = None
+        self.yolo_model_loaders_superseded = []
+        self.yolo_model_restoring = False
+        self.yolo_image_worker = None
 
         # Initialize additional state variables
         self._init_additional_state()
@@ -131,6 +146,44 @@ class MainWindowCore(QMainWindow, WindowMixin):
         self.image_data = None
         self.label_file = None
         self.lastLabel = None
+        # Decoded images, the current one pinned; shares the global cache budget.
+        CacheManager.instance().set_budget(self.settings.get(SETTING_CACHE_BUDGET, DEFAULT_BUDGET))
+        self.image_cache = CacheManager.instance().register('images', PRIORITY_HIGH)
+        # Raw samples and window/level of the current image if it has 16 bits per sample.
+        self.hdr_image = None
+        self.pending_window_level = None
+        self.cache_stats_dialog = None
+        self.yolo_label_cache = None
+        self.yolo_label_cache_worker = None
+        # Opens the archive, bucket or video being opened; fetches remote images before they are loaded.
+        self.image_source_worker = None
+        self.image_fetch_path = None
+        self.yolo_label_cache_time = 0
+        self.yolo_label_cache_errors = set()
+
+        # CreateML saves are batched; write them back once saving pauses.
+        self.create_ml_flush_timer = QTimer(self)
+        self.create_ml_flush_timer.setSingleShot(True)
+        self.create_ml_flush_timer.setInterval(2000)
+        self.create_ml_flush_timer.timeout.connect(CreateMLStore.flush_all)
+
+        # Annotation index of the save directory, kept current in the background.
+        self.annotation_index = None
+        self.annotation_index_worker = None
+        self.annotation_index_pending = False
+        self.filtered_indices = None
+        self.image_status = ImageStatusTracker()
+        self.dir_watcher = None
+        # Client of the shared work queue while connected; m_img_list then holds the leased batch.
+        self.work_queue = None
+        self.work_queue_root = None
+        self.work_queue_calls = []
+        self.work_queue_worker = None
+        self.work_queue_leasing = False
+        self.annotation_index_timer = QTimer(self)
+        self.annotation_index_timer.setSingleShot(True)
+        self.annotation_index_timer.setInterval(5000)
+        self.annotation_index_timer.timeout.connect(self.start_annotation_indexing)
 
     def load_predefined_classes(self, predefined_classes_file):
         """Load predefined class labels from file."""
@@ -210,6 +263,7 @@ class MainWindowCore(QMainWindow, WindowMixin):
             self.label_list.clear()
         self.file_path = None
         self.image_data = None
+        self.hdr_image = None
         self.label_file = None
         if hasattr(self, 'canvas'):
             self.canvas.reset_state()
@@ -254,6 +308,26 @@ class MainWindowCore(QMainWindow, WindowMixin):
     def closeEvent(self, event):
         """Handle window close event."""
         if self.may_continue():
+            CreateMLStore.flush_all()
+            if hasattr(self, 'thumbnail_loader'):
+                self.thumbnail_loader.wait()
+            if self.annotation_index_worker is not None and self.annotation_index_worker.isRunning():
+                self.annotation_index_worker.cancel()
+                self.annotation_index_worker.wait()
+            self.finish_work_queue_calls()
+            for worker in self.findChildren(LabelCacheWorker) + self.findChildren(SourceWorker):
+                worker.wait()
+            if self.work_queue is not None:
+                self.work_queue.release()
+            if self.yolo_worker is not None and self.yolo_worker.isRunning():
+                # Label files of the images already predicted are still written.
+                self.yolo_worker.cancel()
+                self.yolo_worker.wait()
+            if self.yolo_image_worker is not None:
+                self.yolo_image_worker.wait()
+            for loader in [self.yolo_model_loader] + self.yolo_model_loaders_superseded:
+                if loader is not None:
+                    loader.wait()
             settings = self.settings
             # Save settings before closing
             if self.recent_files:
@@ -270,6 +344,8 @@ class MainWindowCore(QMainWindow, WindowMixin):
                 settings[SETTING_AUTO_SAVE] = self.auto_saving.isChecked()
             if hasattr(self, 'single_class_mode'):
                 settings[SETTING_SINGLE_CLASS] = self.single_class_mode.isChecked()
+            if hasattr(self, 'order_by_uncertainty_action'):
+                settings[SETTING_ORDER_BY_UNCERTAINTY] = self.order_by_uncertainty_action.isChecked()
             settings[SETTING_LABEL_FILE_FORMAT] = self.label_file_format
             settings.save()
             event.accept()
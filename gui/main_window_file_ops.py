@@ -6,6 +6,7 @@ File operations for RedLabel MainWindow - loading, saving, importing, exporting
 import os
 import sys
 import codecs
+import sqlite3
 
 try:
     from PyQt5.QtGui import *
@@ -22,6 +23,20 @@ from libs.labelFile import LabelFile, LabelFileError, LabelFileFormat
 from libs.pascal_voc_io import PascalVocReader, XML_EXT
 from libs.yolo_io import YoloReader, TXT_EXT
 from libs.create_ml_io import CreateMLReader, JSON_EXT
+from libs.packed_io import (PackedReader, PackedStore, PACKED_DB_NAME, image_key,
+                            import_annotations, export_annotations)
+from libs.annotation_index import LabelCacheWorker
+from libs.archive_source import ARCHIVE_EXTS, get_archive, is_archive
+from libs.object_store import URL_SCHEME, get_bucket, is_object_url
+from libs.video_source import VIDEO_EXTS, get_video, is_video, video_support
+from libs.storage import (READ_AHEAD, SourceWorker, image_exists, member_ready, prefetch, read_member, source_at,
+                          split_member_path)
+from libs.dir_watcher import DirectoryWatcher
+from libs.image_decoder import decode_image
+from libs.cache_manager import file_key
+from libs.high_bit_depth import HighBitDepthImage, is_high_bit_depth
+from libs.thumbnails import ThumbnailCache
+from libs.sharding import annotation_path, is_sharded, reshard, save_dir_root
 from libs.constants import *
 from libs.utils import *
 from libs.ustr import ustr
@@ -29,13 +44,12 @@ from libs.shape import Shape
 
 
 def read(filename, default=None):
-    """Read image file."""
+    """Read image file with the fastest decoder available for its format."""
     try:
-        reader = QImageReader(filename)
-        reader.setAutoTransform(True)
-        return reader.read()
-    except:
+        image = decode_image(filename)
+    except Exception:
         return default
+    return default if image is None else image
 
 
 class MainWindowFileOpsMixin:
@@ -56,15 +70,21 @@ class MainWindowFileOpsMixin:
         # Tzutalin 20160906 : Add file list and dock to move faster
         # Highlight the file item
         if unicode_file_path and self.file_list_widget.count() > 0:
-            if unicode_file_path in self.m_img_list:
-                index = self.m_img_list.index(unicode_file_path)
+            index = self.image_status.index_of(unicode_file_path)
+            if index >= 0:
                 file_widget_item = self.file_list_widget.item(index)
                 file_widget_item.setSelected(True)
+                self.thumbnail_view.setCurrentIndex(self.thumbnail_model.index(index))
             else:
                 self.file_list_widget.clear()
                 self.m_img_list.clear()
 
-        if unicode_file_path and os.path.exists(unicode_file_path):
+        self.image_fetch_path = None
+        if unicode_file_path and image_exists(unicode_file_path) and not member_ready(unicode_file_path):
+            self._fetch_and_load(unicode_file_path)
+            return False
+
+        if unicode_file_path and image_exists(unicode_file_path):
             if LabelFile.is_label_file(unicode_file_path):
                 try:
                     self.label_file = LabelFile(unicode_file_path)
@@ -83,7 +103,7 @@ class MainWindowFileOpsMixin:
             else:
                 # Load image:
                 # read data first and store for saving into label file.
-                self.image_data = read(unicode_file_path, None)
+                self.image_data = self._load_image(unicode_file_path)
                 self.label_file = None
                 self.canvas.verified = False
 
@@ -99,7 +119,8 @@ class MainWindowFileOpsMixin:
             self.status("Loaded %s" % os.path.basename(unicode_file_path))
             self.image = image
             self.file_path = unicode_file_path
-            self.canvas.load_pixmap(QPixmap.fromImage(image))
+            self.canvas.load_image(image)
+            self.update_window_level_controls()
             if self.label_file:
                 self.load_labels(self.label_file.shapes)
             self.set_clean()
@@ -119,16 +140,94 @@ class MainWindowFileOpsMixin:
                 self.label_list.item(self.label_list.count() - 1).setSelected(True)
 
             self.canvas.setFocus(True)
+            self.read_ahead()
             return True
         return False
 
+    def _fetch_and_load(self, path):
+        """Fetch an image of a remote source in the background, then load it unless another was opened."""
+        self.image_fetch_path = path
+        self.status('Fetching %s...' % os.path.basename(path))
+        worker = SourceWorker(lambda: read_member(path), parent=self)
+        worker.succeeded.connect(lambda _data: self._on_image_fetched(path))
+        worker.failed.connect(lambda message: self._on_image_fetch_failed(path, message))
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    def _on_image_fetched(self, path):
+        if path == self.image_fetch_path:
+            self.load_file(path)
+
+    def _on_image_fetch_failed(self, path, message):
+        if path == self.image_fetch_path:
+            self.image_fetch_path = None
+            self.error_message(u'Error opening file', u'<p>Could not fetch <i>%s</i>: %s' % (path, message))
+            self.status("Error reading %s" % path)
+
+    def read_ahead(self):
+        """Let remote sources start fetching the images after the current one."""
+        upcoming = []
+        index = self.cur_img_idx
+        while len(upcoming) < READ_AHEAD:
+            index = self.next_visible_index(index, 1)
+            if index is None:
+                break
+            upcoming.append(self.m_img_list[index])
+        prefetch(upcoming)
+
+    def _load_image(self, path):
+        """Decode path, or reuse the cached image if the file is unchanged.
+
+        The returned QImage is the only decoded copy: it is shared by
+        self.image, the canvas and the image cache, where it stays pinned
+        until another image is opened. For 16-bit images it is the 8-bit
+        rendering of self.hdr_image.
+        """
+        key = file_key(path)
+        if key is None:
+            return None
+        cached = self.image_cache.get(key)
+        self.image_cache.unpin()
+        if cached is None:
+            cached = self._decode_image(path)
+            if cached is None or (isinstance(cached, QImage) and cached.isNull()):
+                return cached
+            self.image_cache.put(key, cached, pin=True)
+        else:
+            self.image_cache.pin(key)
+        if isinstance(cached, HighBitDepthImage):
+            self.hdr_image = cached
+            return cached.display
+        return cached
+
+    def _decode_image(self, path):
+        """A displayable QImage of path, or a HighBitDepthImage for 16-bit PNG and TIFF files."""
+        if is_high_bit_depth(path):
+            try:
+                hdr = HighBitDepthImage.open(path)
+            except (OSError, ValueError) as e:
+                self.status('Reading %s as 8-bit: %s' % (os.path.basename(path), e))
+                hdr = None
+            if hdr is not None:
+                return hdr
+        image = read(path, None)
+        if image is None or image.isNull():
+            return image
+        # Convert once to a format QPainter draws without per-paint conversion.
+        if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied,
+                                  QImage.Format_Grayscale8):
+            image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied if image.hasAlphaChannel()
+                                          else QImage.Format_RGB32)
+        return image
+
     def save_file(self, _value=False):
         """Save the current annotations to file."""
         if self.default_save_dir is not None and len(ustr(self.default_save_dir)):
             if self.file_path:
-                image_file_name = os.path.basename(self.file_path)
-                saved_file_name = os.path.splitext(image_file_name)[0]
-                saved_path = os.path.join(ustr(self.default_save_dir), saved_file_name)
+                if self.label_file_format == LabelFileFormat.PACKED:
+                    saved_path = os.path.join(ustr(self.default_save_dir), PACKED_DB_NAME)
+                else:
+                    saved_path = annotation_path(ustr(self.default_save_dir), self.file_path, create=True)
                 self._save_file(saved_path)
         else:
             image_file_dir = os.path.dirname(self.file_path)
@@ -166,8 +265,13 @@ class MainWindowFileOpsMixin:
         """Internal method to save annotations to specified path."""
         if annotation_file_path and self.save_labels(annotation_file_path):
             self.set_clean()
+            self.image_status.set_path_status(self.file_path, labeled=True, verified=self.canvas.verified)
+            self.update_image_status_label()
+            self.schedule_annotation_indexing()
             self.statusBar().showMessage('Saved to  %s' % annotation_file_path)
             self.statusBar().show()
+            if self.work_queue is not None:
+                self.submit_to_work_queue(annotation_file_path)
 
     def save_labels(self, annotation_file_path):
         """Save current labels to annotation file."""
@@ -201,6 +305,12 @@ class MainWindowFileOpsMixin:
                     annotation_file_path += JSON_EXT
                 self.label_file.save_create_ml_format(annotation_file_path, shapes, self.file_path, self.image_data,
                                                       self.label_hist, self.line_color.getRgb(), self.fill_color.getRgb())
+                self.create_ml_flush_timer.start()
+            elif self.label_file_format == LabelFileFormat.PACKED:
+                if os.path.basename(annotation_file_path) != PACKED_DB_NAME:
+                    annotation_file_path = os.path.join(os.path.dirname(annotation_file_path), PACKED_DB_NAME)
+                self.label_file.save_packed_format(annotation_file_path, shapes, self.file_path, self.image_data,
+                                                   self.line_color.getRgb(), self.fill_color.getRgb())
             else:
                 self.label_file.save(annotation_file_path, shapes, self.file_path, self.image_data,
                                      self.line_color.getRgb(), self.fill_color.getRgb())
@@ -210,8 +320,8 @@ class MainWindowFileOpsMixin:
             self.error_message(u'Error saving label data', u'<b>%s</b>' % e)
             return False
 
-    def load_labels(self, shapes):
-        """Load labels from shape data."""
+    def load_labels(self, shapes, append=False):
+        """Load labels from shape data, replacing the shapes on the canvas unless append is set."""
         s = []
         for label, points, line_color, fill_color, difficult in shapes:
             shape = Shape(label=label)
@@ -238,7 +348,7 @@ class MainWindowFileOpsMixin:
 
             self.add_label(shape)
         self.update_combo_box()
-        self.canvas.load_shapes(s)
+        self.canvas.load_shapes(self.canvas.shapes + s if append else s)
 
     def open_file(self, _value=False):
         """Open file dialog to select an image or label file."""
@@ -281,12 +391,100 @@ class MainWindowFileOpsMixin:
                                                                     QFileDialog.ShowDirsOnly | QFileDialog.DontResolveSymlinks))
         else:
             target_dir_path = ustr(default_open_dir_path)
+        if is_archive(target_dir_path):
+            self.open_image_source(target_dir_path)
+            return
         self.last_open_dir = target_dir_path
         self.default_save_dir = target_dir_path
         self.import_dir_images(target_dir_path)
         if self.file_path:
             self.show_bounding_box_from_annotation_file(file_path=self.file_path)
 
+    def open_archive_dialog(self, _value=False):
+        """Open file dialog to select a zip or tar archive of images."""
+        if not self.may_continue():
+            return
+        path = os.path.dirname(self.last_open_dir) if self.last_open_dir else '.'
+        filters = 'Image archives (%s)' % ' '.join('*' + ext for ext in ARCHIVE_EXTS)
+        filename, _ = QFileDialog.getOpenFileName(self, '%s - Open Archive' % self.__class__.__name__, path, filters)
+        if filename:
+            self.open_image_source(ustr(filename))
+
+    def open_video_dialog(self, _value=False):
+        """Open file dialog to select a video whose frames to annotate."""
+        if not self.may_continue():
+            return
+        path = os.path.dirname(self.last_open_dir) if self.last_open_dir else '.'
+        filters = 'Videos (%s)' % ' '.join('*' + ext for ext in VIDEO_EXTS)
+        filename, _ = QFileDialog.getOpenFileName(self, '%s - Open Video' % self.__class__.__name__, path, filters)
+        if filename:
+            self.open_image_source(ustr(filename))
+
+    def open_bucket_dialog(self, _value=False):
+        """Ask for the s3:// location of a bucket of images."""
+        if not self.may_continue():
+            return
+        url, ok = QInputDialog.getText(self, '%s - Open Bucket' % self.__class__.__name__,
+                                       'Location (%sbucket/prefix):' % URL_SCHEME, QLineEdit.Normal, URL_SCHEME)
+        url = ustr(url).strip()
+        if ok and is_object_url(url) and len(url) > len(URL_SCHEME):
+            self.open_image_source(url)
+
+    def open_image_source(self, location):
+        """Browse the images of an archive, bucket or video without copying them to a directory.
+
+        Annotations go to the regular directory the source suggests, e.g.
+        one next to the archive.
+        """
+        if is_video(location) and not video_support():
+            self.error_message(u'Error opening %s' % location, u'Reading videos needs PyAV: <i>pip install av</i>')
+            return
+        # Archives and videos are indexed on first use and buckets are listed on every open,
+        # which can take long; it is done in the background.
+        if is_object_url(location):
+            open_source, message = get_bucket, 'Listing %s...'
+        elif is_video(location):
+            open_source, message = get_video, 'Indexing %s...'
+        else:
+            open_source, message = get_archive, 'Indexing %s...'
+        progress = QProgressDialog(message % location, 'Cancel', 0, 0, self)
+        progress.setWindowTitle('Opening')
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        worker = self.image_source_worker = SourceWorker(lambda: open_source(location), parent=self)
+        worker.succeeded.connect(lambda source: self._on_image_source_opened(worker, location, source))
+        worker.failed.connect(lambda message: self._on_image_source_failed(worker, location, message))
+        worker.finished.connect(progress.deleteLater)
+        worker.finished.connect(worker.deleteLater)
+        # The source is still opened, but no longer shown.
+        progress.canceled.connect(self._cancel_image_source)
+        worker.start()
+
+    def _cancel_image_source(self):
+        self.image_source_worker = None
+
+    def _on_image_source_failed(self, worker, location, message):
+        if worker is not self.image_source_worker:
+            return
+        self.image_source_worker = None
+        self.error_message(u'Error opening %s' % location, u'<b>%s</b>' % message)
+
+    def _on_image_source_opened(self, worker, location, source):
+        if worker is not self.image_source_worker:
+            return
+        self.image_source_worker = None
+        save_dir = source.default_save_dir()
+        try:
+            os.makedirs(save_dir, exist_ok=True)
+        except OSError as e:
+            self.error_message(u'Error opening %s' % location, u'Cannot create <i>%s</i>: %s' % (save_dir, e))
+            return
+        self.last_open_dir = source.root
+        self.default_save_dir = save_dir
+        self.import_dir_images(source.root)
+        if self.file_path:
+            self.show_bounding_box_from_annotation_file(file_path=self.file_path)
+
     def import_dir_images(self, dir_path):
         """Import all images from a directory."""
         if not dir_path:
@@ -296,22 +494,46 @@ class MainWindowFileOpsMixin:
         self.dir_name = dir_path
         self.file_path = None
         self.file_list_widget.clear()
+        self.filtered_indices = None
         self.m_img_list = self.scan_all_images(dir_path)
+        if self.order_by_uncertainty_action.isChecked():
+            self.m_img_list = self._sorted_images(self.m_img_list)
         self.img_count = len(self.m_img_list)
+        self.refresh_image_status()
+        self.warm_annotation_cache()
+        self.start_annotation_indexing()
         self.open_next_image()
         for imgPath in self.m_img_list:
             item = QListWidgetItem(imgPath)
             self.file_list_widget.addItem(item)
+        self.thumbnail_model.set_paths(self.m_img_list)
+        if source_at(os.path.abspath(dir_path)) is not None:
+            # Archives, buckets and videos are read as they were listed; there is nothing to watch.
+            if self.dir_watcher is not None:
+                self.dir_watcher.stop()
+        else:
+            self.watch_image_directory(dir_path)
         
         # Update YOLO inference state after importing directory
         if hasattr(self, 'update_yolo_inference_state'):
             self.update_yolo_inference_state()
 
+    def _image_extensions(self):
+        """File extensions of the image formats Qt can read."""
+        return ['.%s' % fmt.data().decode("ascii").lower() for fmt in QImageReader.supportedImageFormats()]
+
     def scan_all_images(self, folder_path):
         """Scan directory for all supported image files."""
-        extensions = ['.%s' % fmt.data().decode("ascii").lower() for fmt in QImageReader.supportedImageFormats()]
+        extensions = self._image_extensions()
         images = []
 
+        source = get_archive(folder_path) if is_archive(folder_path) else source_at(os.path.abspath(folder_path))
+        if source is not None:
+            images = [source.member_path(name) for name in source.names()
+                      if name.lower().endswith(tuple(extensions))]
+            natural_sort(images, key=lambda x: x.lower())
+            return images
+
         for root, dirs, files in os.walk(folder_path):
             for file in files:
                 if file.lower().endswith(tuple(extensions)):
@@ -321,18 +543,97 @@ class MainWindowFileOpsMixin:
         natural_sort(images, key=lambda x: x.lower())
         return images
 
-    def open_next_image(self, _value=False):
-        """Navigate to the next image in the list."""
-        # Proceeding next image without dialog if having any label
+    def _leave_current_image(self):
+        """Auto-save or ask about unsaved changes; False if navigation should stop."""
+        # Proceeding to another image without dialog if having any label
         if self.auto_saving.isChecked():
             if self.default_save_dir is not None:
                 if self.dirty is True:
                     self.save_file()
             else:
                 self.change_save_dir_dialog()
-                return
+                return False
+        return self.may_continue()
 
-        if not self.may_continue():
+    def watch_image_directory(self, dir_path):
+        """Follow images being added to or removed from dir_path."""
+        if self.dir_watcher is None:
+            self.dir_watcher = DirectoryWatcher(self._image_extensions(), parent=self)
+            self.dir_watcher.images_changed.connect(self._on_watched_images_changed)
+        try:
+            self.dir_watcher.watch(dir_path, self.m_img_list)
+        except OSError as e:
+            self.status('Not watching %s: %s' % (dir_path, e))
+
+    def _on_watched_images_changed(self, added, removed):
+        """Insert new images at their sorted position and drop deleted ones."""
+        added = [ustr(path) for path in added if self.image_status.index_of(ustr(path)) < 0]
+        removed = set(ustr(path) for path in removed if self.image_status.index_of(ustr(path)) >= 0)
+        if not added and not removed:
+            return
+        # Row positions shift below; un-hide now and filter again at the end.
+        filtered = self.filtered_indices is not None
+        if filtered:
+            self._set_filtered_indices(None)
+        sort_key = lambda x: x.lower()
+        if self.order_by_uncertainty_action.isChecked() or len(added) + len(removed) > max(256, self.img_count // 20):
+            # Large bursts: one merge and one list rebuild beat many inserts. A list
+            # ordered by score is always rebuilt, as insert positions go by name.
+            self.m_img_list = self._sorted_images(
+                [path for path in self.m_img_list if path not in removed] + added)
+            self.file_list_widget.clear()
+            self.file_list_widget.addItems(self.m_img_list)
+        else:
+            for index in sorted((self.image_status.index_of(path) for path in removed), reverse=True):
+                del self.m_img_list[index]
+                self.file_list_widget.takeItem(index)
+            for path in added:
+                index = natural_insert_position(self.m_img_list, path, key=sort_key)
+                self.m_img_list.insert(index, path)
+                self.file_list_widget.insertItem(index, QListWidgetItem(path))
+        self.img_count = len(self.m_img_list)
+        self.thumbnail_model.set_paths(self.m_img_list)
+        self.image_status.remap(self.m_img_list, self._annotated_paths(added))
+        self.update_image_status_label()
+
+        if self.file_path is not None:
+            index = self.image_status.index_of(self.file_path)
+            if index >= 0:
+                self.cur_img_idx = index
+                self.file_list_widget.item(index).setSelected(True)
+            else:
+                # The open image was deleted; stay near where it was.
+                self.cur_img_idx = max(0, min(self.cur_img_idx, self.img_count - 1))
+        if filtered:
+            self.apply_file_filter()
+        if hasattr(self, 'update_yolo_inference_state'):
+            self.update_yolo_inference_state()
+        self.status('%d images added, %d removed' % (len(added), len(removed)))
+
+    def _annotated_paths(self, image_paths):
+        """The image_paths that already have an annotation in the save directory."""
+        if not self.default_save_dir or not image_paths:
+            return []
+        sharded = is_sharded(self.default_save_dir)
+        packed = PackedStore.open_if_exists(self.default_save_dir)
+        annotated = []
+        for path in image_paths:
+            base = annotation_path(self.default_save_dir, path, sharded=sharded)
+            if any(os.path.isfile(base + ext) for ext in (XML_EXT, TXT_EXT, JSON_EXT)) or \
+                    (packed is not None and image_key(path) in packed):
+                annotated.append(path)
+        return annotated
+
+    def open_next_image(self, _value=False):
+        """Navigate to the next image in the list."""
+        if not self._leave_current_image():
+            return
+
+        if self.work_queue is not None and (
+                self.work_queue.lease_lost or
+                self.next_visible_index(self.cur_img_idx if self.file_path is not None else -1, 1) is None):
+            # The batch is done or lost: take the next one from the queue.
+            self.open_next_queue_batch()
             return
 
         if self.img_count <= 0:
@@ -342,29 +643,17 @@ class MainWindowFileOpsMixin:
             return
 
         filename = None
-        if self.file_path is None:
-            filename = self.m_img_list[0]
-            self.cur_img_idx = 0
-        else:
-            if self.cur_img_idx + 1 < self.img_count:
-                self.cur_img_idx += 1
-                filename = self.m_img_list[self.cur_img_idx]
+        index = self.next_visible_index(self.cur_img_idx if self.file_path is not None else -1, 1)
+        if index is not None:
+            self.cur_img_idx = index
+            filename = self.m_img_list[self.cur_img_idx]
 
         if filename:
             self.load_file(filename)
 
     def open_prev_image(self, _value=False):
         """Navigate to the previous image in the list."""
-        # Proceeding prev image without dialog if having any label
-        if self.auto_saving.isChecked():
-            if self.default_save_dir is not None:
-                if self.dirty is True:
-                    self.save_file()
-            else:
-                self.change_save_dir_dialog()
-                return
-
-        if not self.may_continue():
+        if not self._leave_current_image():
             return
 
         if self.img_count <= 0:
@@ -373,8 +662,9 @@ class MainWindowFileOpsMixin:
         if self.file_path is None:
             return
 
-        if self.cur_img_idx - 1 >= 0:
-            self.cur_img_idx -= 1
+        index = self.next_visible_index(self.cur_img_idx, -1)
+        if index is not None:
+            self.cur_img_idx = index
             filename = self.m_img_list[self.cur_img_idx]
             if filename:
                 self.load_file(filename)
@@ -392,6 +682,9 @@ class MainWindowFileOpsMixin:
 
         if dir_path is not None and len(dir_path) > 1:
             self.default_save_dir = dir_path
+            self.refresh_image_status()
+            self.warm_annotation_cache()
+            self.start_annotation_indexing()
 
         # Only try to load annotations if a file is currently open
         if self.file_path is not None:
@@ -433,11 +726,18 @@ class MainWindowFileOpsMixin:
 
     def show_bounding_box_from_annotation_file(self, file_path):
         """Load bounding boxes from existing annotation files."""
+        # A packed store answers with one indexed lookup instead of file probes.
+        store = PackedStore.open_if_exists(self.default_save_dir if self.default_save_dir is not None
+                                           else os.path.dirname(file_path))
+        if store is not None and image_key(file_path) in store:
+            self.load_packed_by_filename(store.db_path, file_path)
+            return
+
         if self.default_save_dir is not None:
-            basename = os.path.basename(os.path.splitext(file_path)[0])
-            xml_path = os.path.join(self.default_save_dir, basename + XML_EXT)
-            txt_path = os.path.join(self.default_save_dir, basename + TXT_EXT)
-            json_path = os.path.join(self.default_save_dir, basename + JSON_EXT)
+            basename = annotation_path(self.default_save_dir, file_path)
+            xml_path = basename + XML_EXT
+            txt_path = basename + TXT_EXT
+            json_path = basename + JSON_EXT
 
             """Annotation file priority:
             PascalXML > YOLO
@@ -484,6 +784,13 @@ class MainWindowFileOpsMixin:
         if os.path.isfile(txt_path) is False:
             return
 
+        shapes = self._cached_yolo_shapes(txt_path)
+        if shapes is not None:
+            self.set_format(FORMAT_YOLO)
+            self.load_labels(shapes)
+            self.canvas.verified = False
+            return
+
         try:
             self.set_format(FORMAT_YOLO)
             tYoloParseReader = YoloReader(txt_path, self.image)
@@ -499,6 +806,57 @@ class MainWindowFileOpsMixin:
         except Exception as e:
             self._show_critical_annotation_error("YOLO Loading Error", txt_path, str(e))
 
+    def warm_annotation_cache(self):
+        """Parse every YOLO label file of the save directory in one bulk pass, in the background.
+
+        Until the pass is done, label files are read one by one as before.
+        """
+        self.yolo_label_cache = None
+        self.yolo_label_cache_worker = None
+        if not self.default_save_dir or not os.path.isdir(self.default_save_dir):
+            return
+        worker = LabelCacheWorker(self.default_save_dir, parent=self)
+        worker.cache_ready.connect(self._on_label_cache_ready)
+        worker.finished.connect(self._on_label_cache_thread_finished)
+        self.yolo_label_cache_worker = worker
+        worker.start()
+
+    def _on_label_cache_ready(self, cache, started):
+        if self.sender() is not self.yolo_label_cache_worker:
+            # The save directory changed while this pass was reading.
+            return
+        self.yolo_label_cache = cache
+        self.yolo_label_cache_time = started
+        self.yolo_label_cache_errors = set(os.path.abspath(path) for path, _ in cache.errors)
+
+    def _on_label_cache_thread_finished(self):
+        worker = self.sender()
+        if worker is self.yolo_label_cache_worker:
+            self.yolo_label_cache_worker = None
+        worker.deleteLater()
+
+    def _cached_yolo_shapes(self, txt_path):
+        """Return the shapes of txt_path from the bulk cache, or None if stale or absent.
+
+        Files with parse errors are left to YoloReader so the user still gets
+        its error report.
+        """
+        cache = self.yolo_label_cache
+        if cache is None or os.path.abspath(txt_path) in self.yolo_label_cache_errors:
+            return None
+        index = cache.index_of(txt_path)
+        if index < 0:
+            return None
+        classes_path = os.path.join(save_dir_root(os.path.realpath(txt_path)), "classes.txt")
+        try:
+            if os.path.getmtime(txt_path) >= self.yolo_label_cache_time or \
+                    os.path.getmtime(classes_path) >= self.yolo_label_cache_time:
+                return None
+        except OSError:
+            return None
+        boxes = cache.pixel_boxes(index, self.image.height(), self.image.width())
+        return cache.get_shapes(index, boxes=boxes.astype(int))
+
     def load_create_ml_json_by_filename(self, json_path, file_path):
         """Load CreateML format annotation file."""
         if self.file_path is None:
@@ -515,6 +873,79 @@ class MainWindowFileOpsMixin:
         except Exception as e:
             self._show_critical_annotation_error("CreateML Loading Error", json_path, str(e))
 
+    def load_packed_by_filename(self, db_path, file_path):
+        """Load the annotations of file_path from a packed store."""
+        if self.file_path is None:
+            return
+
+        try:
+            self.set_format(FORMAT_PACKED)
+            packed_reader = PackedReader(db_path, file_path)
+            self.load_labels(packed_reader.get_shapes())
+            self.canvas.verified = packed_reader.verified
+        except Exception as e:
+            self._show_critical_annotation_error("Packed Store Loading Error", db_path, str(e))
+
+    def _ask_exchange_format(self, title):
+        """Ask which file format to import from or export to."""
+        formats = {FORMAT_PASCALVOC: 'xml', FORMAT_YOLO: 'txt', FORMAT_CREATEML: 'json'}
+        item, ok = QInputDialog.getItem(self, title, 'Format:', list(formats), 0, False)
+        return formats[item] if ok else None
+
+    def import_to_packed_store(self, _value=False):
+        """Copy the annotation files of the save directory into its packed store."""
+        if not self.default_save_dir:
+            QMessageBox.warning(self, "No Save Directory", "Please set a save directory first.")
+            return
+        source_format = self._ask_exchange_format('Import to Packed Store')
+        if source_format is None:
+            return
+        store = PackedStore.open(os.path.join(self.default_save_dir, PACKED_DB_NAME))
+        count = import_annotations(store, self.default_save_dir, source_format, self.m_img_list)
+        self.status('Imported %d images into %s' % (count, store.db_path))
+        if self.file_path:
+            self.load_file(self.file_path)
+
+    def export_packed_store(self, _value=False):
+        """Write the packed store of the save directory out as annotation files."""
+        store = PackedStore.open_if_exists(self.default_save_dir) if self.default_save_dir else None
+        if store is None:
+            QMessageBox.warning(self, "No Packed Store", "The save directory has no packed annotation store.")
+            return
+        target_format = self._ask_exchange_format('Export Packed Store')
+        if target_format is None:
+            return
+        count = export_annotations(store, self.default_save_dir, target_format, list(self.label_hist))
+        self.status('Exported %d images from %s' % (count, store.db_path))
+
+    def shard_save_dir(self, _value=False):
+        """Move the annotation files of the save directory into hash-prefix shards."""
+        if not self.default_save_dir:
+            QMessageBox.warning(self, "No Save Directory", "Please set a save directory first.")
+            return
+        if is_sharded(self.default_save_dir):
+            self.status('%s is already sharded' % self.default_save_dir)
+            return
+        if not self.may_continue():
+            return
+        reply = QMessageBox.question(
+            self, "Shard Save Directory",
+            "Move every annotation file of\n%s\ninto hash-prefix subdirectories?\n\n"
+            "Other tools reading this directory must then look in the subdirectories." % self.default_save_dir,
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            moved = reshard(self.default_save_dir, image_paths=self.m_img_list)
+        except OSError as e:
+            QApplication.restoreOverrideCursor()
+            self.error_message('Error sharding save directory', '<b>%s</b>' % e)
+            return
+        QApplication.restoreOverrideCursor()
+        self.warm_annotation_cache()
+        self.status('Moved %d annotation files into shards' % moved)
+
     def copy_previous_bounding_boxes(self):
         """Copy bounding boxes from the previous image."""
         currIndex = self.m_img_list.index(self.file_path)
@@ -525,6 +956,9 @@ class MainWindowFileOpsMixin:
     def delete_image(self):
         """Delete the current image file."""
         delete_path = self.file_path
+        if delete_path is not None and split_member_path(delete_path) is not None:
+            self.status('%s belongs to an archive, bucket or video and cannot be deleted' % os.path.basename(delete_path))
+            return
         if delete_path is not None:
             idx = self.cur_img_idx
             if os.path.exists(delete_path):
@@ -576,11 +1010,30 @@ class MainWindowFileOpsMixin:
 
     def file_item_double_clicked(self, item=None):
         """Handle file list item double click."""
-        self.cur_img_idx = self.m_img_list.index(ustr(item.text()))
-        filename = self.m_img_list[self.cur_img_idx]
+        index = self.image_status.index_of(ustr(item.text()))
+        if index < 0:
+            # The item is no longer in the image list.
+            return
+        self.cur_img_idx = index
+        filename = self.m_img_list[index]
         if filename:
             self.load_file(filename)
 
+    def thumbnail_activated(self, index):
+        """Open the image of an activated thumbnail."""
+        self.cur_img_idx = index.row()
+        self.load_file(self.m_img_list[self.cur_img_idx])
+
+    def file_view_changed(self, tab_index):
+        """Attach the disk cache the first time the thumbnail grid is shown."""
+        if self.file_view_tabs.widget(tab_index) is self.thumbnail_view and self.thumbnail_loader.cache is None:
+            try:
+                self.thumbnail_loader.cache = ThumbnailCache()
+            except (OSError, sqlite3.Error) as e:
+                self.status('Thumbnails will not be cached: %s' % e)
+            if self.file_path is not None:
+                self.thumbnail_view.scrollTo(self.thumbnail_model.index(self.cur_img_idx))
+
     def _show_annotation_errors(self, title, file_path, errors):
         """Show a dialog with annotation parsing errors."""
         filename = os.path.basename(file_path)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Annotation index, image status, file list filtering and ordering for RedLabel MainWindow
+"""
+import os
+import sys
+from bisect import bisect_left, bisect_right
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import *
+except ImportError:
+    if sys.version_info.major >= 3:
+        import sip
+        sip.setapi('QVariant', 2)
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+from libs.active_learning import score_name
+from libs.annotation_index import AnnotationIndex, AnnotationIndexWorker, QueryError
+from libs.create_ml_io import JSON_EXT
+from libs.image_status import LABELED, VERIFIED
+from libs.packed_io import PackedStore, image_key
+from libs.pascal_voc_io import XML_EXT
+from libs.sharding import annotation_names
+from libs.utils import natural_sort
+from libs.yolo_io import TXT_EXT
+from libs.ustr import ustr
+
+
+class MainWindowIndexMixin:
+    """Mixin class for the annotation index, image status tracking and the file list filter and order."""
+
+    def start_annotation_indexing(self):
+        """(Re-)index the save directory in the background."""
+        if not self.default_save_dir:
+            return
+        worker = self.annotation_index_worker
+        if worker is not None and worker.isRunning():
+            if worker.index.save_dir == os.path.abspath(self.default_save_dir):
+                # Catch up on whatever changed while this run was scanning.
+                self.annotation_index_pending = True
+                return
+            worker.cancel()
+        try:
+            self.annotation_index = AnnotationIndex.for_directory(self.default_save_dir)
+        except Exception as e:
+            self.status('Annotation index unavailable: %s' % e)
+            return
+        self.annotation_index_pending = False
+        self.annotation_index_worker = AnnotationIndexWorker(self.annotation_index, self.m_img_list, parent=self)
+        self.annotation_index_worker.finished.connect(self._on_index_thread_finished)
+        self.annotation_index_worker.progress_updated.connect(self._on_indexing_progress)
+        self.annotation_index_worker.indexing_finished.connect(self._on_indexing_finished)
+        self.annotation_index_worker.indexing_failed.connect(self._on_indexing_failed)
+        self.annotation_index_worker.start()
+
+    def schedule_annotation_indexing(self):
+        """Re-index shortly after the last of a series of saves."""
+        self.annotation_index_timer.start()
+
+    def _on_indexing_progress(self, done, total):
+        if done < total:
+            self.file_filter_status.setText('Indexing %d/%d' % (done, total))
+
+    def _on_indexing_finished(self, count):
+        if self.sender() is not self.annotation_index_worker or self.annotation_index_pending:
+            return
+        self.file_filter_status.setText('')
+        self._merge_index_status()
+        self.thumbnail_model.set_badges(self.annotation_index.box_counts(), self.annotation_index.names('verified'))
+        # Results may have changed under the active filter.
+        if self.file_filter_edit.text().strip():
+            self.apply_file_filter()
+
+    def _on_index_thread_finished(self):
+        worker = self.sender()
+        if worker is self.annotation_index_worker:
+            self.annotation_index_worker = None
+            if self.annotation_index_pending:
+                self.start_annotation_indexing()
+        worker.deleteLater()
+
+    def _on_indexing_failed(self, message):
+        self.file_filter_status.setText('Index failed')
+        self.file_filter_status.setToolTip(message)
+
+    def refresh_image_status(self):
+        """Rebuild the labelled/verified flags of m_img_list from the save directory.
+
+        Labelled comes from one listing of the save directory; verified is
+        only known from the annotation index and is filled in once it is
+        current.
+        """
+        self.image_status.reset(self.m_img_list)
+        if self.default_save_dir:
+            labeled = self._labeled_keys()
+            verified = set()
+            if self.annotation_index is not None and \
+                    self.annotation_index.save_dir == os.path.abspath(self.default_save_dir):
+                verified = self.annotation_index.names('verified')
+            self.image_status.load(labeled, verified, image_key)
+        self.update_image_status_label()
+
+    def _labeled_keys(self):
+        """image_key() of every image with an annotation in the save directory, from one listing of it."""
+        labeled = set()
+        for ext in (XML_EXT, TXT_EXT, JSON_EXT):
+            labeled.update(annotation_names(self.default_save_dir, ext))
+        packed = PackedStore.open_if_exists(self.default_save_dir)
+        if packed is not None:
+            labeled.update(packed.names())
+        return labeled
+
+    def _merge_index_status(self):
+        """Take the verified flags (and CreateML images) from a freshly updated index."""
+        index = self.annotation_index
+        if index is None or not self.default_save_dir or index.save_dir != os.path.abspath(self.default_save_dir):
+            return
+        labeled = index.names()
+        verified = index.names('verified')
+        for i, path in enumerate(self.image_status.paths):
+            key = image_key(path)
+            if key in labeled:
+                self.image_status.set_status(i, labeled=True, verified=key in verified)
+        self.update_image_status_label()
+
+    def update_image_status_label(self):
+        total = len(self.image_status)
+        if not total:
+            self.image_status_label.setText('')
+            return
+        self.image_status_label.setText('Labeled %d/%d  Verified %d/%d' % (
+            self.image_status.labeled_count, total, self.image_status.verified_count, total))
+
+    def _open_next_with_status(self, flag, done_message):
+        if not self.m_img_list or not self._leave_current_image():
+            return
+        start = self.cur_img_idx if self.file_path is not None else -1
+        index = self.image_status.find_next(start, flag)
+        if index is None:
+            self.status(done_message)
+            return
+        self.cur_img_idx = index
+        self.load_file(self.m_img_list[index])
+
+    def open_next_unlabeled_image(self, _value=False):
+        """Jump to the next image without annotations."""
+        self._open_next_with_status(LABELED, 'Every image is labeled')
+
+    def open_next_unverified_image(self, _value=False):
+        """Jump to the next image that is not verified."""
+        self._open_next_with_status(VERIFIED, 'Every image is verified')
+
+    def apply_file_filter(self):
+        """Show only the images matching the query in the filter box."""
+        query = ustr(self.file_filter_edit.text()).strip()
+        if not query:
+            self.clear_file_filter()
+            return
+        if self.annotation_index is None:
+            self.status('Set a save directory to filter images by their annotations')
+            return
+        try:
+            indices = self.annotation_index.filter(self.m_img_list, query)
+        except QueryError as e:
+            self.file_filter_status.setText('')
+            self.status(str(e))
+            return
+        self._set_filtered_indices(indices)
+        self.file_filter_status.setText('%d of %d' % (len(indices), self.img_count))
+
+    def clear_file_filter(self):
+        self._set_filtered_indices(None)
+        self.file_filter_status.setText('')
+
+    def _set_filtered_indices(self, indices):
+        previous = self.filtered_indices
+        self.filtered_indices = indices
+        # Only touch rows whose visibility changes; hiding is slow on large lists.
+        if previous is None:
+            previous = range(self.file_list_widget.count())
+        shown = set(indices) if indices is not None else None
+        was_shown = set(previous)
+        for row in range(self.file_list_widget.count()):
+            visible = shown is None or row in shown
+            if visible != (row in was_shown):
+                self.file_list_widget.setRowHidden(row, not visible)
+                self.thumbnail_view.setRowHidden(row, not visible)
+
+    def next_visible_index(self, index, step):
+        """Index of the next image after index (backwards if step < 0) that passes the filter, or None."""
+        if self.filtered_indices is None:
+            target = index + step
+            return target if 0 <= target < self.img_count else None
+        if step > 0:
+            pos = bisect_right(self.filtered_indices, index)
+            return self.filtered_indices[pos] if pos < len(self.filtered_indices) else None
+        pos = bisect_left(self.filtered_indices, index) - 1
+        return self.filtered_indices[pos] if pos >= 0 else None
+
+    def _sorted_images(self, image_paths):
+        """image_paths by name, or by uncertainty score, highest first, if the list is ordered by it.
+
+        Scores are those of the loaded model. Images without a score, and
+        images labeled since they were scored, follow the scored ones, by name.
+        """
+        paths = list(image_paths)
+        natural_sort(paths, key=lambda x: x.lower())
+        engine = getattr(self, 'yolo_inference_engine', None)
+        model = engine.model_digest() if engine is not None else None
+        if self.order_by_uncertainty_action.isChecked() and self.default_save_dir and model is not None:
+            try:
+                scores = AnnotationIndex.for_directory(self.default_save_dir).scores(model)
+                labeled = self._labeled_keys() if scores else set()
+            except Exception as e:
+                self.status('Uncertainty scores unavailable: %s' % e)
+                return paths
+            if scores:
+                paths.sort(key=lambda path: 1.0 if image_key(path) in labeled else
+                           -scores.get(score_name(path, self.last_open_dir), -1.0))
+        return paths
+
+    def apply_image_order(self, _value=False):
+        """Reorder the file list after the order or the scores changed."""
+        if not self.m_img_list or self.work_queue is not None:
+            # A leased batch keeps the order of the queue.
+            return
+        paths = self._sorted_images(self.m_img_list)
+        if paths == self.m_img_list:
+            return
+        filtered = self.filtered_indices is not None
+        if filtered:
+            self._set_filtered_indices(None)
+        self.m_img_list = paths
+        self.file_list_widget.clear()
+        self.file_list_widget.addItems(paths)
+        self.thumbnail_model.set_paths(paths)
+        self.image_status.remap(paths)
+        if self.file_path is not None:
+            index = self.image_status.index_of(self.file_path)
+            if index >= 0:
+                self.cur_img_idx = index
+                self.file_list_widget.item(index).setSelected(True)
+        if filtered:
+            self.apply_file_filter()
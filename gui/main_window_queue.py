@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared work queue for RedLabel MainWindow - annotating leased batches of images
+"""
+import os
+import sys
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import *
+except ImportError:
+    if sys.version_info.major >= 3:
+        import sip
+        sip.setapi('QVariant', 2)
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+from libs.constants import *
+from libs.labelFile import LabelFileFormat
+from libs.pascal_voc_io import XML_EXT
+from libs.sharding import save_dir_root
+from libs.storage import SourceWorker
+from libs.ustr import ustr
+from libs.work_queue import CLASSES_FILE, DEFAULT_PORT, LeaseError, WorkQueueClient
+from libs.yolo_io import TXT_EXT
+
+
+class MainWindowQueueMixin:
+    """Mixin class for taking images from a work queue shared with other annotators."""
+
+    def toggle_work_queue(self, _value=False):
+        """Connect to a work queue server, or disconnect if connected."""
+        if self.work_queue is not None:
+            if self.may_continue():
+                self.disconnect_work_queue()
+            return
+        if not self.last_open_dir:
+            QMessageBox.warning(self, "No Image Directory",
+                                "Open the image directory of the queue first; leased images are looked up in it.")
+            return
+        default_url = self.settings.get(SETTING_WORK_QUEUE_URL, 'http://127.0.0.1:%d' % DEFAULT_PORT)
+        url, ok = QInputDialog.getText(self, '%s - Work Queue' % self.__class__.__name__,
+                                       'Server URL:', QLineEdit.Normal, default_url)
+        url = ustr(url).strip()
+        if ok and url:
+            self.connect_work_queue(url)
+
+    def connect_work_queue(self, url):
+        """Annotate the batches the queue at url hands out instead of the whole directory."""
+        client = WorkQueueClient(url)
+        self.status('Connecting to the work queue at %s...' % url)
+        self.call_work_queue(client.stats, lambda _counts: self._on_work_queue_connected(client, url),
+                             lambda message: self.error_message(u'Error connecting to work queue',
+                                                                u'<b>%s</b>' % message))
+
+    def _on_work_queue_connected(self, client, url):
+        if self.work_queue is not None or not self.may_continue():
+            return
+        self.settings[SETTING_WORK_QUEUE_URL] = url
+        self.work_queue = client
+        self.work_queue_root = os.path.abspath(self.last_open_dir)
+        if self.dir_watcher is not None:
+            # New files are added to the queue by its server, not to the batch.
+            self.dir_watcher.stop()
+        self.work_queue_action.setText(self.get_str('disconnectWorkQueue'))
+        self.open_next_queue_batch()
+
+    def disconnect_work_queue(self):
+        """Give the current batch back and return to the whole directory."""
+        client, self.work_queue = self.work_queue, None
+        self.call_work_queue(client.release)
+        self.work_queue_action.setText(self.get_str('connectWorkQueue'))
+        self.import_dir_images(self.work_queue_root)
+        self.status('Disconnected from the work queue')
+
+    def call_work_queue(self, function, succeeded=None, failed=None):
+        """Run a call to the queue server in the background, after the calls made before it.
+
+        The calls share one lease, so a save must reach the server before
+        the lease is given back for the next batch.
+        """
+        self.work_queue_calls.append((function, succeeded, failed))
+        if self.work_queue_worker is None:
+            self._next_work_queue_call()
+
+    def _next_work_queue_call(self):
+        self.work_queue_worker = None
+        if not self.work_queue_calls:
+            return
+        function, succeeded, failed = self.work_queue_calls.pop(0)
+        worker = self.work_queue_worker = SourceWorker(function, parent=self)
+        if succeeded is not None:
+            worker.succeeded.connect(succeeded)
+        if failed is not None:
+            worker.failed.connect(failed)
+        worker.finished.connect(self._next_work_queue_call)
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    def finish_work_queue_calls(self):
+        """Make the calls still waiting, without their GUI updates; for closing the window."""
+        if self.work_queue_worker is not None:
+            self.work_queue_worker.wait()
+        calls, self.work_queue_calls = self.work_queue_calls, []
+        for function, _succeeded, _failed in calls:
+            try:
+                function()
+            except Exception:
+                pass
+
+    def queue_image_path(self, name):
+        return os.path.join(self.work_queue_root, *name.split('/'))
+
+    def queue_image_name(self, path):
+        return os.path.relpath(path, self.work_queue_root).replace(os.sep, '/')
+
+    def open_next_queue_batch(self):
+        """Lease the next batch of images, giving the current one back, and open its first image."""
+        if self.work_queue_leasing:
+            return
+        client = self.work_queue
+        self.work_queue_leasing = True
+        self.status('Leasing the next batch from the work queue...')
+        self.call_work_queue(client.lease, lambda names: self._on_queue_batch_leased(client, names),
+                             self._on_queue_batch_failed)
+
+    def _on_queue_batch_failed(self, message):
+        self.work_queue_leasing = False
+        self.status('Work queue: %s' % message)
+
+    def _on_queue_batch_leased(self, client, names):
+        self.work_queue_leasing = False
+        if client is not self.work_queue:
+            # Disconnected while the batch was leased.
+            self.call_work_queue(client.release)
+            return
+        if not names:
+            QMessageBox.information(self, "Work Queue", "The work queue has no images left.")
+            return
+        paths = [self.queue_image_path(name) for name in names]
+        self.file_path = None
+        self.file_list_widget.clear()
+        self.filtered_indices = None
+        self.m_img_list = paths
+        self.img_count = len(paths)
+        self.refresh_image_status()
+        self.file_list_widget.addItems(paths)
+        self.thumbnail_model.set_paths(paths)
+        self.cur_img_idx = 0
+        self.load_file(paths[0])
+        self.status('Leased %d images from the work queue' % len(paths))
+        if hasattr(self, 'update_yolo_inference_state'):
+            self.update_yolo_inference_state()
+
+    def submit_to_work_queue(self, annotation_file_path):
+        """Send the annotation just saved for the current image to the queue."""
+        if self.label_file_format == LabelFileFormat.PASCAL_VOC:
+            ext = XML_EXT
+        elif self.label_file_format == LabelFileFormat.YOLO:
+            ext = TXT_EXT
+        else:
+            self.status('The work queue accepts Pascal VOC and YOLO annotations only; saved locally')
+            return
+        if not annotation_file_path.lower().endswith(ext):
+            annotation_file_path += ext
+        files = {}
+        try:
+            with open(annotation_file_path, 'r', encoding=DEFAULT_ENCODING) as f:
+                files[os.path.basename(annotation_file_path)] = f.read()
+            if ext == TXT_EXT:
+                with open(os.path.join(save_dir_root(annotation_file_path), CLASSES_FILE), 'r',
+                          encoding=DEFAULT_ENCODING) as f:
+                    files[CLASSES_FILE] = f.read()
+        except OSError as e:
+            self.error_message(u'Error sending annotation to work queue', u'<b>%s</b>' % e)
+            return
+        client, name = self.work_queue, self.queue_image_name(self.file_path)
+
+        def complete():
+            try:
+                return client.complete(name, files)
+            except LeaseError:
+                return None
+
+        self.call_work_queue(complete, self._on_work_queue_submitted,
+                             lambda message: self.error_message(u'Error sending annotation to work queue',
+                                                                u'<b>%s</b>' % message))
+
+    def _on_work_queue_submitted(self, counts):
+        if counts is None:
+            QMessageBox.warning(self, "Work Queue",
+                                "The lease on this batch expired and its images went back to the queue. "
+                                "The annotation was saved locally only; the next image starts a new batch.")
+            return
+        self.status('Sent to the work queue: %d done, %d leased, %d pending'
+                    % (counts['done'], counts['leased'], counts['pending']))
@@ -16,15 +16,20 @@ except ImportError:
     from PyQt4.QtGui import *
     from PyQt4.QtCore import *
 
+from libs.archive_source import is_archive
+from libs.object_store import is_object_url
+from libs.video_source import is_video
 from libs.combobox import ComboBox
 from libs.default_label_combobox import DefaultLabelComboBox
 from libs.canvas import Canvas
 from libs.zoomWidget import ZoomWidget
 from libs.lightWidget import LightWidget
+from libs.windowLevelWidget import WindowLevelWidget
 from libs.labelDialog import LabelDialog
 from libs.colorDialog import ColorDialog
 from libs.constants import *
 from libs.utils import add_actions
+from libs.thumbnails import ThumbnailLoader, ThumbnailModel, create_thumbnail_view
 
 
 class MainWindowUIMixin:
@@ -90,6 +95,9 @@ class MainWindowUIMixin:
         
         # YOLO inference section
         self._create_yolo_controls(layout)
+
+        # Window/level for 16-bit images
+        self._create_window_level_controls(layout)
         
         # Update YOLO button state
         self.update_yolo_inference_state()
@@ -125,6 +133,20 @@ class MainWindowUIMixin:
         
         yolo_layout.addWidget(self.yolo_inference_button)
         
+        # Single-image prediction
+        self.yolo_predict_button = QPushButton("Predict This Image")
+        self.yolo_predict_button.clicked.connect(self.predict_current_image)
+        self.yolo_predict_button.setEnabled(False)
+        self.yolo_predict_button.setToolTip("Add the model's detections on the current image as boxes (Ctrl+P)")
+        yolo_layout.addWidget(self.yolo_predict_button)
+        
+        # Active learning: score unlabeled images for the file list order
+        self.yolo_rank_button = QPushButton("Rank Unlabeled Images")
+        self.yolo_rank_button.clicked.connect(self.score_unlabeled_images)
+        self.yolo_rank_button.setEnabled(False)
+        self.yolo_rank_button.setToolTip("Score how unsure the model is about each unlabeled image and list those first")
+        yolo_layout.addWidget(self.yolo_rank_button)
+        
         # Progress bar for inference
         self.yolo_progress = QProgressBar()
         self.yolo_progress.setVisible(False)
@@ -132,6 +154,19 @@ class MainWindowUIMixin:
         
         layout.addWidget(yolo_group)
 
+    def _create_window_level_controls(self, layout):
+        """Create the window/level sliders, shown only while a 16-bit image is open."""
+        self.window_level_widget = WindowLevelWidget()
+        self.window_level_widget.window_changed.connect(self.set_window_level)
+        self.window_level_widget.auto_requested.connect(self.auto_window_level)
+        self.window_level_widget.setVisible(False)
+        # Slider moves arrive faster than large images render; only the latest one is drawn.
+        self.window_level_timer = QTimer(self)
+        self.window_level_timer.setSingleShot(True)
+        self.window_level_timer.setInterval(15)
+        self.window_level_timer.timeout.connect(self._render_window_level)
+        layout.addWidget(self.window_level_widget)
+
     def _create_label_list_controls(self, layout, get_str):
         """Create label list and combo box for showing unique labels."""
         self.combo_box = ComboBox(self)
@@ -156,15 +191,52 @@ class MainWindowUIMixin:
         # File list dock widget
         self.file_list_widget = QListWidget()
         self.file_list_widget.itemDoubleClicked.connect(self.file_item_double_clicked)
+        self.file_list_widget.setUniformItemSizes(True)
         file_list_layout = QVBoxLayout()
         file_list_layout.setContentsMargins(0, 0, 0, 0)
-        file_list_layout.addWidget(self.file_list_widget)
+        file_list_layout.addLayout(self._create_file_filter_controls())
+        file_list_layout.addWidget(self._create_file_view_tabs())
         file_list_container = QWidget()
         file_list_container.setLayout(file_list_layout)
         self.file_dock = QDockWidget(get_str('fileList'), self)
         self.file_dock.setObjectName(get_str('files'))
         self.file_dock.setWidget(file_list_container)
 
+    def _create_file_view_tabs(self):
+        """Put the file list and the thumbnail grid side by side in tabs."""
+        self.thumbnail_loader = ThumbnailLoader(parent=self)
+        self.thumbnail_model = ThumbnailModel(self.thumbnail_loader, self)
+        self.thumbnail_view = create_thumbnail_view(self.thumbnail_model)
+        self.thumbnail_view.activated.connect(self.thumbnail_activated)
+
+        self.file_view_tabs = QTabWidget()
+        self.file_view_tabs.addTab(self.file_list_widget, "List")
+        self.file_view_tabs.addTab(self.thumbnail_view, "Thumbnails")
+        self.file_view_tabs.currentChanged.connect(self.file_view_changed)
+        return self.file_view_tabs
+
+    def _create_file_filter_controls(self):
+        """Create the query box that filters the file list by annotations."""
+        self.file_filter_edit = QLineEdit()
+        self.file_filter_edit.setPlaceholderText("Filter, e.g. class:dog unverified")
+        self.file_filter_edit.setToolTip(
+            "Show only images matching all terms:\n"
+            "class:NAME  has a box labelled NAME\n"
+            "verified / unverified\n"
+            "small:N  has a box smaller than N pixels\n"
+            "empty  annotated without boxes\n"
+            "unlabeled  not annotated\n"
+            "Next/previous image then step through the matches.")
+        self.file_filter_edit.returnPressed.connect(self.apply_file_filter)
+        self.file_filter_status = QLabel('')
+        self.file_filter_status.setStyleSheet("color: #666; font-size: 11px;")
+
+        filter_layout = QHBoxLayout()
+        filter_layout.setContentsMargins(0, 0, 0, 0)
+        filter_layout.addWidget(self.file_filter_edit)
+        filter_layout.addWidget(self.file_filter_status)
+        return filter_layout
+
     def _create_canvas_and_scroll(self, get_str):
         """Create main canvas and scroll area components."""
         # Create utility widgets
@@ -217,18 +289,22 @@ class MainWindowUIMixin:
         # Setup status bar coordinates display
         self.label_coordinates = QLabel('')
         self.statusBar().addPermanentWidget(self.label_coordinates)
+        self.image_status_label = QLabel('')
+        self.statusBar().addPermanentWidget(self.image_status_label)
 
         # Load initial file/directory if specified
         import os
         from functools import partial
-        if self.file_path and os.path.isdir(self.file_path):
+        if self.file_path and (is_archive(self.file_path) or is_object_url(self.file_path) or is_video(self.file_path)):
+            self.queue_event(partial(self.open_image_source, self.file_path))
+        elif self.file_path and os.path.isdir(self.file_path):
             self.queue_event(partial(self.import_dir_images, self.file_path or ""))
             self.open_dir_dialog(dir_path=self.file_path, silent=True)
         elif self.file_path:
             self.queue_event(partial(self.load_file, self.file_path or ""))
         
-        # Load last saved YOLO model (after UI is fully initialized)
-        self._load_last_yolo_model()
+        # Restore the last saved YOLO model once the window is up
+        self.queue_event(self._load_last_yolo_model)
 
     def toggle_actions(self, value=True):
         """Enable/Disable widgets which depend on an opened image."""
@@ -17,8 +17,32 @@ except ImportError:
     from PyQt4.QtGui import *
     from PyQt4.QtCore import *
 
-from libs.yolo_inference import YOLOModelDialog, YOLOInferenceWorker
+from libs.yolo_inference import YOLOModelDialog, YOLOModelLoader, YOLOImageWorker, YOLOInferenceWorker
+from libs.active_learning import YOLOScoringWorker, score_name
+from libs.annotation_index import AnnotationIndex
 from libs.constants import *
+from libs.yolo_io import CLASSES_LOCK, TXT_EXT
+from libs.image_array import image_digest
+from libs.sharding import annotation_path
+
+# Detections overlapping an existing box of the same label this much are not added again.
+DUPLICATE_IOU = 0.9
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection)
+
+
+def shape_box(shape):
+    xs = [point.x() for point in shape.points]
+    ys = [point.y() for point in shape.points]
+    return min(xs), min(ys), max(xs), max(ys)
 
 
 class MainWindowYOLOMixin:
@@ -26,56 +50,114 @@ class MainWindowYOLOMixin:
 
     def select_yolo_model(self):
         """Open dialog to select YOLO model."""
-        dialog = YOLOModelDialog(self)
+        engine = self.yolo_inference_engine
+        dialog = YOLOModelDialog(self, tile_size=engine.tile_size, tile_overlap=engine.tile_overlap,
+                                 backend=engine.backend)
         if dialog.exec_() == QDialog.Accepted:
+            engine.tile_size = dialog.get_tile_size()
+            engine.tile_overlap = dialog.get_tile_overlap()
+            engine.backend = dialog.get_backend()
+            self.settings[SETTING_YOLO_TILE_SIZE] = engine.tile_size
+            self.settings[SETTING_YOLO_TILE_OVERLAP] = engine.tile_overlap
+            self.settings[SETTING_YOLO_BACKEND] = engine.backend
             selected_model = dialog.get_selected_model()
             if selected_model:
                 self._load_yolo_model(selected_model)
 
-    def _load_yolo_model(self, model_path):
-        """Load YOLO model and update UI."""
-        try:
-            self.yolo_inference_engine.load_model(model_path)
-            self.selected_yolo_model = model_path
-            
-            # Update UI
-            model_name = os.path.basename(model_path)
-            self.yolo_model_label.setText(f"Model: {model_name}")
-            self.yolo_model_label.setStyleSheet("color: #0066cc; font-size: 11px;")
-            
-            # Save to settings
-            self.settings[SETTING_YOLO_MODEL_PATH] = model_path
-            self.settings.save()
-            
-            # Update inference button state
-            self.update_yolo_inference_state()
-            
-            self.statusBar().showMessage(f"Loaded YOLO model: {model_name}", 3000)
-            
-        except Exception as e:
+    def _load_yolo_model(self, model_path, restoring=False):
+        """Load YOLO model in a background thread; the UI is updated when it is ready.
+
+        A model restored from the settings that fails to load is forgotten
+        silently instead of reporting an error. Models still resident from
+        an earlier load are switched to at once.
+        """
+        model = self.yolo_inference_engine.resident_model(model_path)
+        if model is not None:
+            self._supersede_yolo_model_loader()
+            self.yolo_model_loader = None
+            self._use_yolo_model(model_path, model)
+            return
+        model_name = os.path.basename(model_path)
+        self.yolo_model_restoring = restoring
+        self.yolo_model_label.setText(f"Loading model: {model_name}...")
+        self.yolo_model_label.setStyleSheet("color: #666; font-size: 11px; font-style: italic;")
+        self.statusBar().showMessage(f"Loading YOLO model: {model_name}...")
+        self._start_yolo_model_loader(model_path)
+
+    def _start_yolo_model_loader(self, model_path):
+        loader = YOLOModelLoader(self.yolo_inference_engine, model_path)
+        loader.model_loaded.connect(self._on_yolo_model_loaded)
+        loader.load_failed.connect(self._on_yolo_model_load_failed)
+        self._supersede_yolo_model_loader()
+        self.yolo_model_loader = loader
+        loader.start()
+
+    def _supersede_yolo_model_loader(self):
+        # A load in flight keeps running but its result is ignored.
+        self.yolo_model_loaders_superseded = [old for old in self.yolo_model_loaders_superseded if old.isRunning()]
+        if self.yolo_model_loader is not None and self.yolo_model_loader.isRunning():
+            self.yolo_model_loaders_superseded.append(self.yolo_model_loader)
+
+    def _on_yolo_model_loaded(self, model_path, model):
+        """Make a model loaded in the background current."""
+        if self.sender() is self.yolo_model_loader:
+            self._use_yolo_model(model_path, model)
+
+    def _use_yolo_model(self, model_path, model):
+        """Make model current and update UI."""
+        self.yolo_inference_engine.set_model(model, model_path)
+        self.selected_yolo_model = model_path
+        
+        # Update UI
+        model_name = os.path.basename(model_path)
+        self.yolo_model_label.setText(f"Model: {model_name}")
+        self.yolo_model_label.setStyleSheet("color: #0066cc; font-size: 11px;")
+        
+        # Save to settings
+        self.settings[SETTING_YOLO_MODEL_PATH] = model_path
+        self.settings.save()
+        
+        # Update inference button state
+        self.update_yolo_inference_state()
+        
+        self.statusBar().showMessage(f"Loaded YOLO model: {model_name}", 3000)
+
+    def _on_yolo_model_load_failed(self, model_path, error_message):
+        """Report a model that failed to load, or forget it if it was restored from the settings."""
+        if self.sender() is not self.yolo_model_loader or not model_path:
+            return
+        if self.yolo_model_restoring:
+            self.settings[SETTING_YOLO_MODEL_PATH] = ''
+            self.statusBar().clearMessage()
+        else:
             QMessageBox.critical(
                 self, 
                 "Model Load Error", 
-                f"Failed to load YOLO model:\n{str(e)}"
+                f"Failed to load YOLO model:\n{error_message}"
             )
-            self.selected_yolo_model = None
-            self.yolo_model_label.setText("No model selected")
-            self.yolo_model_label.setStyleSheet("color: #666; font-size: 11px;")
-            self.update_yolo_inference_state()
+        self.selected_yolo_model = None
+        self.yolo_inference_engine.set_model(None, None)
+        self.yolo_model_label.setText("No model selected")
+        self.yolo_model_label.setStyleSheet("color: #666; font-size: 11px;")
+        self.update_yolo_inference_state()
 
     def update_yolo_inference_state(self):
         """Update YOLO inference button enabled state."""
         has_model = self.selected_yolo_model is not None
         has_images = bool(self.m_img_list)
         has_save_dir = self.default_save_dir is not None
-        has_unlabeled = bool(self._get_unlabeled_images()) if has_images and has_save_dir else False
+        has_unlabeled = self.image_status.labeled_count < len(self.image_status) if has_save_dir else False
+        
+        running = self.yolo_worker is not None
         
-        # Enable button only if we have model, images, save dir, and unlabeled images
-        enabled = has_model and has_images and has_save_dir and has_unlabeled
+        # Enable button only if we have model, images, save dir, and unlabeled images, and no batch is running
+        enabled = has_model and has_images and has_save_dir and has_unlabeled and not running
         self.yolo_inference_button.setEnabled(enabled)
         
         # Update tooltip
-        if not has_model:
+        if running:
+            tooltip = "Wait for the running inference or ranking to finish"
+        elif not has_model:
             tooltip = "Select a YOLO model first"
         elif not has_save_dir:
             tooltip = "Set a save directory first"
@@ -87,6 +169,77 @@ class MainWindowYOLOMixin:
             tooltip = "Run YOLO inference on unlabeled images"
         
         self.yolo_inference_button.setToolTip(tooltip)
+        self.yolo_rank_button.setEnabled(enabled)
+        
+        can_predict = has_model and self.yolo_image_worker is None
+        self.yolo_predict_button.setEnabled(can_predict)
+        if hasattr(self, 'predict_image_action'):
+            self.predict_image_action.setEnabled(can_predict)
+
+    def predict_current_image(self, _value=False):
+        """Pre-annotate the image on the canvas with the current model.
+
+        The decoded image is predicted in a background thread and the
+        detections are added as editable boxes. Results are cached by
+        image content, model and threshold, so predicting an image again
+        is instant.
+        """
+        if self.selected_yolo_model is None or self.yolo_image_worker is not None:
+            return
+        if not self.file_path or self.image.isNull():
+            self.status('Open an image to predict first')
+            return
+        confidence = getattr(self, 'confidence_threshold', 0.25)
+        model_digest = self.yolo_inference_engine.model_digest()
+        engine = self.yolo_inference_engine
+        key = None if model_digest is None else (image_digest(self.image), model_digest, engine.backend,
+                                                 confidence, engine.tile_size, engine.tile_overlap)
+        detections = None if key is None else self.yolo_inference_engine.prediction_cache.get(key)
+        if detections is not None:
+            self._add_detection_shapes(detections)
+            return
+        # Window/level re-renders a 16-bit image in place, so the worker gets its own copy.
+        image = self.image.copy() if self.hdr_image is not None else self.image
+        worker = self.yolo_image_worker = YOLOImageWorker(self.yolo_inference_engine, image, key, confidence)
+        worker.file_path = self.file_path
+        worker.prediction_ready.connect(self._on_image_prediction_ready)
+        worker.prediction_failed.connect(self._on_image_prediction_failed)
+        worker.finished.connect(self._on_image_prediction_finished)
+        self.update_yolo_inference_state()
+        self.statusBar().showMessage(f"Predicting {os.path.basename(self.file_path)}...")
+        worker.start()
+
+    def _on_image_prediction_ready(self, key, detections):
+        if self.sender().file_path != self.file_path:
+            # The image was left meanwhile; its detections are cached for when it is predicted again.
+            self.statusBar().clearMessage()
+            return
+        self._add_detection_shapes(detections)
+
+    def _on_image_prediction_failed(self, error_message):
+        self.statusBar().clearMessage()
+        QMessageBox.warning(self, "Prediction Error", f"Could not predict this image:\n{error_message}")
+
+    def _on_image_prediction_finished(self):
+        self.yolo_image_worker = None
+        self.update_yolo_inference_state()
+
+    def _add_detection_shapes(self, detections):
+        """Add detections as boxes, skipping those that are already on the canvas."""
+        boxes = [(shape.label, shape_box(shape)) for shape in self.canvas.shapes]
+        shapes = []
+        for detection in detections:
+            label, bbox = detection['class_name'], detection['bbox']
+            if any(label == other and box_iou(bbox, box) >= DUPLICATE_IOU for other, box in boxes):
+                continue
+            x1, y1, x2, y2 = bbox
+            shapes.append((label, [(x1, y1), (x2, y1), (x2, y2), (x1, y2)], None, None, False))
+            if label not in self.label_hist:
+                self.label_hist.append(label)
+        if shapes:
+            self.load_labels(shapes, append=True)
+            self.set_dirty()
+        self.status(f"Added {len(shapes)} of {len(detections)} detections")
 
     def _has_labels_txt(self):
         """Check if classes.txt exists in the save directory (for YOLO format)."""
@@ -96,19 +249,19 @@ class MainWindowYOLOMixin:
         return os.path.exists(classes_path)
 
     def _load_last_yolo_model(self):
-        """Load the last saved YOLO model from settings."""
+        """Restore the last saved YOLO model from settings in the background.
+
+        Without one, ultralytics is still imported in the background so
+        that picking a model does not wait for torch.
+        """
+        if self.yolo_model_loader is not None or self.selected_yolo_model is not None:
+            # A model was picked before the window got here.
+            return
         last_model_path = self.settings.get(SETTING_YOLO_MODEL_PATH, None)
         if last_model_path and os.path.exists(last_model_path):
-            try:
-                self.yolo_inference_engine.load_model(last_model_path)
-                self.selected_yolo_model = last_model_path
-                model_name = os.path.basename(last_model_path)
-                self.yolo_model_label.setText(f"Model: {model_name}")
-                self.yolo_model_label.setStyleSheet("color: #0066cc; font-size: 11px;")
-                self.update_yolo_inference_state()
-            except Exception as e:
-                # Model failed to load, clear from settings
-                self.settings[SETTING_YOLO_MODEL_PATH] = ''
+            self._load_yolo_model(last_model_path, restoring=True)
+        elif self.yolo_inference_engine.is_ultralytics_available:
+            self._start_yolo_model_loader(None)
 
     def _ensure_classes_txt(self):
         """Ensure classes.txt exists in save directory, create from model if missing."""
@@ -127,7 +280,7 @@ class MainWindowYOLOMixin:
             class_names = self.yolo_inference_engine.get_class_names()
             
             # Write class names to classes.txt
-            with open(classes_path, 'w') as f:
+            with CLASSES_LOCK, open(classes_path, 'w') as f:
                 for class_name in class_names:
                     f.write(f"{class_name}\n")
             
@@ -145,6 +298,8 @@ class MainWindowYOLOMixin:
 
     def run_yolo_inference(self):
         """Run YOLO inference on all unlabeled images."""
+        if self.yolo_worker is not None:
+            return
         if not self.selected_yolo_model:
             QMessageBox.warning(self, "No Model", "Please select a YOLO model first.")
             return
@@ -178,19 +333,12 @@ class MainWindowYOLOMixin:
         if not self.m_img_list or not self.default_save_dir:
             return []
         
-        unlabeled = []
-        for img_path in self.m_img_list:
-            # Get corresponding label file path
-            img_name = os.path.splitext(os.path.basename(img_path))[0]
-            label_path = os.path.join(self.default_save_dir, f"{img_name}.txt")
-            
-            if not os.path.exists(label_path):
-                unlabeled.append(img_path)
-        
-        return unlabeled
+        return self.image_status.unlabeled_paths()
 
     def _start_yolo_inference(self, image_paths):
         """Start YOLO inference in a background thread."""
+        if self.yolo_worker is not None:
+            return
         confidence = getattr(self, 'confidence_threshold', 0.25)
         
         # Setup progress bar
@@ -206,108 +354,125 @@ class MainWindowYOLOMixin:
         self.yolo_worker = YOLOInferenceWorker(
             self.yolo_inference_engine, 
             image_paths, 
-            confidence
+            self.default_save_dir,
+            confidence,
+            image_cache=self.image_cache,
+            parent=self
         )
         
         # Connect signals
         self.yolo_worker.progress_updated.connect(self.yolo_progress.setValue)
-        self.yolo_worker.inference_completed.connect(self._on_inference_completed)
+        self.yolo_worker.labels_written.connect(self._on_labels_written)
         self.yolo_worker.inference_failed.connect(self._on_inference_failed)
         self.yolo_worker.finished_all.connect(self._on_inference_finished)
+        self.yolo_worker.finished.connect(self._on_yolo_worker_thread_finished)
         
         self.yolo_worker.start()
         
         self.statusBar().showMessage("Running YOLO inference...")
 
-    def _on_inference_completed(self, image_path, detections):
-        """Handle completed inference for a single image."""
-        if detections:
-            # Create label file for this image
-            self._create_yolo_label_file(image_path, detections)
-            
-            # If this is the current image, update the canvas
-            if image_path == self.file_path:
-                self._load_yolo_labels_for_current_image()
+    def _on_labels_written(self, image_paths):
+        """Mark images labeled by the inference worker, and show the labels of the current one."""
+        for image_path in image_paths:
+            self.image_status.set_path_status(image_path, labeled=True)
+        self.update_image_status_label()
+        if self.file_path in image_paths:
+            self._load_yolo_labels_for_current_image()
 
     def _on_inference_failed(self, image_path, error_message):
         """Handle failed inference for a single image."""
         print(f"Inference failed for {image_path}: {error_message}")
 
+    def _on_yolo_worker_thread_finished(self):
+        """Drop the batch worker once its thread has stopped; finished_all is emitted while it still runs."""
+        worker = self.sender()
+        if worker is self.yolo_worker:
+            self.yolo_worker = None
+            self.update_yolo_inference_state()
+        worker.deleteLater()
+
     def _on_inference_finished(self):
         """Handle completion of all inference tasks."""
-        # Reset UI state
+        # Reset UI state; the button is enabled again once the thread has stopped
         self.yolo_progress.setVisible(False)
-        self.yolo_inference_button.setEnabled(True)
         self.yolo_inference_button.setText("Run YOLO Inference")
         self.update_yolo_inference_state()
         
         # Update status
         self.statusBar().showMessage("YOLO inference completed", 3000)
+        self.schedule_annotation_indexing()
         
         # Refresh current image if it was processed
         if hasattr(self, 'file_path') and self.file_path:
             self.load_file(self.file_path)
 
-    def _create_yolo_label_file(self, image_path, detections):
-        """Create YOLO format label file from detections."""
-        if not self.default_save_dir or not detections:
+    def score_unlabeled_images(self, _value=False):
+        """Score how uncertain the model is about every unlabeled image, in the background.
+
+        Images already scored with this model are skipped, so an
+        interrupted run picks up where it stopped. When done, the file
+        list is ordered by the scores.
+        """
+        if not self.selected_yolo_model or not self.default_save_dir or self.yolo_worker is not None:
+            return
+        model = self.yolo_inference_engine.model_digest()
+        if model is None:
+            self.status('The model file cannot be read')
             return
-        
-        # Get image dimensions
         try:
-            from PIL import Image
-            with Image.open(image_path) as img:
-                img_width, img_height = img.size
-        except ImportError:
-            # Fallback to QImage if PIL not available
-            img = QImage(image_path)
-            img_width, img_height = img.width(), img.height()
-        
-        # Load class names from classes.txt
-        classes_path = os.path.join(self.default_save_dir, "classes.txt")
-        class_names = []
-        if os.path.exists(classes_path):
-            with open(classes_path, 'r') as f:
-                class_names = [line.strip() for line in f.readlines()]
+            index = AnnotationIndex.for_directory(self.default_save_dir)
+            scored = index.scored_names(model)
+        except Exception as e:
+            QMessageBox.warning(self, "Scores Unavailable", f"Could not open the score store:\n{e}")
+            return
+        image_paths = [path for path in self._get_unlabeled_images()
+                       if score_name(path, self.last_open_dir) not in scored]
+        if not image_paths:
+            self._on_scoring_finished()
+            return
         
-        # Create YOLO format lines
-        yolo_lines = []
-        for detection in detections:
-            x1, y1, x2, y2 = detection['bbox']
-            class_name = detection['class_name']
-            
-            # Get class index
-            if class_name in class_names:
-                class_idx = class_names.index(class_name)
-            else:
-                # Add new class to classes.txt
-                class_names.append(class_name)
-                class_idx = len(class_names) - 1
-                with open(classes_path, 'a') as f:
-                    f.write(f"{class_name}\n")
-            
-            # Convert to YOLO format (normalized)
-            x_center = (x1 + x2) / 2.0 / img_width
-            y_center = (y1 + y2) / 2.0 / img_height
-            width = (x2 - x1) / img_width
-            height = (y2 - y1) / img_height
-            
-            yolo_lines.append(f"{class_idx} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}")
+        self.yolo_progress.setVisible(True)
+        self.yolo_progress.setRange(0, len(image_paths))
+        self.yolo_progress.setValue(0)
+        self.yolo_inference_button.setEnabled(False)
+        self.yolo_rank_button.setEnabled(False)
+        self.yolo_rank_button.setText("Ranking Images...")
         
-        # Save label file
-        img_name = os.path.splitext(os.path.basename(image_path))[0]
-        label_file_path = os.path.join(self.default_save_dir, f"{img_name}.txt")
+        self.yolo_worker = YOLOScoringWorker(
+            self.yolo_inference_engine,
+            image_paths,
+            index,
+            model,
+            self.last_open_dir,
+            getattr(self, 'confidence_threshold', 0.25),
+            image_cache=self.image_cache,
+            parent=self
+        )
+        self.yolo_worker.progress_updated.connect(self.yolo_progress.setValue)
+        self.yolo_worker.inference_failed.connect(self._on_inference_failed)
+        self.yolo_worker.finished_all.connect(self._on_scoring_finished)
+        self.yolo_worker.finished.connect(self._on_yolo_worker_thread_finished)
+        self.yolo_worker.start()
         
-        with open(label_file_path, 'w') as f:
-            f.write('\n'.join(yolo_lines))
+        self.statusBar().showMessage(f"Scoring {len(image_paths)} unlabeled images...")
+
+    def _on_scoring_finished(self):
+        """Order the file list by the new scores."""
+        self.yolo_progress.setVisible(False)
+        self.yolo_rank_button.setText("Rank Unlabeled Images")
+        self.update_yolo_inference_state()
+        if self.order_by_uncertainty_action.isChecked():
+            self.apply_image_order()
+        else:
+            self.order_by_uncertainty_action.setChecked(True)
+        self.statusBar().showMessage("Images ordered by uncertainty", 3000)
 
     def _load_yolo_labels_for_current_image(self):
         """Load YOLO labels for the current image and update canvas."""
         if not self.file_path or not self.default_save_dir:
             return
         
-        img_name = os.path.splitext(os.path.basename(self.file_path))[0]
-        label_path = os.path.join(self.default_save_dir, f"{img_name}.txt")
+        label_path = annotation_path(self.default_save_dir, self.file_path, TXT_EXT)
         
         if os.path.exists(label_path):
             self.load_yolo_txt_by_filename(label_path)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Uncertainty scores for ordering unlabeled images by how much labeling them teaches the model.
+
+The loaded model predicts every image at the low SCORING_CONF threshold,
+and each image is scored from the confidences of its candidate boxes:
+
+    entropy           mean binary entropy of the candidates, in bits
+    least_confidence  1 minus the lowest confidence kept at the
+                      annotation threshold
+    disagreement      share of the candidates the annotation threshold
+                      drops, i.e. how far the box counts at the two
+                      thresholds disagree
+
+all between 0 and 1; the score is their mean. Images without candidates
+score 0. Scores are computed with NumPy over batches of images and kept
+in the annotation index of the save directory, per model and image path
+relative to the image directory.
+"""
+import os
+
+import numpy as np
+
+from libs.yolo_inference import YOLOInferenceWorker
+
+# Confidence threshold of the candidate boxes.
+SCORING_CONF = 0.05
+
+# Images scored and stored at once.
+SCORE_BATCH = 256
+
+
+def uncertainty_scores(confidences, conf_threshold=0.25):
+    """(N, 4) array of score, entropy, least confidence and disagreement.
+
+    confidences holds one sequence of candidate box confidences per image.
+    """
+    counts = np.fromiter((len(c) for c in confidences), dtype=np.int64, count=len(confidences))
+    n = len(counts)
+    image = np.repeat(np.arange(n), counts)
+    conf = np.concatenate([np.asarray(c, dtype=np.float64) for c in confidences]) if counts.sum() else np.zeros(0)
+    p = np.clip(conf, 1e-6, 1 - 1e-6)
+    box_entropy = -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+    candidates = np.maximum(counts, 1)
+    entropy = np.bincount(image, box_entropy, n) / candidates
+    kept = conf >= conf_threshold
+    lowest = np.ones(n)
+    np.minimum.at(lowest, image[kept], conf[kept])
+    least_confidence = 1 - lowest
+    disagreement = (counts - np.bincount(image, kept, n)) / candidates
+    score = (entropy + least_confidence + disagreement) / 3
+    return np.stack([score, entropy, least_confidence, disagreement], axis=1)
+
+
+def score_name(image_path, image_dir):
+    """Name the scores of image_path are stored under: its '/'-separated path relative to image_dir."""
+    return os.path.relpath(image_path, image_dir or os.path.dirname(image_path)).replace(os.sep, '/')
+
+
+class YOLOScoringWorker(YOLOInferenceWorker):
+    """Worker thread scoring the uncertainty of the model on images.
+
+    Runs the decode and inference stages of YOLOInferenceWorker; instead
+    of label files, the writer stage stores scores in the annotation
+    index every SCORE_BATCH images, so an interrupted run keeps them.
+    """
+
+    def __init__(self, inference_engine, image_paths, index, model, image_dir, conf_threshold=0.25,
+                 image_cache=None, parent=None):
+        super().__init__(inference_engine, image_paths, index.save_dir, SCORING_CONF, image_cache, parent)
+        self.index = index
+        self.model = model
+        self.image_dir = image_dir
+        self.annotation_threshold = conf_threshold
+        self._pending = []
+
+    def _write(self, image_path, detections, image_size):
+        self._pending.append((score_name(image_path, self.image_dir), [d['confidence'] for d in detections]))
+        if len(self._pending) >= SCORE_BATCH:
+            self._save_scores()
+        return False
+
+    def _write_done(self):
+        if self._pending:
+            self._save_scores()
+
+    def _save_scores(self):
+        names = [name for name, _ in self._pending]
+        scores = uncertainty_scores([confidences for _, confidences in self._pending], self.annotation_threshold)
+        self._pending = []
+        self.index.save_scores(self.model, [(name,) + tuple(float(v) for v in row) for name, row in zip(names, scores)])
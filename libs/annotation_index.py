@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Persistent SQLite index of every annotation in a save directory.
+
+Questions such as "which images contain class X" or "which are unverified"
+would otherwise mean opening every annotation file. AnnotationIndex parses
+the save directory once, keeps one row per annotated image and one per box
+in ``.redlabel_index.db``, and on later runs re-parses only the files whose
+mtime or size changed. Queries are a few space-separated terms, all of
+which must hold:
+
+    class:NAME   has a box labelled NAME
+    verified     is marked verified
+    unverified   is not marked verified
+    small:N      has a box narrower or lower than N pixels
+    empty        has an annotation file without boxes
+    unlabeled    has no annotation at all
+
+The index also keeps the uncertainty scores of the images scored for
+active learning, one per image and model (see libs.active_learning).
+"""
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from PyQt5.QtCore import QThread, pyqtSignal
+except ImportError:
+    from PyQt4.QtCore import QThread, pyqtSignal
+
+from libs.bulk_io import read_pascal_voc_files, read_yolo_dir, read_yolo_files
+from libs.create_ml_io import CreateMLStore, JSON_EXT
+from libs.image_info import get_image_info
+from libs.packed_io import PackedStore, image_key, packed_db_path
+from libs.pascal_voc_io import XML_EXT
+from libs.sharding import is_sharded
+from libs.yolo_io import TXT_EXT
+
+INDEX_FILENAME = '.redlabel_index.db'
+
+# Packed store rows are indexed under this pseudo path prefix.
+PACKED_PREFIX = 'packed:'
+
+# Image name of the row kept for an annotation file that could not be parsed.
+UNREADABLE_NAME = ''
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER,
+    size INTEGER,
+    verified INTEGER NOT NULL DEFAULT 0,
+    box_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE TABLE IF NOT EXISTS boxes (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    label TEXT NOT NULL,
+    width REAL,
+    height REAL
+);
+CREATE INDEX IF NOT EXISTS boxes_path ON boxes (path);
+CREATE INDEX IF NOT EXISTS boxes_label ON boxes (label);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS scores (
+    name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    score REAL NOT NULL,
+    entropy REAL,
+    least_confidence REAL,
+    disagreement REAL,
+    PRIMARY KEY (name, model)
+);
+"""
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _signature(*paths):
+    """mtime/size fingerprint of the given files; missing files count as absent."""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append('%d:%d' % (st.st_mtime_ns, st.st_size))
+        except OSError:
+            parts.append('-')
+    return ' '.join(parts)
+
+
+def _scan(save_dir, recursive):
+    """Map annotation file path -> (mtime_ns, size) for every label file."""
+    found = {}
+    pending = [save_dir]
+    while pending:
+        dir_path = pending.pop()
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                if recursive:
+                    pending.append(entry.path)
+                continue
+            if entry.name == 'classes.txt' or not entry.name.lower().endswith((XML_EXT, TXT_EXT, JSON_EXT)):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            found[entry.path] = (st.st_mtime_ns, st.st_size)
+    return found
+
+
+def _box_rows(path, name, boxes):
+    """boxes rows from (label, x_min, y_min, x_max, y_max) tuples; None coordinates stay NULL."""
+    return [(path, name, label,
+             x_max - x_min if x_max is not None else None,
+             y_max - y_min if y_max is not None else None)
+            for label, x_min, y_min, x_max, y_max in boxes]
+
+
+def parse_query(text):
+    """Turn a query string into a (where, params, unlabeled) triple."""
+    clauses = []
+    params = []
+    unlabeled = False
+    for term in text.split():
+        key, _, value = term.partition(':')
+        key = key.lower()
+        if key == 'class' and value:
+            clauses.append('EXISTS (SELECT 1 FROM boxes b WHERE b.path = f.path AND b.name = f.name '
+                           'AND b.label = ?)')
+            params.append(value)
+        elif key == 'verified' and not value:
+            clauses.append('f.verified = 1')
+        elif key == 'unverified' and not value:
+            clauses.append('f.verified = 0')
+        elif key == 'small' and value:
+            try:
+                params.append(float(value))
+            except ValueError:
+                raise QueryError('small: needs a size in pixels, got %r' % value)
+            clauses.append('EXISTS (SELECT 1 FROM boxes b WHERE b.path = f.path AND b.name = f.name '
+                           'AND min(b.width, b.height) < ?)')
+        elif key == 'empty' and not value:
+            clauses.append('f.box_count = 0')
+        elif key == 'unlabeled' and not value:
+            unlabeled = True
+        else:
+            raise QueryError('Unknown filter term: %s' % term)
+    return ' AND '.join(clauses) or '1', params, unlabeled
+
+
+class AnnotationIndex:
+    """The annotation index of one save directory.
+
+    Indexes are shared per directory. update() may run on a worker thread
+    while the GUI queries; it holds the lock only while writing a batch.
+    """
+
+    # Files parsed and committed per transaction.
+    BATCH_SIZE = 2000
+
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    @classmethod
+    def for_directory(cls, save_dir):
+        key = os.path.abspath(save_dir)
+        with cls._indexes_lock:
+            index = cls._indexes.get(key)
+            if index is None:
+                index = cls._indexes[key] = cls(key)
+            return index
+
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self.db_path = os.path.join(save_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        except sqlite3.OperationalError:
+            # Read-only save directory: keep the index for this session only.
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        if not any(pk for _, column, _, _, _, pk in self._conn.execute('PRAGMA table_info(scores)')
+                   if column == 'model'):
+            # Scores from before they were kept per model; they are computed again when needed.
+            self._conn.execute('DROP TABLE scores')
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        with AnnotationIndex._indexes_lock:
+            AnnotationIndex._indexes.pop(self.save_dir, None)
+
+    def _meta(self, key):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _replace(self, paths, files, boxes, meta=None):
+        """Replace every row of the given paths in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in paths])
+            self._conn.executemany('DELETE FROM boxes WHERE path = ?', [(p,) for p in paths])
+            self._conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', files)
+            self._conn.executemany('INSERT INTO boxes VALUES (?, ?, ?, ?, ?)', boxes)
+            for key, value in (meta or {}).items():
+                self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def update(self, image_paths=None, progress=None, cancelled=None):
+        """Bring the index up to date with the save directory.
+
+        image_paths lets YOLO boxes be measured in pixels; without a
+        matching image their size stays unknown. progress(done, total) is
+        called after each batch and cancelled() is polled between batches.
+        Returns the number of annotation files (re-)indexed.
+        """
+        images = {image_key(path): path for path in image_paths or ()}
+        current = _scan(self.save_dir, is_sharded(self.save_dir))
+        with self._lock:
+            stored = {path: (mtime_ns, size) for path, mtime_ns, size in self._conn.execute(
+                'SELECT DISTINCT path, mtime_ns, size FROM files WHERE path NOT LIKE ?', (PACKED_PREFIX + '%',))}
+            classes_signature = self._meta('classes')
+
+        # YOLO class ids mean nothing without classes.txt, so a new one invalidates every .txt.
+        classes_path = os.path.join(self.save_dir, 'classes.txt')
+        new_classes_signature = _signature(classes_path)
+        stale_txt = new_classes_signature != classes_signature
+        removed = [path for path in stored if path not in current]
+        changed = sorted(path for path, signature in current.items()
+                         if stored.get(path) != signature or (stale_txt and path.lower().endswith(TXT_EXT)))
+        if removed:
+            self._replace(removed, [], [])
+
+        total = len(changed) + 1
+        done = 0
+        for start in range(0, len(changed), self.BATCH_SIZE):
+            if cancelled is not None and cancelled():
+                return done
+            batch = changed[start:start + self.BATCH_SIZE]
+            files, boxes = [], []
+            xml_paths = [p for p in batch if p.lower().endswith(XML_EXT)]
+            txt_paths = [p for p in batch if p.lower().endswith(TXT_EXT)]
+            json_paths = [p for p in batch if p.lower().endswith(JSON_EXT)]
+            if xml_paths:
+                self._collect_bulk(read_pascal_voc_files(xml_paths), current, images, files, boxes)
+            if txt_paths:
+                self._collect_bulk(read_yolo_files(txt_paths, classes_path), current, images, files, boxes)
+            for path in json_paths:
+                self._collect_create_ml(path, current, files, boxes)
+            self._replace(batch, files, boxes)
+            done += len(batch)
+            if progress is not None:
+                progress(done, total)
+
+        self._update_packed(images)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('classes', new_classes_signature))
+        if progress is not None:
+            progress(total, total)
+        return done
+
+    def _collect_bulk(self, bulk, current, images, files, boxes):
+        labels = bulk.classes
+        for file_index, path in enumerate(bulk.files):
+            name = image_key(path)
+            start, end = int(bulk.offsets[file_index]), int(bulk.offsets[file_index + 1])
+            coords = bulk.boxes[start:end]
+            if bulk.normalized:
+                image_path = images.get(name)
+                info = None
+                if image_path is not None:
+                    info = get_image_info(image_path)
+                if info is None:
+                    coords = [(None, None, None, None)] * (end - start)
+                else:
+                    coords = bulk.pixel_boxes(file_index, info.height, info.width).tolist()
+            else:
+                coords = coords.tolist()
+            mtime_ns, size = current[path]
+            files.append((path, name, mtime_ns, size, int(bool(bulk.verified[file_index])), end - start))
+            boxes.extend(_box_rows(path, name, [(labels[class_id],) + tuple(box) for class_id, box
+                                                in zip(bulk.class_ids[start:end].tolist(), coords)]))
+
+    def _collect_create_ml(self, path, current, files, boxes):
+        mtime_ns, size = current[path]
+        try:
+            store = CreateMLStore.open(path)
+            records = [store.get(filename) for filename in store.images()]
+        except (OSError, ValueError):
+            # Not a CreateML file, e.g. COCO's instances.json: keep it as unreadable, without
+            # images, so it is not parsed again until it changes.
+            files.append((path, UNREADABLE_NAME, mtime_ns, size, 0, 0))
+            return
+        for record in records:
+            if record is None:
+                continue
+            name = image_key(record['image'])
+            rows = []
+            for annotation in record['annotations']:
+                c = annotation['coordinates']
+                rows.append((annotation['label'], 0, 0, c['width'], c['height']))
+            files.append((path, name, mtime_ns, size, int(bool(record.get('verified', False))), len(rows)))
+            boxes.extend(_box_rows(path, name, rows))
+
+    def _update_packed(self, images):
+        """Re-index the packed store of the save directory when it changed."""
+        db_path = packed_db_path(self.save_dir)
+        signature = _signature(db_path, db_path + '-wal')
+        with self._lock:
+            if signature == self._meta('packed'):
+                return
+            paths = [row[0] for row in self._conn.execute(
+                'SELECT DISTINCT path FROM files WHERE path LIKE ?', (PACKED_PREFIX + '%',))]
+        files, boxes = [], []
+        store = PackedStore.open_if_exists(self.save_dir)
+        for name in store.names() if store is not None else ():
+            record = store.get(name)
+            if record is None:
+                continue
+            shapes, verified = record
+            path = PACKED_PREFIX + name
+            paths.append(path)
+            files.append((path, name, None, None, int(verified), len(shapes)))
+            boxes.extend(_box_rows(path, name, [shape[:5] for shape in shapes]))
+        self._replace(paths, files, boxes, meta={'packed': signature})
+
+    def names(self, query=''):
+        """Names (image keys) of the annotated images matching query."""
+        where, params, _ = parse_query(query)
+        with self._lock:
+            return set(row[0] for row in self._conn.execute(
+                'SELECT DISTINCT f.name FROM files f WHERE f.name != ? AND ' + where, [UNREADABLE_NAME] + params))
+
+    def filter(self, image_paths, query):
+        """Sorted positions in image_paths of the images matching query."""
+        where, params, unlabeled = parse_query(query)
+        if unlabeled:
+            if where != '1':
+                return []
+            annotated = self.names()
+            return [i for i, path in enumerate(image_paths) if image_key(path) not in annotated]
+        matching = self.names(query)
+        return [i for i, path in enumerate(image_paths) if image_key(path) in matching]
+
+    def box_counts(self):
+        """Map every annotated image name to its number of boxes."""
+        with self._lock:
+            return dict(self._conn.execute('SELECT name, max(box_count) FROM files WHERE name != ? GROUP BY name',
+                                           (UNREADABLE_NAME,)))
+
+    def save_scores(self, model, rows):
+        """Store (name, score, entropy, least_confidence, disagreement) rows computed with model."""
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)',
+                                   [(name, model) + tuple(values) for name, *values in rows])
+
+    def scores(self, model):
+        """Map every image name scored with model to its uncertainty score."""
+        with self._lock:
+            return dict(self._conn.execute('SELECT name, score FROM scores WHERE model = ?', (model,)))
+
+    def scored_names(self, model):
+        """Names of the images scored with model."""
+        with self._lock:
+            return set(row[0] for row in self._conn.execute('SELECT name FROM scores WHERE model = ?', (model,)))
+
+    def labels(self):
+        """Every label in the index with its box count, most common first."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT label, count(*) FROM boxes GROUP BY label ORDER BY count(*) DESC').fetchall()
+
+
+class AnnotationIndexWorker(QThread):
+    """Runs AnnotationIndex.update() in the background."""
+
+    progress_updated = pyqtSignal(int, int)  # done, total
+    indexing_finished = pyqtSignal(int)  # files re-indexed
+    indexing_failed = pyqtSignal(str)
+
+    def __init__(self, index, image_paths=None, parent=None):
+        super(AnnotationIndexWorker, self).__init__(parent)
+        self.index = index
+        self.image_paths = list(image_paths or ())
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            count = self.index.update(self.image_paths, progress=self.progress_updated.emit,
+                                      cancelled=lambda: self._cancelled)
+        except Exception as e:
+            # An exception escaping run() would abort the application.
+            self.indexing_failed.emit(str(e))
+            return
+        self.indexing_finished.emit(count)
+
+
+class LabelCacheWorker(QThread):
+    """Reads every YOLO label file of a save directory in one bulk pass, in the background."""
+
+    cache_ready = pyqtSignal(object, float)  # BulkAnnotations, time the read started
+
+    def __init__(self, save_dir, parent=None):
+        super(LabelCacheWorker, self).__init__(parent)
+        self.save_dir = save_dir
+
+    def run(self):
+        started = time.time()
+        try:
+            cache = read_yolo_dir(self.save_dir, recursive=is_sharded(self.save_dir))
+        except (OSError, ValueError):
+            return
+        self.cache_ready.emit(cache, started)
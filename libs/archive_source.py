@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Images inside zip and tar archives, read in place.
+
+Opening an archive builds an index of its members once: where each
+member's data starts, its size and how it is compressed. The index is
+stored under ~/.redlabelArchives and reused while the archive keeps its
+mtime and size, so reopening a large tar does not walk its headers again.
+A member is then read with one seek and one read, plus an inflate for
+deflated zip members; nothing is ever extracted to disk.
+
+Members are addressed by virtual paths (see libs.storage), the archive
+path joined with the member name, e.g. ``/data/set.zip/train/img_001.jpg``.
+"""
+import hashlib
+import json
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+
+from libs.constants import DEFAULT_ENCODING
+from libs.storage import ImageSource, register_source, source_at
+
+ARCHIVE_EXTS = ('.zip', '.tar')
+
+# Bumped when the layout of the stored index changes.
+INDEX_VERSION = 1
+
+
+def default_index_dir():
+    return os.path.join(os.path.expanduser("~"), '.redlabelArchives')
+
+
+def is_archive(path):
+    """True if path is a zip or uncompressed tar file."""
+    return bool(path) and path.lower().endswith(ARCHIVE_EXTS) and os.path.isfile(path)
+
+
+def _zip_members(path):
+    """[name, data offset, stored size, size, method, crc] of the readable files of a zip."""
+    members = []
+    with open(path, 'rb') as f, zipfile.ZipFile(f) as archive:
+        for info in archive.infolist():
+            # Encrypted members and other compression methods are left out.
+            if info.is_dir() or info.flag_bits & 0x1 or \
+                    info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                continue
+            # The data follows the local header, whose extra field may differ from the central one.
+            f.seek(info.header_offset)
+            header = f.read(30)
+            if len(header) < 30 or header[:4] != b'PK\x03\x04':
+                continue
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            members.append([info.filename, info.header_offset + 30 + name_length + extra_length,
+                            info.compress_size, info.file_size, info.compress_type, info.CRC])
+    return members
+
+
+def _tar_members(path):
+    """Like _zip_members() for an uncompressed tar; compressed tars cannot be read by offset."""
+    members = []
+    with tarfile.open(path, 'r:') as archive:
+        for info in archive:
+            if info.isfile() and not info.issparse():
+                members.append([info.name, info.offset_data, info.size, info.size, zipfile.ZIP_STORED, None])
+    return members
+
+
+class Archive(ImageSource):
+    """The member index of one zip or tar archive, and reads of its members."""
+
+    def __init__(self, path, index_dir=None):
+        self.path = self.root = os.path.abspath(path)
+        st = os.stat(self.path)
+        self.mtime_ns, self.size = st.st_mtime_ns, st.st_size
+        digest = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        self.index_path = os.path.join(index_dir or default_index_dir(), digest + '.json')
+        members = self._load_index()
+        if members is None:
+            members = _zip_members(self.path) if self.path.lower().endswith('.zip') else _tar_members(self.path)
+            self._save_index(members)
+        self._members = dict((member[0], tuple(member[1:])) for member in members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, name):
+        return name in self._members
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding=DEFAULT_ENCODING) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('version') != INDEX_VERSION or saved.get('path') != self.path or \
+                saved.get('mtime_ns') != self.mtime_ns or saved.get('size') != self.size:
+            return None
+        return saved.get('members')
+
+    def _save_index(self, members):
+        data = {'version': INDEX_VERSION, 'path': self.path, 'mtime_ns': self.mtime_ns,
+                'size': self.size, 'members': members}
+        tmp_path = self.index_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp_path, 'w', encoding=DEFAULT_ENCODING) as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def names(self):
+        """Names of the member files, in archive order."""
+        return list(self._members)
+
+    def stat(self, name):
+        """(mtime_ns, size) of a member; the archive's mtime stands in for the member's."""
+        return self.mtime_ns, self._members[name][2]
+
+    def read(self, name):
+        """The bytes of a member; raises KeyError if it does not exist and OSError if it is damaged."""
+        offset, stored_size, size, method, crc = self._members[name]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(stored_size)
+        if len(data) != stored_size:
+            raise OSError('%s: member %s is truncated' % (self.path, name))
+        if method == zipfile.ZIP_DEFLATED:
+            try:
+                data = zlib.decompress(data, -15)
+            except zlib.error as e:
+                raise OSError('%s: member %s: %s' % (self.path, name, e))
+        if len(data) != size or (crc is not None and zlib.crc32(data) != crc):
+            raise OSError('%s: member %s is corrupt' % (self.path, name))
+        return data
+
+    def default_save_dir(self):
+        """<archive name>_annotations next to the archive."""
+        return os.path.splitext(self.path)[0] + '_annotations'
+
+
+_archives_lock = threading.Lock()
+
+
+def get_archive(path, index_dir=None):
+    """The Archive at path, indexed on first use and again whenever the file changes.
+
+    The archive is registered with libs.storage, so its member paths can be
+    read like files. Raises OSError, or the zipfile/tarfile errors for files
+    that are not readable archives.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    with _archives_lock:
+        archive = source_at(path)
+        if not isinstance(archive, Archive) or (archive.mtime_ns, archive.size) != (st.st_mtime_ns, st.st_size):
+            archive = Archive(path, index_dir)
+            register_source(archive)
+        return archive
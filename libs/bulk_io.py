@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Bulk annotation readers for dataset-scale tooling.
+
+The per-file readers in pascal_voc_io / yolo_io build a list of shape tuples
+for a single image, which is what the canvas needs but far too slow when a
+tool has to look at a whole dataset. The readers in this module walk a
+directory once and return every box in flat, columnar NumPy arrays.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from lxml import etree
+
+from libs.pascal_voc_io import XML_EXT
+from libs.yolo_io import TXT_EXT
+
+# Below this many files a process pool costs more than it saves.
+MIN_FILES_PER_WORKER = 256
+
+
+class BulkAnnotations:
+    """Boxes of many annotation files stored column by column.
+
+    Box ``i`` belongs to ``files[file_ids[i]]`` and has class
+    ``classes[class_ids[i]]``. The boxes of file ``j`` occupy the slice
+    ``offsets[j]:offsets[j + 1]`` of every per-box column. ``sizes`` holds
+    the (height, width, depth) recorded in each file, or zeros when the
+    format does not record it.
+    """
+
+    def __init__(self, files, classes, offsets, class_ids, boxes, difficult, verified, errors=None,
+                 normalized=False, sizes=None):
+        self.files = files
+        self.classes = classes
+        self.offsets = offsets
+        self.class_ids = class_ids
+        self.boxes = boxes
+        self.difficult = difficult
+        self.verified = verified
+        self.errors = errors or []
+        # YOLO loads keep boxes as fractions of the image size.
+        self.normalized = normalized
+        self.sizes = sizes if sizes is not None else np.zeros((len(files), 3), dtype=np.int32)
+        self.file_ids = np.repeat(np.arange(len(files), dtype=np.int32), np.diff(offsets))
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    @property
+    def box_verified(self):
+        """Per-box copy of the per-file verified flag."""
+        return self.verified[self.file_ids]
+
+    def index_of(self, file_path):
+        """Return the position of file_path in files, or -1."""
+        if not hasattr(self, '_file_index'):
+            self._file_index = {os.path.abspath(path): i for i, path in enumerate(self.files)}
+        return self._file_index.get(os.path.abspath(file_path), -1)
+
+    def to_pixels(self, dims):
+        """Convert normalized boxes to pixels for every file in one step.
+
+        dims is an (n_files, 2) array of (height, width) rows in file order.
+        """
+        dims = np.asarray(dims, dtype=np.float64)
+        return normalized_to_pixels(self.boxes, dims[self.file_ids, 0], dims[self.file_ids, 1])
+
+    def pixel_boxes(self, file_index, height, width):
+        """Convert the normalized boxes of a single file to pixels."""
+        start, end = self.offsets[file_index], self.offsets[file_index + 1]
+        return normalized_to_pixels(self.boxes[start:end], height, width)
+
+    def get_shapes(self, file_index, boxes=None):
+        """Return the boxes of one file in the reader shape tuple format.
+
+        ``boxes`` may be given to substitute converted coordinates for the
+        file's rows, e.g. the result of pixel_boxes().
+        """
+        start, end = self.offsets[file_index], self.offsets[file_index + 1]
+        if boxes is None:
+            boxes = self.boxes[start:end]
+        shapes = []
+        for class_id, (x_min, y_min, x_max, y_max), difficult in zip(
+                self.class_ids[start:end].tolist(), boxes.tolist(),
+                self.difficult[start:end].tolist()):
+            points = [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)]
+            shapes.append((self.classes[class_id], points, None, None, difficult))
+        return shapes
+
+
+def list_annotation_files(dir_path, ext, recursive=True):
+    """Return the sorted paths of all files under dir_path ending with ext."""
+    paths = []
+    if recursive:
+        for root, dirs, files in os.walk(dir_path):
+            paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(ext))
+    else:
+        with os.scandir(dir_path) as entries:
+            paths.extend(e.path for e in entries if e.name.lower().endswith(ext) and e.is_file())
+    paths.sort()
+    return paths
+
+
+_VOC_PARSER = etree.XMLParser(remove_blank_text=True)
+_VOC_COLUMNS = [etree.XPath(expr, smart_strings=False) for expr in (
+    'object/name/text()',
+    'object/bndbox/xmin/text()',
+    'object/bndbox/ymin/text()',
+    'object/bndbox/xmax/text()',
+    'object/bndbox/ymax/text()')]
+_VOC_DIFFICULT = etree.XPath('object/difficult/text()', smart_strings=False)
+
+
+def _parse_voc_objects(root):
+    """Per-object fallback for files where some object lacks a field."""
+    names = []
+    difficult = []
+    coords = []
+    for object_iter in root.iterchildren('object'):
+        bnd_box = object_iter.find('bndbox')
+        coords.extend((bnd_box.findtext('xmin'), bnd_box.findtext('ymin'),
+                       bnd_box.findtext('xmax'), bnd_box.findtext('ymax')))
+        names.append(object_iter.findtext('name'))
+        difficult.append(object_iter.findtext('difficult', '0'))
+    return names, difficult, coords
+
+
+def _voc_size(size):
+    """[height, width, depth] of a VOC <size> element, zeros if it is missing."""
+    try:
+        return [int(float(size.findtext(tag))) for tag in ('height', 'width', 'depth')]
+    except (AttributeError, TypeError, ValueError):
+        return [0, 0, 0]
+
+
+def _parse_voc_file(path):
+    """Parse one VOC file into (verified, size, names, difficult, coords).
+
+    Coordinates and difficult flags are returned as the raw strings; they are
+    converted in one vectorized step once all files are read.
+    """
+    root = etree.parse(path, _VOC_PARSER).getroot()
+    verified = root.get('verified') == 'yes'
+    size = _voc_size(root.find('size'))
+    names, x_min, y_min, x_max, y_max = [column(root) for column in _VOC_COLUMNS]
+    difficult = _VOC_DIFFICULT(root)
+    n = len(names)
+    if not (len(x_min) == len(y_min) == len(x_max) == len(y_max) == len(difficult) == n):
+        return (verified, size) + _parse_voc_objects(root)
+    coords = [None] * (4 * n)
+    coords[0::4] = x_min
+    coords[1::4] = y_min
+    coords[2::4] = x_max
+    coords[3::4] = y_max
+    return verified, size, names, difficult, coords
+
+
+def _parse_voc_chunk(paths):
+    """Parse a list of VOC files, flattening the results to keep pickling cheap."""
+    verified = []
+    sizes = []
+    counts = []
+    names = []
+    difficult = []
+    coords = []
+    errors = []
+    for path in paths:
+        try:
+            file_verified, file_size, file_names, file_difficult, file_coords = _parse_voc_file(path)
+        except Exception as e:
+            errors.append((path, str(e)))
+            file_verified, file_size, file_names, file_difficult, file_coords = False, [0, 0, 0], [], [], []
+        verified.append(file_verified)
+        sizes.extend(file_size)
+        counts.append(len(file_names))
+        names.extend(file_names)
+        difficult.extend(file_difficult)
+        coords.extend(file_coords)
+    return verified, sizes, counts, names, difficult, coords, errors
+
+
+def _chunks(items, n_chunks):
+    size = max(1, -(-len(items) // n_chunks))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def read_pascal_voc_dir(dir_path, class_list=None, workers=None, recursive=True):
+    """Read every Pascal VOC file under dir_path into a BulkAnnotations.
+
+    Classes are numbered in the order of class_list, with names not in it
+    appended as they are met. Files are parsed in a process pool of
+    ``workers`` processes (default: one per CPU); unreadable files are
+    reported in ``errors`` and contribute no boxes. Coordinates are kept as
+    written in the file, without PascalVocReader's truncation to int.
+    """
+    paths = list_annotation_files(dir_path, XML_EXT, recursive)
+    return read_pascal_voc_files(paths, class_list, workers)
+
+
+def read_pascal_voc_files(paths, class_list=None, workers=None):
+    """Read the given Pascal VOC files into a BulkAnnotations."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(paths) // MIN_FILES_PER_WORKER))
+
+    if workers > 1:
+        # Several chunks per worker so one slow disk region does not stall the pool.
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_parse_voc_chunk, _chunks(paths, workers * 4)))
+    else:
+        results = [_parse_voc_chunk(paths)]
+
+    classes = list(class_list) if class_list else []
+    class_index = {name: i for i, name in enumerate(classes)}
+    verified = []
+    sizes = []
+    counts = []
+    class_ids = []
+    difficult = []
+    coords = []
+    errors = []
+    for chunk_verified, chunk_sizes, chunk_counts, chunk_names, chunk_difficult, chunk_coords, chunk_errors \
+            in results:
+        verified.extend(chunk_verified)
+        sizes.extend(chunk_sizes)
+        counts.extend(chunk_counts)
+        for name in chunk_names:
+            class_id = class_index.get(name)
+            if class_id is None:
+                class_id = class_index[name] = len(classes)
+                classes.append(name)
+            class_ids.append(class_id)
+        difficult.extend(chunk_difficult)
+        coords.extend(chunk_coords)
+        errors.extend(chunk_errors)
+
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return BulkAnnotations(
+        files=list(paths),
+        classes=classes,
+        offsets=offsets,
+        class_ids=np.asarray(class_ids, dtype=np.int32),
+        boxes=np.asarray(coords, dtype=np.float64).reshape(-1, 4),
+        difficult=np.asarray(difficult, dtype=np.float64).astype(bool),
+        verified=np.asarray(verified, dtype=bool),
+        errors=errors,
+        sizes=np.asarray(sizes, dtype=np.int32).reshape(-1, 3))
+
+
+def read_classes_file(classes_path):
+    """Read a YOLO classes.txt, skipping blank lines."""
+    with open(classes_path, 'r') as classes_file:
+        return [cls for cls in classes_file.read().strip('\n').split('\n') if cls.strip()]
+
+
+def normalized_to_pixels(boxes, heights, widths):
+    """Scale normalized xmin..ymax boxes to rounded pixel coordinates.
+
+    heights and widths are scalars or per-box arrays. Rounding matches
+    YoloReader, which uses Python's round-half-to-even.
+    """
+    heights = np.asarray(heights, dtype=np.float64)
+    widths = np.asarray(widths, dtype=np.float64)
+    scale = np.stack(np.broadcast_arrays(widths, heights, widths, heights), axis=-1)
+    return np.round(boxes * scale)
+
+
+def read_yolo_dir(dir_path, classes_path=None, recursive=True):
+    """Read every YOLO label file under dir_path into a BulkAnnotations.
+
+    classes.txt is read once, from classes_path or dir_path. Boxes are
+    stored as normalized xmin..ymax clipped to [0, 1], the same geometry
+    YoloReader produces before scaling; use to_pixels() or pixel_boxes() to
+    scale them. Files with malformed lines or unknown class indices are
+    listed in ``errors``.
+    """
+    if classes_path is None:
+        classes_path = os.path.join(dir_path, 'classes.txt')
+    paths = [path for path in list_annotation_files(dir_path, TXT_EXT, recursive)
+             if os.path.basename(path) != 'classes.txt']
+    return read_yolo_files(paths, classes_path)
+
+
+def read_yolo_files(paths, classes_path):
+    """Read the given YOLO label files into a BulkAnnotations."""
+    try:
+        classes = read_classes_file(classes_path)
+    except (OSError, UnicodeDecodeError):
+        classes = []
+
+    errors = []
+    counts = []
+    tokens = []
+    for path in paths:
+        try:
+            with open(path, 'r') as bnd_box_file:
+                file_tokens = bnd_box_file.read().split()
+        except (OSError, UnicodeDecodeError) as e:
+            errors.append((path, str(e)))
+            file_tokens = []
+        if len(file_tokens) % 5:
+            errors.append((path, 'expected 5 values per line'))
+            file_tokens = []
+        counts.append(len(file_tokens) // 5)
+        tokens.extend(file_tokens)
+
+    try:
+        rows = np.array(tokens, dtype=np.float64).reshape(-1, 5)
+    except ValueError:
+        # Rare: some file holds a non-numeric token. Convert per file to
+        # find it, then drop that file's rows.
+        rows, counts = _convert_yolo_rows_per_file(paths, counts, tokens, errors)
+
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    class_ids = rows[:, 0].astype(np.int32)
+    if len(class_ids) and class_ids.max() >= len(classes):
+        file_ids = np.repeat(np.arange(len(paths)), counts)
+        for file_id in np.unique(file_ids[class_ids >= len(classes)]):
+            errors.append((paths[file_id], 'class index not found in %s' % classes_path))
+        classes = classes + ['unknown_class_%d' % i for i in range(len(classes), class_ids.max() + 1)]
+
+    x_center, y_center, w, h = rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4]
+    boxes = np.empty((len(rows), 4), dtype=np.float64)
+    boxes[:, 0] = np.maximum(x_center - w / 2, 0)
+    boxes[:, 1] = np.maximum(y_center - h / 2, 0)
+    boxes[:, 2] = np.minimum(x_center + w / 2, 1)
+    boxes[:, 3] = np.minimum(y_center + h / 2, 1)
+
+    return BulkAnnotations(
+        files=list(paths),
+        classes=classes,
+        offsets=offsets,
+        class_ids=class_ids,
+        boxes=boxes,
+        difficult=np.zeros(len(rows), dtype=bool),
+        verified=np.zeros(len(paths), dtype=bool),
+        errors=errors,
+        normalized=True)
+
+
+def _convert_yolo_rows_per_file(paths, counts, tokens, errors):
+    converted = []
+    new_counts = []
+    start = 0
+    for path, count in zip(paths, counts):
+        end = start + count * 5
+        try:
+            converted.append(np.array(tokens[start:end], dtype=np.float64))
+            new_counts.append(count)
+        except ValueError as e:
+            errors.append((path, str(e)))
+            new_counts.append(0)
+        start = end
+    rows = np.concatenate(converted) if converted else np.empty(0, dtype=np.float64)
+    return rows.reshape(-1, 5), new_counts
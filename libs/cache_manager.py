@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+One memory budget for every in-memory cache of decoded image data.
+
+Each cache registers with the CacheManager under a name and a priority.
+The manager keeps the sum of all caches under a global byte budget: when
+an insertion pushes it over, the least recently used entries of the
+lowest-priority cache go first. Every cache counts hits, misses and
+evictions so the debug panel can show where the memory goes.
+"""
+import threading
+from collections import OrderedDict
+
+from libs.storage import image_stat
+
+DEFAULT_BUDGET = 1024 * 1024 * 1024
+
+# Suggested priorities; higher priorities are evicted last.
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 50
+PRIORITY_HIGH = 100
+
+
+def file_key(path):
+    """Cache key for the current contents of a file or archive member: (path, mtime, size), or None if it is missing."""
+    try:
+        mtime_ns, size = image_stat(path)
+    except OSError:
+        return None
+    return path, mtime_ns, size
+
+
+def sizeof(value):
+    """Approximate number of bytes held by a cached value."""
+    for attr in ('sizeInBytes', 'byteCount'):  # QImage (Qt >= 5.10, older Qt)
+        method = getattr(value, attr, None)
+        if method is not None:
+            return int(method())
+    if hasattr(value, 'depth') and hasattr(value, 'width'):  # QPixmap
+        return value.width() * value.height() * max(value.depth(), 8) // 8
+    if hasattr(value, 'nbytes'):  # numpy arrays
+        return int(value.nbytes)
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+
+class ManagedCache:
+    """An LRU mapping whose memory is accounted for by a CacheManager.
+
+    Pinned keys are never evicted; use them for the data on screen.
+    """
+
+    def __init__(self, manager, name, priority=PRIORITY_NORMAL, max_bytes=None):
+        self.manager = manager
+        self.name = name
+        self.priority = priority
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._pinned = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self.manager.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes=None, pin=False):
+        """Store value under key, evicting from this and other caches as needed."""
+        if nbytes is None:
+            nbytes = sizeof(value)
+        with self.manager.lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+                self.manager.total_bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.bytes += nbytes
+            self.manager.total_bytes += nbytes
+            if pin:
+                self._pinned.add(key)
+            if self.max_bytes is not None:
+                while self.bytes > self.max_bytes and self._evict_one(keep=key):
+                    pass
+            self.manager._make_room(keep=(self, key))
+
+    def pop(self, key, default=None):
+        with self.manager.lock:
+            self._pinned.discard(key)
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.bytes -= entry[1]
+            self.manager.total_bytes -= entry[1]
+            return entry[0]
+
+    def pin(self, key):
+        with self.manager.lock:
+            if key in self._entries:
+                self._pinned.add(key)
+
+    def unpin(self, key=None):
+        """Allow key (every key if None) to be evicted again."""
+        with self.manager.lock:
+            if key is None:
+                self._pinned.clear()
+            else:
+                self._pinned.discard(key)
+            self.manager._make_room()
+
+    def clear(self):
+        with self.manager.lock:
+            self.manager.total_bytes -= self.bytes
+            self._entries.clear()
+            self._pinned.clear()
+            self.bytes = 0
+
+    def _evict_one(self, keep=None):
+        """Drop the least recently used unpinned entry; False if there is none."""
+        for key in self._entries:
+            if key not in self._pinned and key != keep:
+                _, nbytes = self._entries.pop(key)
+                self.bytes -= nbytes
+                self.manager.total_bytes -= nbytes
+                self.evictions += 1
+                return True
+        return False
+
+    def stats(self):
+        return {'name': self.name, 'priority': self.priority, 'entries': len(self._entries),
+                'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class CacheManager:
+    """Registry of ManagedCaches sharing one byte budget."""
+
+    _instance = None
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.total_bytes = 0
+        self.lock = threading.RLock()
+        self._caches = OrderedDict()
+
+    @classmethod
+    def instance(cls):
+        """The application-wide manager."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def register(self, name, priority=PRIORITY_NORMAL, max_bytes=None):
+        """Return the cache called name, creating it on first use."""
+        with self.lock:
+            cache = self._caches.get(name)
+            if cache is None:
+                cache = self._caches[name] = ManagedCache(self, name, priority, max_bytes)
+            return cache
+
+    def caches(self):
+        return list(self._caches.values())
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._make_room()
+
+    def _make_room(self, keep=None):
+        """Evict until the total fits the budget, lowest priority first."""
+        if self.total_bytes <= self.budget:
+            return
+        keep_cache, keep_key = keep if keep is not None else (None, None)
+        for cache in sorted(self._caches.values(), key=lambda c: c.priority):
+            while self.total_bytes > self.budget and \
+                    cache._evict_one(keep=keep_key if cache is keep_cache else None):
+                pass
+            if self.total_bytes <= self.budget:
+                return
+
+    def stats(self):
+        """Per-cache statistics, highest priority first."""
+        with self.lock:
+            return [cache.stats() for cache in sorted(self._caches.values(), key=lambda c: -c.priority)]
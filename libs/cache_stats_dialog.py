@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Debug panel showing the memory use and hit rates of the managed caches.
+"""
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import *
+except ImportError:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+MB = 1024 * 1024
+
+COLUMNS = ('Cache', 'Priority', 'Entries', 'Size (MB)', 'Hits', 'Misses', 'Hit rate', 'Evictions')
+
+
+class CacheStatsDialog(QDialog):
+    """Table of CacheManager statistics, refreshed every second while shown."""
+
+    budget_changed = pyqtSignal(int)  # new budget in bytes
+
+    def __init__(self, manager, parent=None):
+        super(CacheStatsDialog, self).__init__(parent)
+        self.manager = manager
+        self.setWindowTitle('Cache Statistics')
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        self.total_label = QLabel()
+        self.budget_spin = QSpinBox()
+        self.budget_spin.setRange(64, 1024 * 1024)
+        self.budget_spin.setSingleStep(256)
+        self.budget_spin.setSuffix(' MB')
+        self.budget_spin.setValue(manager.budget // MB)
+        self.budget_spin.editingFinished.connect(self._on_budget_edited)
+
+        budget_layout = QHBoxLayout()
+        budget_layout.addWidget(QLabel('Budget'))
+        budget_layout.addWidget(self.budget_spin)
+        budget_layout.addStretch()
+        budget_layout.addWidget(self.total_label)
+
+        layout = QVBoxLayout()
+        layout.addLayout(budget_layout)
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+        self.resize(640, 240)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(1000)
+        self._timer.timeout.connect(self.refresh)
+
+    def _on_budget_edited(self):
+        budget = self.budget_spin.value() * MB
+        if budget != self.manager.budget:
+            self.manager.set_budget(budget)
+            self.budget_changed.emit(budget)
+            self.refresh()
+
+    def refresh(self):
+        stats = self.manager.stats()
+        self.table.setRowCount(len(stats))
+        for row, entry in enumerate(stats):
+            lookups = entry['hits'] + entry['misses']
+            values = (entry['name'], entry['priority'], entry['entries'], '%.1f' % (entry['bytes'] / MB),
+                      entry['hits'], entry['misses'],
+                      '%.0f%%' % (100.0 * entry['hits'] / lookups) if lookups else '-', entry['evictions'])
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(str(value)))
+        self.total_label.setText('Used %.1f of %d MB' % (self.manager.total_bytes / MB, self.manager.budget // MB))
+
+    def showEvent(self, event):
+        self.refresh()
+        self._timer.start()
+        super(CacheStatsDialog, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self._timer.stop()
+        super(CacheStatsDialog, self).hideEvent(event)
@@ -50,7 +50,8 @@ class Canvas(QWidget):
         self.scale = 1.0
         self.overlay_color = None
         self.label_font_size = 8
-        self.pixmap = QPixmap()
+        # The image on display; a QImage, so the decoded image is held only once.
+        self.pixmap = QImage()
         self.visible = {}
         self._hide_background = False
         self.hide_background = False
@@ -507,13 +508,19 @@ class Canvas(QWidget):
 
         temp = self.pixmap
         if self.overlay_color:
-            temp = QPixmap(self.pixmap)
+            if isinstance(temp, QImage):
+                temp = temp.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+            else:
+                temp = QPixmap(self.pixmap)
             painter = QPainter(temp)
             painter.setCompositionMode(painter.CompositionMode_Overlay)
             painter.fillRect(temp.rect(), self.overlay_color)
             painter.end()
 
-        p.drawPixmap(0, 0, temp)
+        if isinstance(temp, QImage):
+            p.drawImage(0, 0, temp)
+        else:
+            p.drawPixmap(0, 0, temp)
         Shape.scale = self.scale
         Shape.label_font_size = self.label_font_size
         for shape in self.shapes:
@@ -710,6 +717,10 @@ class Canvas(QWidget):
         self.shapes = []
         self.repaint()
 
+    def load_image(self, image):
+        """Show a QImage without converting it to a QPixmap copy."""
+        self.load_pixmap(image)
+
     def load_shapes(self, shapes):
         self.shapes = list(shapes)
         self.current = None
@@ -15,7 +15,14 @@ SETTING_SINGLE_CLASS = 'singleclass'
 FORMAT_PASCALVOC='PascalVOC'
 FORMAT_YOLO='YOLO'
 FORMAT_CREATEML='CreateML'
+FORMAT_PACKED='Packed'
 SETTING_DRAW_SQUARE = 'draw/square'
 SETTING_LABEL_FILE_FORMAT= 'labelFileFormat'
 SETTING_YOLO_MODEL_PATH = 'yolo/model_path'
+SETTING_YOLO_TILE_SIZE = 'yolo/tile_size'
+SETTING_YOLO_TILE_OVERLAP = 'yolo/tile_overlap'
+SETTING_YOLO_BACKEND = 'yolo/backend'
+SETTING_ORDER_BY_UNCERTAINTY = 'orderByUncertainty'
+SETTING_CACHE_BUDGET = 'cache/budget'
+SETTING_WORK_QUEUE_URL = 'workQueue/url'
 DEFAULT_ENCODING = 'utf-8'
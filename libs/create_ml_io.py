@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
+import atexit
 import json
-from pathlib import Path
+import threading
+import time
+from collections import OrderedDict
 
 from libs.constants import DEFAULT_ENCODING
 import os
@@ -10,6 +13,159 @@ JSON_EXT = '.json'
 ENCODE_METHOD = DEFAULT_ENCODING
 
 
+def _check_record(record, json_path):
+    """Raise ValueError unless record is a CreateML image record."""
+    if not isinstance(record, dict) or not isinstance(record.get('image'), str) or \
+            not isinstance(record.get('annotations'), list):
+        raise ValueError('%s is not a CreateML file: expected image and annotations in every entry'
+                         % json_path)
+    for annotation in record['annotations']:
+        coordinates = annotation.get('coordinates') if isinstance(annotation, dict) else None
+        if not isinstance(coordinates, dict) or 'label' not in annotation or \
+                not all(isinstance(coordinates.get(key), (int, float)) for key in ('x', 'y', 'width', 'height')):
+            raise ValueError('%s is not a CreateML file: malformed annotation of %s'
+                             % (json_path, record['image']))
+
+
+class CreateMLStore:
+    """In-memory image -> record index of one CreateML JSON file.
+
+    The file is parsed once; reads are served from memory and writes are
+    collected and written back in batches. Only changed records are
+    re-encoded, and the file is replaced atomically. If another program
+    modifies the file (its mtime or size changes) it is re-read before the
+    next access, with pending local changes applied on top.
+    """
+
+    # Clean stores kept open beyond this count are dropped, oldest first.
+    MAX_OPEN_STORES = 64
+    _stores = OrderedDict()
+    _stores_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, json_path):
+        """Return the shared store for json_path, loading it if needed."""
+        key = os.path.abspath(json_path)
+        with cls._stores_lock:
+            store = cls._stores.get(key)
+            if store is None:
+                store = cls._stores[key] = cls(key)
+            cls._stores.move_to_end(key)
+            if len(cls._stores) > cls.MAX_OPEN_STORES:
+                for other_key, other in list(cls._stores.items()):
+                    if len(cls._stores) <= cls.MAX_OPEN_STORES:
+                        break
+                    if other is not store and not other.dirty:
+                        del cls._stores[other_key]
+            return store
+
+    @classmethod
+    def flush_all(cls):
+        """Write back pending changes of every open store."""
+        with cls._stores_lock:
+            stores = list(cls._stores.values())
+        for store in stores:
+            store.flush()
+
+    def __init__(self, json_path, batch_size=32, max_delay=5.0):
+        self.json_path = json_path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._records = OrderedDict()
+        self._encoded = {}
+        self._pending = set()
+        self._first_pending_time = None
+        self._stat = None
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def dirty(self):
+        return bool(self._pending)
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.json_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self):
+        stat = self._file_stat()
+        records = OrderedDict()
+        if stat is not None:
+            with open(self.json_path, 'r', encoding=ENCODE_METHOD) as file:
+                data = json.loads(file.read())
+            if not isinstance(data, list):
+                raise ValueError('%s is not a CreateML file: expected a list of images' % self.json_path)
+            for record in data:
+                _check_record(record, self.json_path)
+                # Keep the first entry of an image, like the old linear search did.
+                records.setdefault(record['image'], record)
+        pending = {image: self._records[image] for image in self._pending}
+        self._records = records
+        self._encoded = {}
+        self._records.update(pending)
+        self._stat = stat
+
+    def _reload_if_modified(self):
+        if self._file_stat() != self._stat:
+            self._load()
+
+    def images(self):
+        with self._lock:
+            self._reload_if_modified()
+            return list(self._records)
+
+    def get(self, image):
+        """Return the record of image, or None."""
+        with self._lock:
+            self._reload_if_modified()
+            return self._records.get(image)
+
+    def put(self, record, flush=False):
+        """Insert or replace the record of record['image'].
+
+        The file is written when ``flush`` is set, when it does not exist yet
+        (so callers probing for it find it), once batch_size records are
+        pending, or when the oldest pending record is max_delay seconds old.
+        """
+        with self._lock:
+            self._reload_if_modified()
+            image = record['image']
+            self._records[image] = record
+            self._encoded.pop(image, None)
+            if not self._pending:
+                self._first_pending_time = time.time()
+            self._pending.add(image)
+            if flush or self._stat is None or len(self._pending) >= self.batch_size or \
+                    time.time() - self._first_pending_time >= self.max_delay:
+                self.flush()
+
+    def flush(self):
+        """Atomically write the records back if any are pending."""
+        with self._lock:
+            if not self._pending:
+                return
+            self._reload_if_modified()
+            encoded = self._encoded
+            for image, record in self._records.items():
+                if image not in encoded:
+                    encoded[image] = json.dumps(record)
+            # Same bytes json.dumps would produce for the whole list.
+            data = '[' + ', '.join(encoded[image] for image in self._records) + ']'
+            tmp_path = self.json_path + '.tmp'
+            with open(tmp_path, 'w', encoding=ENCODE_METHOD) as file:
+                file.write(data)
+            os.replace(tmp_path, self.json_path)
+            self._stat = self._file_stat()
+            self._pending.clear()
+            self._first_pending_time = None
+
+
+atexit.register(CreateMLStore.flush_all)
+
+
 class CreateMLWriter:
     def __init__(self, folder_name, filename, img_size, shapes, output_file, database_src='Unknown', local_img_path=None):
         self.folder_name = folder_name
@@ -22,14 +178,8 @@ class CreateMLWriter:
         self.shapes = shapes
         self.output_file = output_file
 
-    def write(self):
-        if os.path.isfile(self.output_file):
-            with open(self.output_file, "r") as file:
-                input_data = file.read()
-                output_dict = json.loads(input_data)
-        else:
-            output_dict = []
-
+    def write(self, flush=True):
+        """Store this image's record; with flush=False the write may be batched."""
         output_image_dict = {
             "image": self.filename,
             "verified": self.verified,
@@ -57,18 +207,7 @@ class CreateMLWriter:
             }
             output_image_dict["annotations"].append(shape_dict)
 
-        # check if image already in output
-        exists = False
-        for i in range(0, len(output_dict)):
-            if output_dict[i]["image"] == output_image_dict["image"]:
-                exists = True
-                output_dict[i] = output_image_dict
-                break
-
-        if not exists:
-            output_dict.append(output_image_dict)
-
-        Path(self.output_file).write_text(json.dumps(output_dict), ENCODE_METHOD)
+        CreateMLStore.open(self.output_file).put(output_image_dict, flush=flush)
 
     def calculate_coordinates(self, x1, x2, y1, y2):
         if x1 < x2:
@@ -105,21 +244,14 @@ class CreateMLReader:
             print("JSON decoding failed")
 
     def parse_json(self):
-        with open(self.json_path, "r") as file:
-            input_data = file.read()
-
-        # Returns a list
-        output_list = json.loads(input_data)
-
-        if output_list:
-            self.verified = output_list[0].get("verified", False)
+        image = CreateMLStore.open(self.json_path).get(self.filename)
 
         if len(self.shapes) > 0:
             self.shapes = []
-        for image in output_list:
-            if image["image"] == self.filename:
-                for shape in image["annotations"]:
-                    self.add_shape(shape["label"], shape["coordinates"])
+        if image is not None:
+            self.verified = image.get("verified", False)
+            for shape in image["annotations"]:
+                self.add_shape(shape["label"], shape["coordinates"])
 
     def add_shape(self, label, bnd_box):
         x_min = bnd_box["x"] - (bnd_box["width"] / 2)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Live watching of the open image directory.
+
+QFileSystemWatcher only reports that a directory changed, and a capture
+pipeline may drop thousands of files in a burst. DirectoryWatcher collects
+the changed directories, waits for the burst to settle, re-lists only those
+directories and reports the images that appeared or disappeared.
+"""
+import os
+import time
+
+try:
+    from PyQt5.QtCore import QFileSystemWatcher, QObject, QTimer, pyqtSignal
+except ImportError:
+    from PyQt4.QtCore import QFileSystemWatcher, QObject, QTimer, pyqtSignal
+
+
+class DirectoryWatcher(QObject):
+    """Watches a directory tree and reports added and removed image files."""
+
+    images_changed = pyqtSignal(list, list)  # added paths, removed paths
+
+    # Quiet time before a batch of changes is reported.
+    DEBOUNCE_MS = 500
+    # Report at least this often while changes keep arriving.
+    MAX_DELAY = 2.0
+
+    def __init__(self, extensions, parent=None):
+        super(DirectoryWatcher, self).__init__(parent)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.root = None
+        self._known = {}  # directory -> set of image paths in it
+        self._pending = set()
+        self._pending_since = None
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._on_directory_changed)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.DEBOUNCE_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def _is_image(self, name):
+        return name.lower().endswith(self.extensions)
+
+    def watch(self, root, image_paths):
+        """Start watching root, whose images are currently image_paths."""
+        self.stop()
+        self.root = os.path.abspath(root)
+        known = {}
+        for path in image_paths:
+            known.setdefault(os.path.dirname(path), set()).add(path)
+        dirs = [self.root]
+        for dir_path, subdirs, _ in os.walk(self.root):
+            dirs.extend(os.path.join(dir_path, d) for d in subdirs)
+        for dir_path in dirs:
+            known.setdefault(dir_path, set())
+        self._known = known
+        self._watcher.addPaths(dirs)
+
+    def stop(self):
+        self._timer.stop()
+        watched = self._watcher.directories()
+        if watched:
+            self._watcher.removePaths(watched)
+        self.root = None
+        self._known = {}
+        self._pending = set()
+        self._pending_since = None
+
+    def _on_directory_changed(self, path):
+        now = time.monotonic()
+        if not self._pending:
+            self._pending_since = now
+        self._pending.add(path)
+        # Keep extending the quiet period, but not past MAX_DELAY.
+        if not self._timer.isActive() or now - self._pending_since < self.MAX_DELAY:
+            self._timer.start()
+
+    def _forget(self, dir_path, removed):
+        prefix = dir_path + os.sep
+        for known_dir in [d for d in self._known if d == dir_path or d.startswith(prefix)]:
+            removed.extend(self._known.pop(known_dir))
+            self._watcher.removePath(known_dir)
+
+    def _add_tree(self, dir_path, added):
+        new_dirs = []
+        for sub_root, subdirs, files in os.walk(dir_path):
+            images = set(os.path.join(sub_root, f) for f in files if self._is_image(f))
+            self._known[sub_root] = images
+            added.extend(images)
+            new_dirs.append(sub_root)
+        if new_dirs:
+            self._watcher.addPaths(new_dirs)
+
+    def flush(self):
+        """Re-list the changed directories and emit what changed."""
+        self._timer.stop()
+        pending, self._pending = self._pending, set()
+        self._pending_since = None
+        added, removed = [], []
+        for dir_path in sorted(pending):
+            if dir_path not in self._known:
+                continue
+            try:
+                entries = list(os.scandir(dir_path))
+            except OSError:
+                self._forget(dir_path, removed)
+                continue
+            images = set()
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if entry.path not in self._known:
+                            self._add_tree(entry.path, added)
+                    elif self._is_image(entry.name):
+                        images.add(entry.path)
+                except OSError:
+                    continue
+            known = self._known[dir_path]
+            added.extend(images - known)
+            removed.extend(known - images)
+            self._known[dir_path] = images
+            # Subdirectories that vanished take their images with them.
+            for known_dir in [d for d in self._known if os.path.dirname(d) == dir_path]:
+                if not os.path.isdir(known_dir):
+                    self._forget(known_dir, removed)
+        if added or removed:
+            self.images_changed.emit(added, removed)
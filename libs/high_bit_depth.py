@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+16-bit images with interactive window/level.
+
+Thermal and medical images store more than 8 bits per sample, and a
+straight conversion to 8 bits throws most of the contrast away. A
+HighBitDepthImage keeps the raw samples in a NumPy array (memory-mapped
+straight from the file for uncompressed TIFFs, otherwise a view over
+Qt's 16-bit decode) and renders them into an 8-bit QImage through a
+65536-entry lookup table. Changing window/level only rebuilds the table
+and re-runs the lookup, split over row bands on a thread pool, into the
+same display buffer.
+"""
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from PyQt5.QtGui import QImage, QImageReader
+except ImportError:
+    from PyQt4.QtGui import QImage, QImageReader
+
+from libs.image_array import UINT16_FORMATS, pixel_rows, qimage_to_array
+
+# Rows rendered per task.
+RENDER_BAND = 256
+# Pixels sampled along each axis when estimating the automatic window.
+AUTO_SAMPLES = 1024
+
+_executor = None
+
+
+def _render_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, min(8, os.cpu_count() or 1)))
+    return _executor
+
+
+def is_high_bit_depth(path):
+    """True if path is a PNG or TIFF with more than 8 bits per sample, judging by its header."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(32)
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+                return head[24] == 16
+            if head[:4] in (b'II*\x00', b'MM\x00*'):
+                layout = _tiff_layout(f, head)
+                return layout is not None and layout['bits'] > 8
+    except (OSError, IndexError, struct.error):
+        pass
+    return False
+
+
+def _tiff_layout(f, head):
+    """Size, sample layout and strips of the first image of a TIFF, or None if unreadable."""
+    endian = '<' if head[:2] == b'II' else '>'
+    sizes = {1: 1, 3: 2, 4: 4, 16: 8}  # BYTE, SHORT, LONG, LONG8
+    codes = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'}
+
+    def values(field_type, count, raw):
+        size = sizes.get(field_type)
+        if size is None:
+            return []
+        if size * count > 4:
+            f.seek(struct.unpack(endian + 'I', raw)[0])
+            raw = f.read(size * count)
+        return list(struct.unpack(endian + codes[field_type] * count, raw[:size * count]))
+
+    f.seek(struct.unpack(endian + 'I', head[4:8])[0])
+    count = struct.unpack(endian + 'H', f.read(2))[0]
+    entries = f.read(12 * count)
+    tags = {}
+    for i in range(count):
+        tag, field_type, n = struct.unpack(endian + 'HHI', entries[12 * i:12 * i + 8])
+        if tag in (256, 257, 258, 259, 273, 274, 277, 279, 284, 322, 339):
+            tags[tag] = (field_type, n, entries[12 * i + 8:12 * i + 12])
+    if 256 not in tags or 257 not in tags:
+        return None
+    layout = {
+        'endian': endian,
+        'width': values(*tags[256])[0],
+        'height': values(*tags[257])[0],
+        'bits': values(*tags[258])[0] if 258 in tags else 1,
+        'compression': values(*tags[259])[0] if 259 in tags else 1,
+        'orientation': values(*tags[274])[0] if 274 in tags else 1,
+        'samples': values(*tags[277])[0] if 277 in tags else 1,
+        'planar': values(*tags[284])[0] if 284 in tags else 1,
+        'sample_format': values(*tags[339])[0] if 339 in tags else 1,
+        'tiled': 322 in tags,
+        'strips': list(zip(values(*tags[273]), values(*tags[279]))) if 273 in tags and 279 in tags else [],
+    }
+    return layout
+
+
+def _memmap_tiff(path):
+    """Memory-map the samples of an uncompressed, single-block 16-bit TIFF; None if it is not one."""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        if head[:4] not in (b'II*\x00', b'MM\x00*'):
+            return None
+        layout = _tiff_layout(f, head)
+    # Rotated or mirrored images are left to Qt, which applies the orientation.
+    if layout is None or layout['bits'] != 16 or layout['compression'] != 1 or layout['tiled'] \
+            or layout['orientation'] != 1 or layout['planar'] != 1 or layout['sample_format'] != 1 or layout['samples'] not in (1, 3, 4) \
+            or not layout['strips']:
+        return None
+    height, width, samples = layout['height'], layout['width'], layout['samples']
+    # The strips must follow one another so the image is one block.
+    offset = layout['strips'][0][0]
+    position = offset
+    for strip_offset, strip_bytes in layout['strips']:
+        if strip_offset != position:
+            return None
+        position += strip_bytes
+    if position - offset < height * width * samples * 2:
+        return None
+    shape = (height, width) if samples == 1 else (height, width, samples)
+    raw = np.memmap(path, dtype=layout['endian'] + 'u2', mode='r', offset=offset, shape=shape)
+    return raw if samples == 1 else raw[..., :3]
+
+
+def read_raw(path):
+    """The 16-bit samples of path as an (h, w) or (h, w, 3) array, or None."""
+    try:
+        raw = _memmap_tiff(path)
+    except (OSError, ValueError, IndexError, struct.error):
+        raw = None
+    if raw is not None:
+        return raw
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    image = reader.read()
+    if image.isNull() or image.format() not in UINT16_FORMATS:
+        return None
+    array = qimage_to_array(image)
+    return array if array.ndim == 2 else array[..., :3]
+
+
+class HighBitDepthImage:
+    """Raw 16-bit samples and their 8-bit rendering under a window/level mapping."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        height, width = raw.shape[:2]
+        self.grayscale = raw.ndim == 2
+        self.display = QImage(width, height, QImage.Format_Grayscale8 if self.grayscale else QImage.Format_RGB32)
+        # Writes go through this view, so every holder of self.display sees them.
+        self._rows = pixel_rows(self.display, writable=True)
+        if not self.grayscale:
+            self._rows.reshape(height, width, 4)[..., 3] = 255
+        self.max_value = self._estimate_max_value()
+        self.level, self.window = self.auto_window()
+        self.render()
+
+    @classmethod
+    def open(cls, path):
+        raw = read_raw(path)
+        return cls(raw) if raw is not None else None
+
+    @property
+    def nbytes(self):
+        """Memory held; memory-mapped samples are paged in from the file and not counted."""
+        raw_bytes = 0 if isinstance(self.raw, np.memmap) or isinstance(self.raw.base, np.memmap) else self.raw.nbytes
+        return raw_bytes + self._rows.nbytes
+
+    def _sample(self):
+        height, width = self.raw.shape[:2]
+        return self.raw[::max(1, height // AUTO_SAMPLES), ::max(1, width // AUTO_SAMPLES)]
+
+    def _estimate_max_value(self):
+        """Largest value of the bit depth the samples appear to use, e.g. 4095 for 12-bit data."""
+        bits = max(8, int(self._sample().max()).bit_length())
+        return (1 << bits) - 1
+
+    def auto_window(self, low=0.5, high=99.5):
+        """(level, window) spanning the low..high percentiles of a subsample of the image."""
+        lo, hi = np.percentile(self._sample(), (low, high))
+        return float(lo + hi) / 2.0, max(float(hi - lo), 1.0)
+
+    def set_window(self, level, window):
+        """Re-render with the given window centre and width; False if nothing changed."""
+        window = max(float(window), 1.0)
+        if (level, window) == (self.level, self.window):
+            return False
+        self.level, self.window = float(level), window
+        self.render()
+        return True
+
+    def lut(self):
+        low = self.level - self.window / 2.0
+        values = (np.arange(65536, dtype=np.float32) - low) * (255.0 / self.window)
+        return np.clip(values, 0, 255).astype(np.uint8)
+
+    def render(self):
+        lut = self.lut()
+        height = self.raw.shape[0]
+        tasks = [_render_executor().submit(self._render_band, lut, start, min(start + RENDER_BAND, height))
+                 for start in range(0, height, RENDER_BAND)]
+        for task in tasks:
+            task.result()
+
+    def _render_band(self, lut, start, end):
+        raw = self.raw[start:end]
+        width = raw.shape[1]
+        if self.grayscale:
+            self._rows[start:end, :width] = np.take(lut, raw)
+            return
+        out = self._rows[start:end].reshape(end - start, width, 4)
+        for channel in range(3):
+            # RGB32 is stored B, G, R, X.
+            out[..., 2 - channel] = np.take(lut, raw[..., channel])
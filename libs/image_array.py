@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Zero-copy views between QImage and NumPy.
+
+qimage_to_array() returns an array over the pixels of a QImage; the array
+keeps the image alive, so it stays valid however long it is used, e.g. by
+an inference thread. array_to_qimage() goes the other way and keeps the
+array alive for as long as the returned QImage's Python object exists;
+copy() it before handing it to Qt for longer than that.
+"""
+import hashlib
+import sys
+
+import numpy as np
+
+try:
+    from PyQt5 import sip
+    from PyQt5.QtGui import QImage
+except ImportError:
+    import sip
+    from PyQt4.QtGui import QImage
+
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+# 32-bit formats whose bytes are B, G, R, A/X in memory on little-endian hosts.
+BGRA_FORMATS = (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied)
+
+# Formats with 16 bits per channel (Qt >= 5.13).
+UINT16_FORMATS = tuple(getattr(QImage, name) for name in (
+    'Format_Grayscale16', 'Format_RGBX64', 'Format_RGBA64', 'Format_RGBA64_Premultiplied') if hasattr(QImage, name))
+
+
+class _PixelBuffer(object):
+    """Exposes the pixels of a QImage through the array interface and keeps the image alive."""
+
+    def __init__(self, image, writable):
+        self.image = image
+        # bits() detaches a shared image first, so writes never leak into other copies.
+        ptr = image.bits() if writable else image.constBits()
+        self.__array_interface__ = {
+            'version': 3,
+            'shape': (image.height(), image.bytesPerLine()),
+            'typestr': '|u1',
+            'data': (int(ptr), not writable),
+        }
+
+
+def pixel_rows(image, writable=False):
+    """(height, bytes per line) uint8 array over the pixel rows of image, padding included."""
+    return np.asarray(_PixelBuffer(image, writable))
+
+
+def qimage_to_array(image, writable=False):
+    """Array over the pixels of image without copying them.
+
+    8-bit formats give (h, w), RGB888/BGR888 give (h, w, 3) and 32-bit
+    formats (h, w, 4) in memory order, i.e. B, G, R, A on little-endian
+    hosts. The 16-bit formats give uint16 arrays: Grayscale16 (h, w) and
+    the 64-bit RGBA formats (h, w, 4) as R, G, B, A. Returns None for
+    other formats.
+    """
+    if image.isNull():
+        return None
+    width, depth = image.width(), image.depth()
+    rows = pixel_rows(image, writable)
+    if image.format() in UINT16_FORMATS:
+        rows = rows.view(np.uint16)
+        depth //= 2
+    if depth not in (8, 24, 32):
+        return None
+    if depth == 8:
+        return rows[:, :width]
+    channels = depth // 8
+    return rows[:, :width * channels].reshape(image.height(), width, channels)
+
+
+def qimage_to_bgr(image):
+    """(h, w, 3) BGR view of image, the layout OpenCV and ultralytics expect.
+
+    32-bit and grayscale images are viewed in place (grayscale by
+    broadcasting); other formats are converted once first.
+    """
+    fmt = image.format()
+    if LITTLE_ENDIAN and fmt in BGRA_FORMATS:
+        return qimage_to_array(image)[..., :3]
+    if fmt == QImage.Format_Grayscale8:
+        gray = qimage_to_array(image)
+        return np.broadcast_to(gray[..., None], gray.shape + (3,))
+    return qimage_to_array(image.convertToFormat(QImage.Format_RGB32))[..., :3]
+
+
+def array_to_qimage(array, bgr=True, copy=False):
+    """QImage over a uint8 array of shape (h, w), (h, w, 3) or (h, w, 4).
+
+    Colour arrays are taken as BGR/BGRA (OpenCV order) unless bgr is
+    False. Rows may be padded, as in a crop of a larger array. With copy,
+    the result owns its pixels.
+    """
+    if array.dtype != np.uint8 or array.ndim not in (2, 3):
+        raise ValueError('expected a uint8 array of shape (h, w) or (h, w, channels)')
+    height, width = array.shape[:2]
+    channels = 1 if array.ndim == 2 else array.shape[2]
+    if array.ndim == 2:
+        fmt = QImage.Format_Grayscale8
+    elif channels == 3:
+        fmt = QImage.Format_BGR888 if bgr else QImage.Format_RGB888
+    elif channels == 4 and LITTLE_ENDIAN:
+        fmt = QImage.Format_ARGB32 if bgr else QImage.Format_RGBA8888
+    else:
+        raise ValueError('unsupported array shape %r' % (array.shape,))
+    if array.strides[0] < 0 or array.strides[-1] != 1 or (array.ndim == 3 and array.strides[1] != channels):
+        array = np.ascontiguousarray(array)
+    image = QImage(sip.voidptr(array.ctypes.data), width, height, array.strides[0], fmt)
+    if copy:
+        return image.copy()
+    image._array = array
+    return image
+
+
+def image_digest(image):
+    """SHA-1 hex digest of the size, format and pixels of a QImage; row padding is left out."""
+    rows = pixel_rows(image)[:, :(image.width() * image.depth() + 7) // 8]
+    sha1 = hashlib.sha1(b'%d %d %d ' % (image.width(), image.height(), int(image.format())))
+    sha1.update(np.ascontiguousarray(rows))
+    return sha1.hexdigest()
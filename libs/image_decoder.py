@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Pluggable image decoding.
+
+QImageReader decodes every format but is not the fastest JPEG decoder
+around. When simplejpeg, OpenCV or Pillow are installed (all built on
+libjpeg-turbo), they are used instead wherever they win: the first image
+of each format is decoded by every available backend, the fastest one is
+remembered in ~/.redlabelDecoders.json, and later images of that format
+go straight to it. The backends release the GIL while decoding, so they
+run in parallel from worker threads.
+
+Decoders write their pixels into the buffer of a freshly allocated QImage
+rather than wrapping their own array, so the result owns its memory.
+simplejpeg decodes straight into that buffer. OpenCV decodes into its own
+array and converts it into the buffer. Pillow cannot decode into foreign
+memory either: its pixels are packed into a bytes object and copied from
+there, with a mode conversion before for modes it cannot pack directly;
+the benchmark accounts for that copy. Images with an EXIF orientation
+other than the default always go through Qt, which applies it.
+"""
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    from PyQt5.QtGui import QImage
+    from PyQt5.QtCore import Qt
+except ImportError:
+    from PyQt4.QtGui import QImage
+    from PyQt4.QtCore import Qt
+
+from libs.constants import DEFAULT_ENCODING
+from libs.image_array import pixel_rows
+from libs.image_info import image_reader, probe_image
+from libs.storage import decode_member, open_image
+
+# Canonical format names of file extensions.
+FORMAT_ALIASES = {'jpeg': 'jpg', 'jpe': 'jpg', 'tif': 'tiff'}
+
+# Decodes per backend during the benchmark; the best time counts.
+BENCHMARK_REPEAT = 2
+
+
+def image_format(path):
+    ext = os.path.splitext(path)[1][1:].lower()
+    return FORMAT_ALIASES.get(ext, ext)
+
+
+def _image_from_array(array):
+    """Copy an (h, w) gray, (h, w, 3) BGR or (h, w, 4) BGRA uint8 array into a new QImage."""
+    if array.dtype != np.uint8:
+        return None
+    height, width = array.shape[:2]
+    if array.ndim == 2:
+        image = QImage(width, height, QImage.Format_Grayscale8)
+        pixel_rows(image, writable=True)[:, :width] = array
+        return image
+    channels = array.shape[2]
+    if channels not in (3, 4):
+        return None
+    image = QImage(width, height, QImage.Format_RGB32 if channels == 3 else QImage.Format_ARGB32)
+    view = pixel_rows(image, writable=True).reshape(height, width, 4)
+    view[..., :channels] = array
+    if channels == 3:
+        view[..., 3] = 255
+    return image
+
+
+def _reduced_size(width, height, max_size):
+    """Smallest size that still covers a max_size box once scaled to fit it."""
+    scale = min(1.0, float(max_size) / max(width, height))
+    return max(1, int(math.ceil(width * scale))), max(1, int(math.ceil(height * scale)))
+
+
+class Decoder(object):
+    """A decoding backend; decode() returns a QImage, or None if it cannot handle the file."""
+
+    name = None
+    # Canonical formats this backend handles; None for any.
+    formats = None
+
+    def supports(self, fmt):
+        return self.formats is None or fmt in self.formats
+
+    def available(self):
+        return True
+
+    def decode(self, path, max_size=None):
+        raise NotImplementedError
+
+
+class QtDecoder(Decoder):
+    """QImageReader; handles every format Qt has a plugin for, and EXIF orientation."""
+
+    name = 'qt'
+
+    def decode(self, path, max_size=None):
+        reader = image_reader(path)
+        reader.setAutoTransform(True)
+        if max_size:
+            full = reader.size()
+            if full.isValid() and (full.width() > max_size or full.height() > max_size):
+                reader.setScaledSize(full.scaled(max_size, max_size, Qt.KeepAspectRatio))
+        image = reader.read()
+        return None if image.isNull() else image
+
+
+class _ModuleDecoder(Decoder):
+    """A backend provided by an optional module, imported on first use."""
+
+    module_name = None
+
+    def __init__(self):
+        self._module = None
+        self._checked = False
+
+    def available(self):
+        # The pixel layouts written below assume a little-endian host.
+        if sys.byteorder != 'little':
+            return False
+        if not self._checked:
+            self._checked = True
+            try:
+                self._module = __import__(self.module_name)
+            except ImportError:
+                self._module = None
+        return self._module is not None
+
+
+class SimpleJpegDecoder(_ModuleDecoder):
+    """simplejpeg decodes straight into the QImage buffer, scaling in the DCT if asked."""
+
+    name = 'simplejpeg'
+    module_name = 'simplejpeg'
+    formats = ('jpg',)
+
+    def decode(self, path, max_size=None):
+        simplejpeg = self._module
+        with open_image(path) as f:
+            data = f.read()
+        height, width, colorspace, _ = simplejpeg.decode_jpeg_header(data)
+        kwargs = {}
+        if max_size and max(width, height) > max_size:
+            kwargs['min_width'], kwargs['min_height'] = _reduced_size(width, height, max_size)
+            height, width = simplejpeg.decode_jpeg_header(data, **kwargs)[:2]
+        if colorspace == 'Gray':
+            if width % 4:
+                # Grayscale8 rows are padded to 4 bytes; decode aside and copy.
+                return _image_from_array(simplejpeg.decode_jpeg(data, 'GRAY', **kwargs)[..., 0])
+            image = QImage(width, height, QImage.Format_Grayscale8)
+            simplejpeg.decode_jpeg(data, 'GRAY', buffer=pixel_rows(image, writable=True), **kwargs)
+            return image
+        image = QImage(width, height, QImage.Format_RGB32)
+        simplejpeg.decode_jpeg(data, 'BGRX', buffer=pixel_rows(image, writable=True), **kwargs)
+        return image
+
+
+class OpenCVDecoder(_ModuleDecoder):
+    """cv2.imdecode; 8-bit gray, BGR and BGRA results are converted into the QImage buffer."""
+
+    name = 'opencv'
+    module_name = 'cv2'
+    formats = ('jpg', 'png', 'bmp', 'tiff', 'webp')
+
+    def decode(self, path, max_size=None):
+        cv2 = self._module
+        with open_image(path) as f:
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+        flags = cv2.IMREAD_UNCHANGED
+        if max_size:
+            info = probe_image(path)
+            if info is not None:
+                longest = max(info.width, info.height)
+                for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                        (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                    if longest // factor >= max_size:
+                        flags = reduced | cv2.IMREAD_IGNORE_ORIENTATION
+                        break
+        array = cv2.imdecode(data, flags)
+        if array is None or array.dtype != np.uint8:
+            return None
+        if array.ndim == 3 and array.shape[2] == 3:
+            height, width = array.shape[:2]
+            image = QImage(width, height, QImage.Format_RGB32)
+            cv2.cvtColor(array, cv2.COLOR_BGR2BGRA, dst=pixel_rows(image, writable=True).reshape(height, width, 4))
+            return image
+        return _image_from_array(array)
+
+
+class PillowDecoder(_ModuleDecoder):
+    """Pillow; JPEGs are scaled in the DCT via draft() when a reduced size is asked."""
+
+    name = 'pillow'
+    module_name = 'PIL.Image'
+    formats = ('jpg', 'png', 'bmp', 'tiff', 'webp', 'gif')
+
+    def available(self):
+        if not super(PillowDecoder, self).available():
+            return False
+        # __import__ of a submodule returns the package.
+        self._module = sys.modules['PIL.Image']
+        return True
+
+    def decode(self, path, max_size=None):
+        with open_image(path) as f, self._module.open(f) as im:
+            if max_size and max(im.size) > max_size:
+                im.draft('RGB' if im.mode != 'L' else 'L', _reduced_size(im.size[0], im.size[1], max_size))
+            if im.mode in ('1', 'L'):
+                mode, fmt, raw_mode = 'L', QImage.Format_Grayscale8, 'L'
+            elif im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info:
+                mode, fmt, raw_mode = 'RGBA', QImage.Format_ARGB32, 'BGRA'
+            elif im.mode in ('RGB', 'P', 'CMYK', 'YCbCr'):
+                mode, fmt, raw_mode = 'RGB', QImage.Format_RGB32, 'BGRX'
+            else:
+                return None
+            if im.mode != mode:
+                # The raw packer reorders the channels itself; other modes need a converted copy first.
+                im = im.convert(mode)
+            width, height = im.size
+            image = QImage(width, height, fmt)
+            pixels = np.frombuffer(im.tobytes('raw', raw_mode), np.uint8)
+            pixel_rows(image, writable=True)[:, :len(pixels) // height] = pixels.reshape(height, -1)
+            return image
+
+
+def default_choices_path():
+    return os.path.join(os.path.expanduser("~"), '.redlabelDecoders.json')
+
+
+class DecoderSelector:
+    """Picks the fastest available decoder per format, benchmarking on first use."""
+
+    def __init__(self, decoders=None, choices_path=None):
+        if decoders is None:
+            decoders = [SimpleJpegDecoder(), OpenCVDecoder(), PillowDecoder()]
+        self.fallback = QtDecoder()
+        self.decoders = [self.fallback] + [d for d in decoders if d.name != 'qt' and d.available()]
+        self.choices_path = choices_path
+        self._choices = {}
+        self._lock = threading.Lock()
+        self._load_choices()
+
+    def _backend_names(self):
+        return sorted(d.name for d in self.decoders)
+
+    def _load_choices(self):
+        if not self.choices_path:
+            return
+        try:
+            with open(self.choices_path, 'r', encoding=DEFAULT_ENCODING) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        # Installing or removing a backend invalidates every choice.
+        if saved.get('backends') == self._backend_names():
+            by_name = dict((d.name, d) for d in self.decoders)
+            self._choices = dict((fmt, by_name[name]) for fmt, name in saved.get('choices', {}).items()
+                                 if name in by_name)
+
+    def _save_choices(self):
+        if not self.choices_path:
+            return
+        data = {'backends': self._backend_names(),
+                'choices': dict((fmt, d.name) for fmt, d in self._choices.items())}
+        tmp_path = self.choices_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding=DEFAULT_ENCODING) as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.choices_path)
+        except OSError:
+            pass
+
+    def remember(self, fmt, decoder):
+        """Use decoder for fmt from now on, here and in later sessions."""
+        self._choices[fmt] = decoder
+        self._save_choices()
+
+    def candidates(self, fmt):
+        return [d for d in self.decoders if d.supports(fmt)]
+
+    def benchmark(self, path, max_size=None, repeat=BENCHMARK_REPEAT):
+        """Time every candidate decoder on path; returns [(decoder, seconds or None)], fastest first.
+
+        A decoder that fails, or disagrees with Qt about the image size,
+        gets None.
+        """
+        results = []
+        expected = None
+        for decoder in self.candidates(image_format(path)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    image = decoder.decode(path, max_size)
+                except Exception:
+                    image = None
+                elapsed = time.perf_counter() - start
+                if image is None or image.isNull():
+                    best = None
+                    break
+                best = elapsed if best is None else min(best, elapsed)
+            if best is not None and max_size is None:
+                # Qt is first in the list and defines the expected size.
+                if expected is None:
+                    expected = image.size()
+                elif image.size() != expected:
+                    best = None
+            results.append((decoder, best))
+        results.sort(key=lambda result: float('inf') if result[1] is None else result[1])
+        return results
+
+    def decoder_for(self, path):
+        fmt = image_format(path)
+        decoder = self._choices.get(fmt)
+        if decoder is not None:
+            return decoder
+        candidates = self.candidates(fmt)
+        if len(candidates) == 1:
+            return candidates[0]
+        with self._lock:
+            if fmt not in self._choices:
+                results = self.benchmark(path)
+                if results[0][1] is None:
+                    # Nothing could decode this file; try again with the next one.
+                    return self.fallback
+                self.remember(fmt, results[0][0])
+            return self._choices[fmt]
+
+    def decode(self, path, max_size=None):
+        """Decode path to a QImage, at least max_size pixels on its longer side if given; None on failure."""
+        decoder = self.decoder_for(path)
+        if decoder is not self.fallback:
+            info = probe_image(path)
+            if info is None or info.orientation not in (0, 1):
+                decoder = self.fallback
+        try:
+            image = decoder.decode(path, max_size)
+        except Exception:
+            image = None
+        if (image is None or image.isNull()) and decoder is not self.fallback:
+            try:
+                image = self.fallback.decode(path, max_size)
+            except OSError:
+                image = None
+        return image
+
+
+_selector = None
+_selector_lock = threading.Lock()
+
+
+def get_decoder_selector():
+    """The application-wide DecoderSelector, persisting its choices in the home directory."""
+    global _selector
+    with _selector_lock:
+        if _selector is None:
+            _selector = DecoderSelector(choices_path=default_choices_path())
+        return _selector
+
+
+def decode_image(path, max_size=None):
+    """Decode the image at path with the fastest backend for its format; None on failure."""
+    try:
+        image = decode_member(path, max_size)
+    except OSError:
+        # An archive member, object or video frame that cannot be read.
+        return None
+    if image is not None:
+        return image
+    return get_decoder_selector().decode(path, max_size)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Header-only image probing with a persistent per-directory cache.
+
+Writers only need an image's width, height and depth, which every common
+format stores in its first few hundred bytes. probe_image() reads just those
+bytes instead of decoding the pixels, and ImageInfoCache remembers the
+result next to the images, keyed by file name, mtime and size.
+"""
+import atexit
+import json
+import os
+import struct
+import threading
+from collections import namedtuple
+
+try:
+    from PyQt5.QtGui import QImage, QImageReader, QImageIOHandler
+    from PyQt5.QtCore import QBuffer
+except ImportError:
+    from PyQt4.QtGui import QImage, QImageReader, QImageIOHandler
+    from PyQt4.QtCore import QBuffer
+
+from libs.constants import DEFAULT_ENCODING
+from libs.storage import image_stat, open_image, probe_member, read_member
+
+# EXIF/TIFF orientations that rotate the image by 90 or 270 degrees.
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# Start-of-frame markers; C4 (DHT), C8 (JPG) and CC (DAC) share the range.
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ImageInfo(namedtuple('ImageInfo', 'width height depth orientation')):
+    """Display size of an image, i.e. after its EXIF orientation is applied."""
+
+    @property
+    def shape(self):
+        """[height, width, depth], the img_size layout used by the writers."""
+        return [self.height, self.width, self.depth]
+
+
+def _oriented(width, height, depth, orientation):
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return ImageInfo(width, height, depth, orientation)
+
+
+def _tiff_tags(data, offset=0, wanted=(256, 257, 274, 277)):
+    """Read the first IFD of the TIFF structure starting at data[offset]."""
+    byte_order = data[offset:offset + 2]
+    if byte_order == b'II':
+        endian = '<'
+    elif byte_order == b'MM':
+        endian = '>'
+    else:
+        return {}
+    ifd = offset + struct.unpack(endian + 'I', data[offset + 4:offset + 8])[0]
+    if ifd + 2 > len(data):
+        return {}
+    count = struct.unpack(endian + 'H', data[ifd:ifd + 2])[0]
+    tags = {}
+    for i in range(count):
+        entry = ifd + 2 + 12 * i
+        if entry + 12 > len(data):
+            break
+        tag, field_type = struct.unpack(endian + 'HH', data[entry:entry + 4])
+        if tag not in wanted:
+            continue
+        if field_type == 3:  # SHORT
+            value = struct.unpack(endian + 'H', data[entry + 8:entry + 10])[0]
+        elif field_type == 4:  # LONG
+            value = struct.unpack(endian + 'I', data[entry + 8:entry + 12])[0]
+        else:
+            continue
+        tags[tag] = value
+    return tags
+
+
+def _probe_png(f, head):
+    width, height = struct.unpack('>II', head[16:24])
+    color_type = head[25]
+    return ImageInfo(width, height, 1 if color_type in (0, 4) else 3, 1)
+
+
+def _probe_jpeg(f, head):
+    orientation = 1
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:  # fill byte
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if code == 0xE1:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                orientation = _tiff_tags(segment, 6, wanted=(274,)).get(274, 1)
+        elif code in JPEG_SOF_MARKERS:
+            height, width, components = struct.unpack('>xHHB', f.read(6))
+            return _oriented(width, height, 1 if components == 1 else 3, orientation)
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _probe_tiff(f, head):
+    f.seek(0)
+    # IFD0 is almost always near the start; 64 KiB covers it for common writers.
+    tags = _tiff_tags(f.read(65536))
+    if 256 not in tags or 257 not in tags:
+        return None
+    return _oriented(tags[256], tags[257], 1 if tags.get(277, 1) == 1 else 3, tags.get(274, 1))
+
+
+def _probe_bmp(f, head):
+    dib_size, width, height, _, bpp = struct.unpack('<IiiHH', head[14:30])
+    depth = 3
+    if bpp <= 8:
+        # Indexed: grayscale only if every palette entry is gray.
+        colors = struct.unpack('<I', head[46:50])[0] or (1 << bpp)
+        f.seek(14 + dib_size)
+        palette = f.read(4 * colors)
+        if all(palette[i] == palette[i + 1] == palette[i + 2] for i in range(0, len(palette) - 3, 4)):
+            depth = 1
+    return ImageInfo(width, abs(height), depth, 1)
+
+
+def _probe_gif(f, head):
+    width, height = struct.unpack('<HH', head[6:10])
+    return ImageInfo(width, height, 3, 1)
+
+
+def image_reader(path):
+    """QImageReader of an image file or archive member."""
+    data = read_member(path)
+    if data is None:
+        return QImageReader(path)
+    buffer = QBuffer()
+    buffer.setData(data)
+    reader = QImageReader(buffer)
+    # The reader does not own its device.
+    reader._buffer = buffer
+    return reader
+
+
+def _probe_with_qt(path):
+    """Fallback for other formats; QImageReader also reads headers only."""
+    reader = image_reader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if not size.isValid():
+        return None
+    width, height = size.width(), size.height()
+    if reader.transformation() & QImageIOHandler.TransformationRotate90:
+        width, height = height, width
+    grayscale = reader.imageFormat() in (QImage.Format_Grayscale8, QImage.Format_Mono, QImage.Format_MonoLSB)
+    return ImageInfo(width, height, 1 if grayscale else 3, 1)
+
+
+def probe_image(path):
+    """Return the ImageInfo of the image at path without decoding it, or None.
+
+    A member of an archive, bucket or video that cannot be read counts as
+    unreadable too.
+    """
+    try:
+        info = probe_member(path)
+    except OSError:
+        return None
+    if info is not None:
+        return info
+    try:
+        with open_image(path) as f:
+            head = f.read(64)
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+                info = _probe_png(f, head)
+            elif head.startswith(b'\xff\xd8'):
+                info = _probe_jpeg(f, head)
+            elif head[:4] in (b'II*\x00', b'MM\x00*'):
+                info = _probe_tiff(f, head)
+            elif head.startswith(b'BM') and len(head) >= 50:
+                info = _probe_bmp(f, head)
+            elif head[:6] in (b'GIF87a', b'GIF89a'):
+                info = _probe_gif(f, head)
+            else:
+                info = None
+    except (OSError, struct.error, IndexError):
+        info = None
+    if info is None or info.width <= 0 or info.height <= 0:
+        try:
+            info = _probe_with_qt(path)
+        except OSError:
+            info = None
+    return info
+
+
+class ImageInfoCache:
+    """ImageInfo of the images of one directory, persisted in that directory.
+
+    Entries are keyed by file name and validated against the file's mtime
+    and size. The cache file is written on save(); if the directory is not
+    writable the cache simply stays in memory.
+    """
+
+    CACHE_FILENAME = '.redlabel_image_info.json'
+    # Write the cache file after this many new entries.
+    SAVE_EVERY = 256
+
+    _caches = {}
+    _caches_lock = threading.Lock()
+
+    @classmethod
+    def for_directory(cls, dir_path):
+        key = os.path.abspath(dir_path)
+        with cls._caches_lock:
+            cache = cls._caches.get(key)
+            if cache is None:
+                cache = cls._caches[key] = cls(key)
+            return cache
+
+    @classmethod
+    def save_all(cls):
+        with cls._caches_lock:
+            caches = list(cls._caches.values())
+        for cache in caches:
+            cache.save()
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.cache_path = os.path.join(dir_path, self.CACHE_FILENAME)
+        self._entries = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        try:
+            with open(self.cache_path, 'r', encoding=DEFAULT_ENCODING) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, path):
+        """Return the ImageInfo of path, probing it on a cache miss."""
+        name = os.path.basename(path)
+        try:
+            key = list(image_stat(path))
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None and entry[:2] == key:
+            return ImageInfo(*entry[2:])
+        info = probe_image(path)
+        if info is None:
+            return None
+        with self._lock:
+            self._entries[name] = key + list(info)
+            self._unsaved += 1
+            save = self._unsaved >= self.SAVE_EVERY
+        if save:
+            self.save()
+        return info
+
+    def save(self):
+        with self._lock:
+            if not self._unsaved:
+                return
+            data = json.dumps(self._entries)
+            self._unsaved = 0
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding=DEFAULT_ENCODING) as f:
+                f.write(data)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass
+
+
+atexit.register(ImageInfoCache.save_all)
+
+
+def get_image_info(path):
+    """Return the (cached) ImageInfo of the image at path, or None."""
+    return ImageInfoCache.for_directory(os.path.dirname(os.path.abspath(path))).get(path)
+
+
+def image_shape(image_path, image_data=None):
+    """Return [height, width, depth] for the writers.
+
+    An already decoded QImage is used as is; otherwise the file is probed,
+    and only if that fails is it fully loaded.
+    """
+    if isinstance(image_data, QImage) and not image_data.isNull():
+        image = image_data
+    else:
+        info = get_image_info(image_path)
+        if info is not None:
+            return info.shape
+        image = QImage()
+        image.load(image_path)
+    return [image.height(), image.width(), 1 if image.isGrayscale() else 3]
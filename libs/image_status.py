@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Labelled / verified status of every image in the open directory.
+
+The status lives in one flag byte per image, kept in m_img_list order, with
+running counts next to it. It is filled once when a directory is opened
+and then updated in place as images are saved, verified or auto-labelled,
+so the GUI never has to touch the file system to answer "how many are left"
+or "where is the next unlabelled image".
+"""
+import numpy as np
+
+LABELED = 1
+VERIFIED = 2
+
+# Blocks scanned per step when searching for the next image with a status.
+SEARCH_BLOCK = 4096
+
+
+class ImageStatusTracker:
+    """Status flags of a list of image paths."""
+
+    def __init__(self, image_paths=()):
+        self.reset(image_paths)
+
+    def reset(self, image_paths):
+        self.paths = list(image_paths)
+        self._positions = {path: i for i, path in enumerate(self.paths)}
+        self.flags = np.zeros(len(self.paths), dtype=np.uint8)
+        self.labeled_count = 0
+        self.verified_count = 0
+
+    def remap(self, image_paths, labeled_paths=()):
+        """Switch to a new list of paths, keeping the flags of paths already tracked.
+
+        Paths new to the tracker start unflagged unless they are in
+        labeled_paths.
+        """
+        old_flags, old_positions = self.flags, self._positions
+        self.paths = list(image_paths)
+        self._positions = {path: i for i, path in enumerate(self.paths)}
+        old_index = np.fromiter((old_positions.get(path, -1) for path in self.paths),
+                                dtype=np.int64, count=len(self.paths))
+        kept = old_index >= 0
+        self.flags = np.zeros(len(self.paths), dtype=np.uint8)
+        self.flags[kept] = old_flags[old_index[kept]]
+        for path in labeled_paths:
+            index = self._positions.get(path)
+            if index is not None:
+                self.flags[index] |= LABELED
+        self.labeled_count = int(np.count_nonzero(self.flags & LABELED))
+        self.verified_count = int(np.count_nonzero(self.flags & VERIFIED))
+
+    def __len__(self):
+        return len(self.flags)
+
+    def index_of(self, path):
+        """Position of path in the list, or -1."""
+        return self._positions.get(path, -1)
+
+    def set_status(self, index, labeled=None, verified=None):
+        """Update the flags of one image; None leaves a flag unchanged."""
+        old = int(self.flags[index])
+        new = old
+        if labeled is not None:
+            new = new | LABELED if labeled else new & ~LABELED
+        if verified is not None:
+            new = new | VERIFIED if verified else new & ~VERIFIED
+        if new != old:
+            self.flags[index] = new
+            self.labeled_count += bool(new & LABELED) - bool(old & LABELED)
+            self.verified_count += bool(new & VERIFIED) - bool(old & VERIFIED)
+
+    def set_path_status(self, path, labeled=None, verified=None):
+        index = self.index_of(path)
+        if index >= 0:
+            self.set_status(index, labeled, verified)
+
+    def load(self, labeled_keys, verified_keys, key):
+        """Set every flag at once from sets of image keys; key(path) maps a path to its key."""
+        keys = [key(path) for path in self.paths]
+        labeled = np.fromiter((k in labeled_keys for k in keys), dtype=bool, count=len(keys))
+        verified = np.fromiter((k in verified_keys for k in keys), dtype=bool, count=len(keys))
+        self.flags = labeled.astype(np.uint8) * LABELED | verified.astype(np.uint8) * VERIFIED
+        self.labeled_count = int(labeled.sum())
+        self.verified_count = int(verified.sum())
+
+    def is_labeled(self, index):
+        return bool(self.flags[index] & LABELED)
+
+    def is_verified(self, index):
+        return bool(self.flags[index] & VERIFIED)
+
+    def unlabeled_paths(self):
+        return [self.paths[i] for i in np.flatnonzero((self.flags & LABELED) == 0)]
+
+    def find_next(self, index, flag, step=1, wrap=True):
+        """Next position after index (before it if step < 0) whose flag is *not* set.
+
+        The search runs over NumPy blocks, so its cost grows with the
+        distance to the match rather than the size of the list. With wrap,
+        it continues from the other end. Returns None when every image has
+        the flag.
+        """
+        n = len(self.flags)
+        if n == 0:
+            return None
+        if step > 0:
+            spans = [(index + 1, n)] + ([(0, min(index + 1, n))] if wrap else [])
+        else:
+            spans = [(0, max(index, 0))] + ([(max(index, 0), n)] if wrap else [])
+        for start, end in spans:
+            if step > 0:
+                block_start = start
+                while block_start < end:
+                    block_end = min(block_start + SEARCH_BLOCK, end)
+                    hits = np.flatnonzero((self.flags[block_start:block_end] & flag) == 0)
+                    if len(hits):
+                        return block_start + int(hits[0])
+                    block_start = block_end
+            else:
+                block_end = end
+                while block_end > start:
+                    block_start = max(block_end - SEARCH_BLOCK, start)
+                    hits = np.flatnonzero((self.flags[block_start:block_end] & flag) == 0)
+                    if len(hits):
+                        return block_start + int(hits[-1])
+                    block_end = block_start
+        return None
@@ -1,17 +1,14 @@
 # Copyright (c) 2016 Tzutalin
 # Create by TzuTaLin <tzu.ta.lin@gmail.com>
 
-try:
-    from PyQt5.QtGui import QImage
-except ImportError:
-    from PyQt4.QtGui import QImage
-
 import os.path
 from enum import Enum
 
 from libs.create_ml_io import CreateMLWriter
+from libs.image_info import image_shape
 from libs.pascal_voc_io import PascalVocWriter
 from libs.pascal_voc_io import XML_EXT
+from libs.packed_io import PackedWriter
 from libs.yolo_io import YOLOWriter
 
 
@@ -19,6 +16,7 @@ class LabelFileFormat(Enum):
     PASCAL_VOC = 1
     YOLO = 2
     CREATE_ML = 3
+    PACKED = 4
 
 
 class LabelFileError(Exception):
@@ -40,14 +38,11 @@ class LabelFile(object):
         img_folder_name = os.path.basename(os.path.dirname(image_path))
         img_file_name = os.path.basename(image_path)
 
-        image = QImage()
-        image.load(image_path)
-        image_shape = [image.height(), image.width(),
-                       1 if image.isGrayscale() else 3]
         writer = CreateMLWriter(img_folder_name, img_file_name,
-                                image_shape, shapes, filename, local_img_path=image_path)
+                                image_shape(image_path, image_data), shapes, filename, local_img_path=image_path)
         writer.verified = self.verified
-        writer.write()
+        # The main window flushes pending CreateML writes shortly after saving.
+        writer.write(flush=False)
         return
 
 
@@ -57,17 +52,10 @@ class LabelFile(object):
         img_folder_name = os.path.split(img_folder_path)[-1]
         img_file_name = os.path.basename(image_path)
         # imgFileNameWithoutExt = os.path.splitext(img_file_name)[0]
-        # Read from file path because self.imageData might be empty if saving to
-        # Pascal format
-        if isinstance(image_data, QImage):
-            image = image_data
-        else:
-            image = QImage()
-            image.load(image_path)
-        image_shape = [image.height(), image.width(),
-                       1 if image.isGrayscale() else 3]
+        # self.imageData might be empty if saving to Pascal format; the size
+        # is then probed from the file header.
         writer = PascalVocWriter(img_folder_name, img_file_name,
-                                 image_shape, local_img_path=image_path)
+                                 image_shape(image_path, image_data), local_img_path=image_path)
         writer.verified = self.verified
 
         for shape in shapes:
@@ -87,17 +75,10 @@ class LabelFile(object):
         img_folder_name = os.path.split(img_folder_path)[-1]
         img_file_name = os.path.basename(image_path)
         # imgFileNameWithoutExt = os.path.splitext(img_file_name)[0]
-        # Read from file path because self.imageData might be empty if saving to
-        # Pascal format
-        if isinstance(image_data, QImage):
-            image = image_data
-        else:
-            image = QImage()
-            image.load(image_path)
-        image_shape = [image.height(), image.width(),
-                       1 if image.isGrayscale() else 3]
+        # self.imageData might be empty if saving to Pascal format; the size
+        # is then probed from the file header.
         writer = YOLOWriter(img_folder_name, img_file_name,
-                            image_shape, local_img_path=image_path)
+                            image_shape(image_path, image_data), local_img_path=image_path)
         writer.verified = self.verified
 
         for shape in shapes:
@@ -111,6 +92,21 @@ class LabelFile(object):
         writer.save(target_file=filename, class_list=class_list)
         return
 
+    def save_packed_format(self, filename, shapes, image_path, image_data,
+                           line_color=None, fill_color=None, database_src=None):
+        img_folder_name = os.path.basename(os.path.dirname(image_path))
+        img_file_name = os.path.basename(image_path)
+        writer = PackedWriter(img_folder_name, img_file_name,
+                              image_shape(image_path, image_data), local_img_path=image_path)
+        writer.verified = self.verified
+
+        for shape in shapes:
+            bnd_box = LabelFile.convert_points_to_bnd_box(shape['points'])
+            writer.add_bnd_box(bnd_box[0], bnd_box[1], bnd_box[2], bnd_box[3], shape['label'], int(shape['difficult']))
+
+        writer.save(target_file=filename)
+        return
+
     def toggle_verify(self):
         self.verified = not self.verified
 
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Images in an S3-compatible bucket, read through a local disk cache.
+
+A Bucket lists the objects under an ``s3://bucket/prefix`` location once
+and registers them with libs.storage, so they open like the files of a
+directory. An object is fetched on its first read over a small pool of
+keep-alive HTTP connections and kept in a size-bounded cache under
+~/.redlabelObjects, at exactly its virtual path; later reads come from
+there. prefetch() fetches the next images on a thread pool while the
+current one is being annotated.
+
+The endpoint, region and credentials come from the usual environment
+variables: AWS_ENDPOINT_URL (e.g. http://localhost:9000 for MinIO),
+AWS_REGION, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and
+AWS_SESSION_TOKEN. Without credentials requests go out unsigned, which
+public buckets accept.
+"""
+import calendar
+import hashlib
+import hmac
+import http.client
+import os
+import queue
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from libs.storage import ImageSource, register_source, source_at
+
+URL_SCHEME = 's3://'
+
+# Connections kept open to the endpoint, which is also the number of parallel fetches.
+POOL_SIZE = 8
+TIMEOUT = 30
+CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+
+class ObjectStoreError(OSError):
+    """A request to the object store failed."""
+
+
+def is_object_url(location):
+    return bool(location) and location.startswith(URL_SCHEME)
+
+
+def parse_object_url(url):
+    """(bucket, prefix) of an s3://bucket/prefix URL; a non-empty prefix ends with '/'."""
+    bucket, _, prefix = url[len(URL_SCHEME):].partition('/')
+    if not bucket:
+        raise ValueError('no bucket in %r' % url)
+    prefix = prefix.strip('/')
+    return bucket, prefix + '/' if prefix else ''
+
+
+def default_cache_dir():
+    return os.path.join(os.path.expanduser("~"), '.redlabelObjects')
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _child_text(element, name):
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child.text or ''
+    return ''
+
+
+def _parse_time(value):
+    """Nanoseconds since the epoch of an ISO 8601 UTC time such as 2024-05-01T12:00:00.123Z."""
+    main, _, fraction = value.rstrip('Z').partition('.')
+    seconds = calendar.timegm(time.strptime(main, '%Y-%m-%dT%H:%M:%S'))
+    return seconds * 10 ** 9 + int((fraction + '000000000')[:9])
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP(S) connections to one host, shared by threads."""
+
+    def __init__(self, endpoint, size=POOL_SIZE, timeout=TIMEOUT):
+        parts = urlsplit(endpoint)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.netloc = parts.netloc
+        self.size = size
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        self.connections_opened += 1
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, headers):
+        """(status, body) of one request.
+
+        A connection the server closed while it sat idle fails on first
+        use; the request is then repeated once on a new connection.
+        """
+        try:
+            connection, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self._connect(), False
+        while True:
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if not reused:
+                    raise ObjectStoreError('%s %s: %s' % (method, path, e))
+                connection, reused = self._connect(), False
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, body
+
+
+class S3Client:
+    """The two S3 calls an image list needs, ListObjectsV2 and GetObject.
+
+    Requests use path-style addressing and are signed with AWS Signature
+    Version 4 when credentials are known.
+    """
+
+    def __init__(self, endpoint=None, region=None, access_key=None, secret_key=None,
+                 session_token=None, pool_size=POOL_SIZE):
+        env = os.environ.get
+        self.region = region or env('AWS_REGION') or env('AWS_DEFAULT_REGION') or 'us-east-1'
+        self.endpoint = (endpoint or env('AWS_ENDPOINT_URL_S3') or env('AWS_ENDPOINT_URL') or
+                         'https://s3.%s.amazonaws.com' % self.region).rstrip('/')
+        self.access_key = access_key or env('AWS_ACCESS_KEY_ID')
+        self.secret_key = secret_key or env('AWS_SECRET_ACCESS_KEY')
+        self.session_token = session_token or env('AWS_SESSION_TOKEN')
+        self.pool = _ConnectionPool(self.endpoint, pool_size)
+
+    def sign(self, method, path, query_string, host, amz_date=None):
+        """Signature V4 headers for a request without a body; path and query_string are URI-encoded."""
+        if amz_date is None:
+            amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        date = amz_date[:8]
+        headers = {'host': host, 'x-amz-content-sha256': EMPTY_SHA256, 'x-amz-date': amz_date}
+        if self.session_token:
+            headers['x-amz-security-token'] = self.session_token
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([method, path, query_string,
+                                       ''.join('%s:%s\n' % (name, headers[name]) for name in sorted(headers)),
+                                       signed_headers, EMPTY_SHA256])
+        scope = '%s/%s/s3/aws4_request' % (date, self.region)
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                    hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['Authorization'] = 'AWS4-HMAC-SHA256 Credential=%s/%s, SignedHeaders=%s, Signature=%s' % (
+            self.access_key, scope, signed_headers, signature)
+        del headers['host']
+        return headers
+
+    def _request(self, method, bucket, key='', query=None):
+        path = '/' + quote(bucket, safe='') + ('/' + quote(key, safe='/') if key else '')
+        query_string = '&'.join('%s=%s' % (quote(name, safe=''), quote(value, safe=''))
+                                for name, value in sorted((query or {}).items()))
+        headers = {'Host': self.pool.netloc}
+        if self.access_key and self.secret_key:
+            headers.update(self.sign(method, path, query_string, self.pool.netloc))
+        status, body = self.pool.request(method, path + ('?' + query_string if query_string else ''), headers)
+        if status != 200:
+            code = ''
+            try:
+                code = _child_text(ElementTree.fromstring(body), 'Code')
+            except ElementTree.ParseError:
+                pass
+            raise ObjectStoreError('%s %s: HTTP %d %s' % (method, path, status, code))
+        return body
+
+    def list_objects(self, bucket, prefix=''):
+        """Yield (key, size, mtime_ns, etag) of every object whose key starts with prefix."""
+        token = None
+        while True:
+            query = {'list-type': '2', 'prefix': prefix}
+            if token:
+                query['continuation-token'] = token
+            try:
+                root = ElementTree.fromstring(self._request('GET', bucket, query=query))
+            except ElementTree.ParseError as e:
+                raise ObjectStoreError('listing %s: %s' % (bucket, e))
+            for item in root:
+                if _local_name(item.tag) == 'Contents':
+                    yield (_child_text(item, 'Key'), int(_child_text(item, 'Size') or 0),
+                           _parse_time(_child_text(item, 'LastModified')), _child_text(item, 'ETag').strip('"'))
+            token = _child_text(root, 'NextContinuationToken')
+            if _child_text(root, 'IsTruncated') != 'true' or not token:
+                return
+
+    def get_object(self, bucket, key):
+        return self._request('GET', bucket, key)
+
+
+class ObjectCache:
+    """Fetched objects on disk, at most max_bytes in total; the least recently read go first.
+
+    Files are kept at the paths they are put under, inside cache_dir. An
+    SQLite table tracks the version (ETag), size and last use of each.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=CACHE_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, version TEXT NOT NULL, '
+                           'bytes INTEGER NOT NULL, used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+        self.total_bytes = self._conn.execute('SELECT coalesce(sum(bytes), 0) FROM entries').fetchone()[0]
+
+    def _version(self, relative_path):
+        row = self._conn.execute('SELECT version FROM entries WHERE path = ?', (relative_path,)).fetchone()
+        return None if row is None else row[0]
+
+    def contains(self, path, version):
+        with self._lock:
+            return self._version(os.path.relpath(path, self.cache_dir)) == version
+
+    def get(self, path, version):
+        """The cached bytes of path if they are of version, else None."""
+        relative_path = os.path.relpath(path, self.cache_dir)
+        with self._lock:
+            if self._version(relative_path) != version:
+                return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            self._conn.execute('UPDATE entries SET used = ? WHERE path = ?', (time.time(), relative_path))
+            self._conn.commit()
+        return data
+
+    def put(self, path, version, data):
+        relative_path = os.path.relpath(path, self.cache_dir)
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            row = self._conn.execute('SELECT bytes FROM entries WHERE path = ?', (relative_path,)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                               (relative_path, version, len(data), time.time()))
+            self.total_bytes += len(data)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute('SELECT path, bytes FROM entries ORDER BY used LIMIT 64').fetchall()
+            if not rows:
+                break
+            for relative_path, nbytes in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, relative_path))
+                except OSError:
+                    pass
+                self._conn.execute('DELETE FROM entries WHERE path = ?', (relative_path,))
+                self.total_bytes -= nbytes
+
+
+def _is_safe_name(name):
+    """False for directory placeholders and names that would escape the cache directory."""
+    parts = name.split('/')
+    return bool(name) and not any(part in ('', '.', '..') for part in parts)
+
+
+class Bucket(ImageSource):
+    """The objects under one s3://bucket/prefix location."""
+
+    def __init__(self, url, client=None, cache=None):
+        self.url = url
+        self.bucket, self.prefix = parse_object_url(url)
+        self.client = client or S3Client()
+        self.cache = cache or ObjectCache()
+        host = urlsplit(self.client.endpoint).netloc.replace(':', '_')
+        self.root = os.path.join(self.cache.cache_dir, host, self.bucket, *self.prefix.split('/')[:-1])
+        self._objects = {}
+        for key, size, mtime_ns, etag in self.client.list_objects(self.bucket, self.prefix):
+            name = key[len(self.prefix):]
+            if _is_safe_name(name):
+                self._objects[name] = (mtime_ns, size, etag)
+        self._pending = {}
+        self._pending_lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=self.client.pool.size)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, name):
+        return name in self._objects
+
+    def names(self):
+        return list(self._objects)
+
+    def stat(self, name):
+        mtime_ns, size, _ = self._objects[name]
+        return mtime_ns, size
+
+    def _fetch(self, name):
+        etag = self._objects[name][2]
+        path = self.member_path(name)
+        data = self.cache.get(path, etag)
+        if data is None:
+            data = self.client.get_object(self.bucket, self.prefix + name)
+            self.cache.put(path, etag, data)
+        return data
+
+    def read(self, name):
+        """The bytes of an object, from the cache or a fetch already under way if possible."""
+        with self._pending_lock:
+            future = self._pending.get(name)
+        if future is not None and not future.cancelled():
+            return future.result()
+        return self._fetch(name)
+
+    def is_ready(self, name):
+        return name not in self._objects or self.cache.contains(self.member_path(name), self._objects[name][2])
+
+    def prefetch(self, names):
+        """Fetch the uncached names in the background, dropping earlier requests not yet started."""
+        with self._pending_lock:
+            for name, future in list(self._pending.items()):
+                if name not in names and future.cancel():
+                    del self._pending[name]
+            for name in names:
+                if name not in self._objects or name in self._pending or \
+                        self.cache.contains(self.member_path(name), self._objects[name][2]):
+                    continue
+                future = self._pending[name] = self._executor.submit(self._fetch, name)
+                future.add_done_callback(lambda _future, name=name: self._fetched(name))
+
+    def _fetched(self, name):
+        with self._pending_lock:
+            self._pending.pop(name, None)
+
+    def close(self):
+        """Stop fetching in the background."""
+        with self._pending_lock:
+            for future in self._pending.values():
+                future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def default_save_dir(self):
+        """~/redlabel_annotations/<bucket>/<prefix>."""
+        return os.path.join(os.path.expanduser("~"), 'redlabel_annotations', self.bucket,
+                            *self.prefix.split('/')[:-1])
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_object_cache():
+    """The application-wide ObjectCache under ~/.redlabelObjects."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ObjectCache()
+        return _cache
+
+
+def get_bucket(url, client=None, cache=None):
+    """List the objects at url and register them with libs.storage; returns the Bucket.
+
+    Raises ObjectStoreError (an OSError) if the listing fails.
+    """
+    bucket = Bucket(url, client, cache or get_object_cache())
+    previous = source_at(bucket.root)
+    if isinstance(previous, Bucket):
+        previous.close()
+    register_source(bucket)
+    return bucket
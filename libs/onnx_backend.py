@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+YOLO models run through ONNX Runtime on the CPU.
+
+A .pt model is exported to ONNX once, by ultralytics, and the export is
+kept next to it as ``<name>.<hash>.onnx``, named after the hash of the
+.pt file: a retrained model gets a new export and the stale one is
+removed. The export carries the class names and input size, so a model
+exported before loads without importing ultralytics or torch.
+
+Images are letterboxed into one batch and the raw output is decoded and
+suppressed with NumPy, the way ultralytics does it; the results mimic the
+ultralytics ones as far as YOLOInferenceEngine reads them.
+
+Needs onnxruntime (``pip install onnxruntime``) and OpenCV, which comes
+with ultralytics.
+"""
+import ast
+import glob
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+from libs.image_array import qimage_to_bgr
+from libs.image_decoder import decode_image
+
+# Gray of the letterbox borders, as in ultralytics.
+PAD_VALUE = 114
+
+# Defaults of ultralytics predictions.
+NMS_IOU = 0.7
+MAX_DETECTIONS = 300
+
+
+def onnx_runtime_support():
+    """True if onnxruntime is installed."""
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def default_threads():
+    """CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def onnx_cache_path(model_path, digest):
+    """Where the export of the model file with the given sha1 is kept."""
+    stem = os.path.splitext(os.path.abspath(model_path))[0]
+    return '%s.%s.onnx' % (stem, digest[:12])
+
+
+def _stale_exports(model_path, keep):
+    stem = os.path.splitext(os.path.abspath(model_path))[0]
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r'\.[0-9a-f]{12}\.onnx$')
+    return [path for path in glob.glob(glob.escape(stem) + '.*.onnx')
+            if pattern.match(os.path.basename(path)) and path != keep]
+
+
+def export_onnx(model_path, onnx_path):
+    """Export the .pt model to onnx_path with ultralytics, removing exports of older versions.
+
+    ultralytics writes the export next to its input, so a copy in a
+    temporary directory is exported; an unrelated <name>.onnx is left
+    alone.
+    """
+    from ultralytics import YOLO
+    work_dir = tempfile.mkdtemp(prefix='redlabel-onnx-')
+    try:
+        copy = os.path.join(work_dir, os.path.basename(model_path))
+        shutil.copyfile(model_path, copy)
+        exported = YOLO(copy).export(format='onnx', dynamic=True, verbose=False)
+        tmp_path = onnx_path + '.tmp'
+        shutil.move(str(exported), tmp_path)
+        os.replace(tmp_path, onnx_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    for path in _stale_exports(model_path, onnx_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return onnx_path
+
+
+def letterbox_batch(images, size):
+    """Scale BGR images into one float32 (N, 3, h, w) RGB batch, keeping their aspect ratio.
+
+    Returns the batch and the (gain, pad x, pad y) of every image, which
+    map boxes back to it.
+    """
+    import cv2
+    height, width = size
+    canvas = np.full((len(images), height, width, 3), PAD_VALUE, np.uint8)
+    transforms = []
+    for i, image in enumerate(images):
+        image_height, image_width = image.shape[:2]
+        gain = min(height / image_height, width / image_width)
+        new_width, new_height = int(round(image_width * gain)), int(round(image_height * gain))
+        left, top = (width - new_width) // 2, (height - new_height) // 2
+        if (new_width, new_height) != (image_width, image_height):
+            image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        canvas[i, top:top + new_height, left:left + new_width] = image[..., :3]
+        transforms.append((gain, left, top))
+    # BGR to RGB, HWC to CHW and 0..1 in one pass over the batch.
+    batch = np.ascontiguousarray(canvas[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32)
+    batch *= 1 / 255.0
+    return batch, transforms
+
+
+def decode_output(output, conf_threshold, transform, image_size, iou=NMS_IOU, max_det=MAX_DETECTIONS):
+    """Boxes (x1, y1, x2, y2 in the image), confidences and class ids from one raw YOLO output.
+
+    output is (4 + classes, anchors): box centre and size in the letterboxed
+    input, then a score per class.
+    """
+    from libs.yolo_inference import non_max_suppression
+    predictions = output.T
+    scores = predictions[:, 4:]
+    class_ids = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(scores)), class_ids]
+    mask = confidences >= conf_threshold
+    centres, sizes = predictions[mask, :2], predictions[mask, 2:4]
+    confidences, class_ids = confidences[mask], class_ids[mask]
+    gain, left, top = transform
+    boxes = (np.concatenate([centres - sizes / 2, centres + sizes / 2], axis=1) - (left, top, left, top)) / gain
+    image_height, image_width = image_size
+    np.clip(boxes, 0, (image_width, image_height, image_width, image_height), out=boxes)
+    keep = non_max_suppression(boxes, confidences, class_ids, iou)[:max_det]
+    return boxes[keep], confidences[keep], class_ids[keep]
+
+
+class HostArray(np.ndarray):
+    """An ndarray with the two torch.Tensor methods read from ultralytics results."""
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.view(np.ndarray)
+
+
+class ONNXBoxes(object):
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = np.asarray(xyxy, np.float32).view(HostArray)
+        self.conf = np.asarray(conf, np.float32).view(HostArray)
+        self.cls = np.asarray(cls, np.float32).view(HostArray)
+
+
+class ONNXResult(object):
+
+    def __init__(self, boxes, names):
+        self.boxes = boxes
+        self.names = names
+
+
+class ONNXModel(object):
+    """An exported YOLO model in an ONNX Runtime session, called like an ultralytics model.
+
+    The session runs one batch at a time on intra_op_threads threads,
+    which do not spin while waiting, so an idle RedLabel uses no CPU.
+    """
+
+    def __init__(self, onnx_path, intra_op_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or default_threads()
+        options.inter_op_num_threads = 1
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        self.path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata.get('names', '{}'))
+        size = ast.literal_eval(metadata.get('imgsz', '[640, 640]'))
+        self.imgsz = (size, size) if isinstance(size, int) else tuple(size)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, source, conf=0.25, iou=NMS_IOU, verbose=True):
+        """Predict a BGR array, an image path, or a list of them in one batch."""
+        sources = source if isinstance(source, list) else [source]
+        images = []
+        for item in sources:
+            if isinstance(item, str):
+                decoded = decode_image(item)
+                if decoded is None:
+                    raise RuntimeError('Could not decode %s' % item)
+                item = qimage_to_bgr(decoded)
+            images.append(item)
+        batch, transforms = letterbox_batch(images, self.imgsz)
+        outputs = self.session.run(None, {self.input_name: batch})[0]
+        results = []
+        for output, transform, image in zip(outputs, transforms, images):
+            boxes, confidences, class_ids = decode_output(output, conf, transform, image.shape[:2], iou)
+            results.append(ONNXResult(ONNXBoxes(boxes, confidences, class_ids), self.names))
+        return results
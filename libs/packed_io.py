@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Packed annotation format: every image's shapes in one SQLite file.
+
+Datasets with millions of images produce millions of tiny .xml/.txt files,
+which are slow to list, sync and back up. The packed format keeps the
+annotations of a whole save directory in a single database file and looks
+images up through its primary key.
+"""
+import os
+import sqlite3
+import threading
+
+from libs.bulk_io import list_annotation_files, read_pascal_voc_dir, read_yolo_dir
+from libs.create_ml_io import CreateMLStore, CreateMLWriter, JSON_EXT
+from libs.pascal_voc_io import PascalVocWriter, XML_EXT
+from libs.sharding import is_sharded, shard_path
+from libs.yolo_io import YOLOWriter, TXT_EXT
+
+PACKED_EXT = '.db'
+PACKED_DB_NAME = 'annotations.redlabel' + PACKED_EXT
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    filename TEXT,
+    verified INTEGER NOT NULL DEFAULT 0,
+    width INTEGER,
+    height INTEGER,
+    depth INTEGER
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    x_min REAL NOT NULL,
+    y_min REAL NOT NULL,
+    x_max REAL NOT NULL,
+    y_max REAL NOT NULL,
+    difficult INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, idx)
+) WITHOUT ROWID;
+"""
+
+
+def packed_db_path(dir_path):
+    """Path of the packed store of a save directory."""
+    return os.path.join(dir_path, PACKED_DB_NAME)
+
+
+def image_key(image_path):
+    """Images are keyed like the other formats name their label files."""
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+
+class PackedStore:
+    """One packed annotation database.
+
+    Stores are shared per path; the connection may be used from any thread.
+    """
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, db_path):
+        key = os.path.abspath(db_path)
+        with cls._stores_lock:
+            store = cls._stores.get(key)
+            if store is None:
+                store = cls._stores[key] = cls(key)
+            return store
+
+    @classmethod
+    def open_if_exists(cls, dir_path):
+        """Return the store of dir_path, or None if the directory has none."""
+        db_path = packed_db_path(dir_path)
+        with cls._stores_lock:
+            store = cls._stores.get(os.path.abspath(db_path))
+        if store is not None:
+            return store
+        return cls.open(db_path) if os.path.isfile(db_path) else None
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        with PackedStore._stores_lock:
+            PackedStore._stores.pop(self.db_path, None)
+
+    def put(self, name, boxes, filename=None, img_size=None, verified=False):
+        """Replace the annotations of image ``name``.
+
+        boxes is a list of (label, x_min, y_min, x_max, y_max, difficult).
+        """
+        height, width, depth = (list(img_size) + [None, None, None])[:3] if img_size else (None, None, None)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO images (name, filename, verified, width, height, depth) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (name, filename, int(bool(verified)), width, height, depth))
+            self._conn.execute('DELETE FROM shapes WHERE name = ?', (name,))
+            self._conn.executemany(
+                'INSERT INTO shapes (name, idx, label, x_min, y_min, x_max, y_max, difficult) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(name, idx, label, x_min, y_min, x_max, y_max, int(bool(difficult)))
+                 for idx, (label, x_min, y_min, x_max, y_max, difficult) in enumerate(boxes)])
+
+    def get(self, name):
+        """Return (boxes, verified) of image ``name``, or None if it is not stored."""
+        with self._lock:
+            row = self._conn.execute('SELECT verified FROM images WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            boxes = self._conn.execute(
+                'SELECT label, x_min, y_min, x_max, y_max, difficult FROM shapes '
+                'WHERE name = ? ORDER BY idx', (name,)).fetchall()
+        return [(label, x_min, y_min, x_max, y_max, bool(difficult))
+                for label, x_min, y_min, x_max, y_max, difficult in boxes], bool(row[0])
+
+    def image_info(self, name):
+        """Return (filename, [height, width, depth]) stored for ``name``."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT filename, height, width, depth FROM images WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], (list(row[1:]) if row[1] is not None else None)
+
+    def names(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT name FROM images ORDER BY name')]
+
+    def __contains__(self, name):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM images WHERE name = ?', (name,)).fetchone() is not None
+
+    def delete(self, name):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM shapes WHERE name = ?', (name,))
+            self._conn.execute('DELETE FROM images WHERE name = ?', (name,))
+
+
+class PackedWriter:
+
+    def __init__(self, folder_name, filename, img_size, database_src='Unknown', local_img_path=None):
+        self.folder_name = folder_name
+        self.filename = filename
+        self.database_src = database_src
+        self.img_size = img_size
+        self.box_list = []
+        self.local_img_path = local_img_path
+        self.verified = False
+
+    def add_bnd_box(self, x_min, y_min, x_max, y_max, name, difficult):
+        self.box_list.append((name, x_min, y_min, x_max, y_max, difficult))
+
+    def save(self, target_file):
+        PackedStore.open(target_file).put(image_key(self.filename), self.box_list, filename=self.filename,
+                                          img_size=self.img_size, verified=self.verified)
+
+
+class PackedReader:
+
+    def __init__(self, db_path, image_path):
+        # shapes type:
+        # [labbel, [(x1,y1), (x2,y2), (x3,y3), (x4,y4)], color, color, difficult]
+        self.shapes = []
+        self.verified = False
+        record = PackedStore.open(db_path).get(image_key(image_path))
+        if record is not None:
+            boxes, self.verified = record
+            for label, x_min, y_min, x_max, y_max, difficult in boxes:
+                points = [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)]
+                self.shapes.append((label, points, None, None, difficult))
+
+    def get_shapes(self):
+        return self.shapes
+
+
+def _image_sizes(image_paths):
+    """Map image key -> (path, [height, width, depth]) using the header probe."""
+    from libs.image_info import get_image_info
+    sizes = {}
+    for path in image_paths or ():
+        info = get_image_info(path)
+        sizes[image_key(path)] = (path, info.shape if info is not None else None)
+    return sizes
+
+
+def import_annotations(store, source_dir, source_format, image_paths=None):
+    """Copy VOC ('xml'), YOLO ('txt') or CreateML ('json') annotations into store.
+
+    YOLO boxes are normalized, so importing them needs the images
+    (``image_paths``) to learn their sizes; files without a matching image
+    are skipped. Returns the number of images imported.
+    """
+    sizes = _image_sizes(image_paths)
+    sharded = is_sharded(source_dir)
+    imported = 0
+    if source_format in ('xml', 'txt'):
+        if source_format == 'xml':
+            bulk = read_pascal_voc_dir(source_dir, recursive=sharded)
+        else:
+            bulk = read_yolo_dir(source_dir, recursive=sharded)
+        for file_index, path in enumerate(bulk.files):
+            name = image_key(path)
+            image_path, img_size = sizes.get(name, (None, None))
+            if img_size is None and bulk.sizes[file_index, 0]:
+                img_size = bulk.sizes[file_index].tolist()
+            boxes = bulk.boxes[bulk.offsets[file_index]:bulk.offsets[file_index + 1]]
+            if bulk.normalized:
+                if img_size is None:
+                    continue
+                boxes = bulk.pixel_boxes(file_index, img_size[0], img_size[1])
+            shapes = bulk.get_shapes(file_index, boxes)
+            store.put(name, [(label, points[0][0], points[0][1], points[2][0], points[2][1], difficult)
+                             for label, points, _, _, difficult in shapes],
+                      filename=os.path.basename(image_path) if image_path else None,
+                      img_size=img_size, verified=bulk.verified[file_index])
+            imported += 1
+    elif source_format == 'json':
+        for json_path in list_annotation_files(source_dir, JSON_EXT, recursive=sharded):
+            if os.path.basename(json_path).startswith('.'):
+                continue
+            try:
+                json_store = CreateMLStore.open(json_path)
+            except ValueError:
+                continue
+            for filename in json_store.images():
+                record = json_store.get(filename)
+                boxes = []
+                for annotation in record['annotations']:
+                    c = annotation['coordinates']
+                    boxes.append((annotation['label'], c['x'] - c['width'] / 2, c['y'] - c['height'] / 2,
+                                  c['x'] + c['width'] / 2, c['y'] + c['height'] / 2, False))
+                name = image_key(filename)
+                store.put(name, boxes, filename=filename, img_size=sizes.get(name, (None, None))[1],
+                          verified=record.get('verified', False))
+                imported += 1
+    else:
+        raise ValueError('Unknown annotation format: %s' % source_format)
+    return imported
+
+
+def export_annotations(store, target_dir, target_format, class_list=None):
+    """Write every image of store as VOC ('xml'), YOLO ('txt') or CreateML ('json') files.
+
+    Images whose size was never recorded are skipped for VOC and YOLO, which
+    need it. Returns the number of images exported.
+    """
+    class_list = list(class_list or [])
+    sharded = is_sharded(target_dir)
+    exported = 0
+    for name in store.names():
+        boxes, verified = store.get(name)
+        filename, img_size = store.image_info(name)
+        filename = filename or name
+        if target_format == 'json':
+            shapes = [{'label': label, 'points': [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)]}
+                      for label, x_min, y_min, x_max, y_max, _ in boxes]
+            writer = CreateMLWriter(os.path.basename(target_dir), filename, img_size, shapes,
+                                    shard_path(target_dir, name, JSON_EXT, sharded, create=True))
+            writer.verified = verified
+            writer.write()
+            exported += 1
+            continue
+        if img_size is None:
+            continue
+        if target_format == 'xml':
+            writer = PascalVocWriter(os.path.basename(target_dir), filename, img_size)
+        elif target_format == 'txt':
+            writer = YOLOWriter(os.path.basename(target_dir), filename, img_size)
+        else:
+            raise ValueError('Unknown annotation format: %s' % target_format)
+        writer.verified = verified
+        for label, x_min, y_min, x_max, y_max, difficult in boxes:
+            writer.add_bnd_box(x_min, y_min, x_max, y_max, label, difficult)
+        if target_format == 'xml':
+            writer.save(shard_path(target_dir, name, XML_EXT, sharded, create=True))
+        else:
+            writer.save(class_list, shard_path(target_dir, name, TXT_EXT, sharded, create=True))
+        exported += 1
+    return exported
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Hash-sharded layout for annotation save directories.
+
+A flat directory holding a million label files makes every lookup, listing
+and sync slow. A sharded save directory spreads them over two levels of
+hash-prefix subdirectories instead, e.g. ``<save_dir>/3f/a2/img_001.xml``,
+which keeps each directory at a few dozen entries. A marker file at the
+root tells readers and writers which layout a directory uses; classes.txt
+and the packed store always stay at the root.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from libs.constants import DEFAULT_ENCODING
+
+SHARD_MARKER = '.redlabel_sharded'
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+# Annotation files moved into shards; anything else stays at the root.
+SHARDED_EXTS = ('.xml', '.txt', '.json')
+ROOT_FILES = ('classes.txt',)
+
+
+def _is_annotation_file(filename, exts):
+    # Hidden files are caches and temporaries, not annotations.
+    return filename.lower().endswith(exts) and filename not in ROOT_FILES and not filename.startswith('.')
+
+
+def is_sharded(save_dir):
+    """True if save_dir uses the sharded layout."""
+    return bool(save_dir) and os.path.isfile(os.path.join(save_dir, SHARD_MARKER))
+
+
+def shard_subdir(name):
+    """Relative shard directory of an annotation named ``name`` (no extension)."""
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return os.path.join(*[digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)])
+
+
+def annotation_path(save_dir, image_path, ext='', sharded=None, create=False):
+    """Path of the annotation of image_path in save_dir, with ext appended.
+
+    sharded defaults to the layout of save_dir; pass it explicitly when
+    resolving many paths at once. With create, the shard directory is made.
+    """
+    return shard_path(save_dir, os.path.splitext(os.path.basename(image_path))[0], ext, sharded, create)
+
+
+def shard_path(save_dir, name, ext='', sharded=None, create=False):
+    """Like annotation_path(), for an annotation already named ``name``."""
+    if sharded is None:
+        sharded = is_sharded(save_dir)
+    if not sharded:
+        return os.path.join(save_dir, name + ext)
+    dir_path = os.path.join(save_dir, shard_subdir(name))
+    if create:
+        os.makedirs(dir_path, exist_ok=True)
+    return os.path.join(dir_path, name + ext)
+
+
+def save_dir_root(annotation_file):
+    """Save directory an annotation file belongs to, looking through shards."""
+    dir_path = os.path.dirname(os.path.abspath(annotation_file))
+    root = dir_path
+    for _ in range(SHARD_LEVELS):
+        root = os.path.dirname(root)
+    if is_sharded(root) and os.path.relpath(dir_path, root).count(os.sep) == SHARD_LEVELS - 1:
+        return root
+    return dir_path
+
+
+def annotation_names(save_dir, ext):
+    """Names (without extension) of the ext annotations in save_dir.
+
+    One directory scan per shard instead of one stat per image.
+    """
+    names = set()
+    if is_sharded(save_dir):
+        dirs = []
+        for root, subdirs, _ in os.walk(save_dir):
+            if os.path.relpath(root, save_dir).count(os.sep) == SHARD_LEVELS - 1 and root != save_dir:
+                dirs.append(root)
+                subdirs[:] = []
+    else:
+        dirs = [save_dir]
+    for dir_path in dirs:
+        try:
+            with os.scandir(dir_path) as entries:
+                names.update(e.name[:-len(ext)] for e in entries if _is_annotation_file(e.name, ext))
+        except OSError:
+            pass
+    return names
+
+
+def _is_annotation_content(path):
+    """True if the file at path parses as an annotation of its format.
+
+    The save directory is often the image directory, so other .txt, .xml
+    and .json files (READMEs, configs) must not be taken for labels.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.xml':
+            for _, element in ElementTree.iterparse(path, events=('start',)):
+                return element.tag == 'annotation'
+            return False
+        with open(path, 'r', encoding=DEFAULT_ENCODING) as f:
+            if ext == '.json':
+                data = json.load(f)
+                return isinstance(data, list) and all(
+                    isinstance(record, dict) and 'image' in record and 'annotations' in record for record in data)
+            for line in f:
+                fields = line.split()
+                if fields and (len(fields) != 5 or not fields[0].isdigit()):
+                    return False
+                for field in fields[1:]:
+                    float(field)
+            return True
+    except (OSError, ValueError, ElementTree.ParseError):
+        return False
+
+
+def _move_into_shard(save_dir, filename, image_names):
+    """Move filename into its shard if it is an annotation; True if it was moved."""
+    name, ext = os.path.splitext(filename)
+    path = os.path.join(save_dir, filename)
+    if name not in image_names and not _is_annotation_content(path):
+        return False
+    os.replace(path, shard_path(save_dir, name, ext, sharded=True, create=True))
+    return True
+
+
+def reshard(save_dir, workers=None, progress=None, image_paths=()):
+    """Move the annotations of a flat save_dir into shards and mark it sharded.
+
+    A file is moved if its name matches one of image_paths or, failing
+    that, if it parses as an annotation of its format; classes.txt and
+    any other file stay at the root. Files are moved by a thread pool,
+    since the work is dominated by rename latency on network file
+    systems. Safe to re-run after an interruption: the marker is only
+    written once every file has moved. Returns the number of files moved.
+    """
+    image_names = set(os.path.splitext(os.path.basename(path))[0] for path in image_paths)
+    with os.scandir(save_dir) as entries:
+        filenames = [e.name for e in entries
+                     if e.is_file() and _is_annotation_file(e.name, SHARDED_EXTS)]
+    done = moved = 0
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+        for was_moved in executor.map(lambda filename: _move_into_shard(save_dir, filename, image_names), filenames):
+            done += 1
+            moved += was_moved
+            if progress is not None:
+                progress(done, len(filenames))
+    with open(os.path.join(save_dir, SHARD_MARKER), 'w') as f:
+        f.write('%d %d\n' % (SHARD_LEVELS, SHARD_WIDTH))
+    return moved
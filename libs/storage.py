@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Image sources behind virtual paths.
+
+Images need not sit in a directory: they can be members of a zip or tar
+archive (libs.archive_source), objects in an S3-compatible bucket
+(libs.object_store) or frames of a video (libs.video_source). Such a source is registered here under a root path,
+and its images get paths below it, ``<root>/<name>``, which sort, display
+and name their annotations like the files of a directory. The functions
+below accept both kinds of path, so the decoders, probes and caches do not
+need to know where an image lives.
+"""
+import io
+import os
+import threading
+
+try:
+    from PyQt5.QtCore import QThread, pyqtSignal
+except ImportError:
+    from PyQt4.QtCore import QThread, pyqtSignal
+
+# Images after the current one that remote sources start fetching.
+READ_AHEAD = 8
+
+
+class ImageSource:
+    """Images under a root path, read through a backend rather than the file system.
+
+    Names are '/'-separated and relative to the root.
+    """
+
+    root = None
+
+    def names(self):
+        """Names of the images, in source order."""
+        raise NotImplementedError
+
+    def __contains__(self, name):
+        raise NotImplementedError
+
+    def stat(self, name):
+        """(mtime_ns, size) of an image."""
+        raise NotImplementedError
+
+    def read(self, name):
+        """The bytes of an image; raises KeyError if it does not exist and OSError if it cannot be read."""
+        raise NotImplementedError
+
+    def decode(self, name, max_size=None):
+        """A QImage of name for sources that produce pixels rather than files, else None."""
+        return None
+
+    def probe(self, name):
+        """The ImageInfo of name if the source knows it without reading the image, else None."""
+        return None
+
+    def is_ready(self, name):
+        """False if reading name would wait for a slow fetch; sources with slow reads override this."""
+        return True
+
+    def prefetch(self, names):
+        """Start reading names in the background; sources with slow reads override this."""
+
+    def default_save_dir(self):
+        """Local directory for the annotations of this source."""
+        raise NotImplementedError
+
+    def member_path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def register_source(source):
+    """Make the images of source reachable through its paths, replacing any source with the same root."""
+    with _sources_lock:
+        _sources[source.root] = source
+
+
+def source_at(root):
+    """The source registered at root, or None."""
+    return _sources.get(root)
+
+
+def split_member_path(path):
+    """(source, name) if path is an image of a registered source, else None."""
+    if not _sources:
+        return None
+    for root, source in list(_sources.items()):
+        if path.startswith(root + os.sep):
+            name = path[len(root) + 1:].replace(os.sep, '/')
+            if name in source:
+                return source, name
+    return None
+
+
+def read_member(path):
+    """The bytes of path if it belongs to a registered source, else None."""
+    member = split_member_path(path)
+    return None if member is None else member[0].read(member[1])
+
+
+def open_image(path):
+    """A binary file object over an image file or source member."""
+    data = read_member(path)
+    return open(path, 'rb') if data is None else io.BytesIO(data)
+
+
+def decode_member(path, max_size=None):
+    """The QImage a registered source decodes for path itself, or None to decode its bytes."""
+    member = split_member_path(path)
+    return None if member is None else member[0].decode(member[1], max_size)
+
+
+def probe_member(path):
+    """The ImageInfo a registered source knows for path, or None."""
+    member = split_member_path(path)
+    return None if member is None else member[0].probe(member[1])
+
+
+def image_stat(path):
+    """(mtime_ns, size) of an image file or source member; raises OSError if it is missing."""
+    member = split_member_path(path)
+    if member is not None:
+        return member[0].stat(member[1])
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def member_ready(path):
+    """False if path is an image of a source that would have to fetch it first."""
+    member = split_member_path(path)
+    return member is None or member[0].is_ready(member[1])
+
+
+def image_exists(path):
+    return split_member_path(path) is not None or os.path.exists(path)
+
+
+def prefetch(paths):
+    """Let the sources of paths start reading them in the background."""
+    by_source = {}
+    for path in paths:
+        member = split_member_path(path)
+        if member is not None:
+            by_source.setdefault(member[0], []).append(member[1])
+    for source, names in by_source.items():
+        source.prefetch(names)
+
+
+class SourceWorker(QThread):
+    """Runs one slow call, such as listing a bucket, indexing an archive or fetching an image, in the background."""
+
+    succeeded = pyqtSignal(object)  # what the call returned
+    failed = pyqtSignal(str)
+
+    def __init__(self, function, parent=None):
+        super(SourceWorker, self).__init__(parent)
+        self.function = function
+
+    def run(self):
+        try:
+            result = self.function()
+        except Exception as e:
+            self.failed.emit(str(e) or e.__class__.__name__)
+            return
+        self.succeeded.emit(result)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Thumbnail grid for browsing large image directories.
+
+Thumbnails are decoded at reduced size (the JPEG decoders scale during the
+DCT), stored as small JPEGs in a size-bounded on-disk cache shared by every
+directory, and generated by a thread pool only for the cells the view
+actually asks for. The most recently requested
+cells are served first, so fast scrolling never waits behind thumbnails
+that already left the screen.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import *
+except ImportError:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+from libs.cache_manager import CacheManager, PRIORITY_LOW
+from libs.image_decoder import decode_image
+from libs.storage import image_stat
+
+THUMBNAIL_SIZE = 128
+
+
+def default_cache_dir():
+    return os.path.join(os.path.expanduser("~"), '.redlabelThumbnails')
+
+
+class ThumbnailCache:
+    """JPEG thumbnails on disk, keyed by image path, mtime and size.
+
+    An SQLite table tracks each entry's size and last use; when the cache
+    grows past max_bytes the least recently used entries are deleted.
+    """
+
+    # Last-use times are written back in batches of this many hits.
+    TOUCH_BATCH = 256
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.size = size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                           '(key TEXT PRIMARY KEY, bytes INTEGER NOT NULL, used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+        self.total_bytes = self._conn.execute('SELECT coalesce(sum(bytes), 0) FROM entries').fetchone()[0]
+        self._touched = {}
+
+    def _key(self, path):
+        try:
+            mtime_ns, size = image_stat(path)
+        except OSError:
+            return None
+        source = '%s|%d|%d|%d' % (os.path.abspath(path), mtime_ns, size, self.size)
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.jpg')
+
+    def get(self, path):
+        """Return the cached thumbnail QImage of path, or None."""
+        key = self._key(path)
+        if key is None:
+            return None
+        image = QImage(self._file(key))
+        if image.isNull():
+            return None
+        with self._lock:
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.TOUCH_BATCH:
+                self._flush_touched()
+        return image
+
+    def _flush_touched(self):
+        touched, self._touched = self._touched, {}
+        with self._conn:
+            self._conn.executemany('UPDATE entries SET used = ? WHERE key = ?',
+                                   [(used, key) for key, used in touched.items()])
+
+    def put(self, path, image):
+        key = self._key(path)
+        if key is None:
+            return
+        file_path = self._file(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (file_path, threading.get_ident())
+        if not image.save(tmp_path, 'JPG', 85):
+            return
+        os.replace(tmp_path, file_path)
+        size = os.path.getsize(file_path)
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute('SELECT bytes FROM entries WHERE key = ?', (key,)).fetchone()
+                self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (key, size, time.time()))
+            self.total_bytes += size - (row[0] if row else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is at 90% of its budget."""
+        self._flush_touched()
+        target = self.max_bytes * 0.9
+        evicted = []
+        for key, size in self._conn.execute('SELECT key, bytes FROM entries ORDER BY used'):
+            if self.total_bytes <= target:
+                break
+            evicted.append(key)
+            self.total_bytes -= size
+        with self._conn:
+            self._conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in evicted])
+        for key in evicted:
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._touched:
+                self._flush_touched()
+            self._conn.close()
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Decode path straight to at most size x size pixels."""
+    image = decode_image(path, size)
+    if image is None:
+        return QImage()
+    # Decoders scale by powers of two at best; finish the job here.
+    if image.width() > size or image.height() > size:
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
+
+
+class _LoaderSignals(QObject):
+    thumbnail_ready = pyqtSignal(str, QImage)
+
+
+class _LoaderRunnable(QRunnable):
+
+    def __init__(self, loader):
+        super(_LoaderRunnable, self).__init__()
+        self.loader = loader
+
+    def run(self):
+        self.loader._work()
+
+
+class ThumbnailLoader(QObject):
+    """Produces thumbnails on a QThreadPool, newest requests first."""
+
+    thumbnail_ready = pyqtSignal(str, QImage)
+
+    # Requests older than this many newer ones are dropped.
+    MAX_QUEUED = 512
+
+    def __init__(self, cache=None, parent=None):
+        super(ThumbnailLoader, self).__init__(parent)
+        self.cache = cache
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max(1, min(4, QThread.idealThreadCount() - 1)))
+        self._queue = deque()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._runners = 0
+        self._signals = _LoaderSignals()
+        self._signals.thumbnail_ready.connect(self.thumbnail_ready)
+
+    def request(self, path):
+        with self._lock:
+            if path in self._queued:
+                return
+            self._queue.append(path)
+            self._queued.add(path)
+            while len(self._queue) > self.MAX_QUEUED:
+                self._queued.discard(self._queue.popleft())
+            start = self._runners < self._pool.maxThreadCount()
+            if start:
+                self._runners += 1
+        if start:
+            self._pool.start(_LoaderRunnable(self))
+
+    def clear(self):
+        with self._lock:
+            self._queue.clear()
+            self._queued.clear()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._runners -= 1
+                    return
+                path = self._queue.pop()
+            try:
+                image = self._thumbnail(path)
+            except Exception:
+                # An exception escaping a QRunnable aborts the application.
+                image = QImage()
+            with self._lock:
+                self._queued.discard(path)
+            self._signals.thumbnail_ready.emit(path, image)
+
+    def _thumbnail(self, path):
+        image = self.cache.get(path) if self.cache is not None else None
+        if image is None:
+            image = make_thumbnail(path)
+            if not image.isNull() and self.cache is not None:
+                try:
+                    self.cache.put(path, image)
+                except (OSError, sqlite3.Error):
+                    pass
+        return image
+
+    def wait(self):
+        self.clear()
+        self._pool.waitForDone()
+
+
+class ThumbnailModel(QAbstractListModel):
+    """The images of m_img_list with lazily loaded thumbnails and box-count badges."""
+
+    BadgeRole = Qt.UserRole + 1
+    VerifiedRole = Qt.UserRole + 2
+
+    # Memory for decoded thumbnails (about 64 KB each), within the global cache budget.
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, loader, parent=None, cache=None):
+        super(ThumbnailModel, self).__init__(parent)
+        self.loader = loader
+        self.loader.thumbnail_ready.connect(self._on_thumbnail_ready)
+        self.paths = []
+        self._rows = {}
+        if cache is None:
+            cache = CacheManager.instance().register('thumbnails', PRIORITY_LOW, self.MAX_BYTES)
+        self._pixmaps = cache
+        self._badges = {}
+        self._verified = set()
+        self._key = lambda path: os.path.splitext(os.path.basename(path))[0]
+        self._placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self._placeholder.fill(QColor(220, 220, 220))
+
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self.loader.clear()
+        self.paths = list(paths)
+        self._rows = {path: i for i, path in enumerate(self.paths)}
+        self.endResetModel()
+
+    def set_badges(self, box_counts, verified=()):
+        """box_counts maps image key -> number of boxes; verified is a set of keys."""
+        self._badges = box_counts
+        self._verified = set(verified)
+        if self.paths:
+            self.dataChanged.emit(self.index(0), self.index(len(self.paths) - 1), [self.BadgeRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DecorationRole:
+            pixmap = self._pixmaps.get(path)
+            if pixmap is None:
+                self.loader.request(path)
+                return self._placeholder
+            return pixmap
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        if role == Qt.ToolTipRole:
+            return path
+        if role == self.BadgeRole:
+            return self._badges.get(self._key(path))
+        if role == self.VerifiedRole:
+            return self._key(path) in self._verified
+        return None
+
+    def _on_thumbnail_ready(self, path, image):
+        row = self._rows.get(path)
+        if row is None or image.isNull():
+            return
+        self._pixmaps.put(path, QPixmap.fromImage(image))
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    """Draws the box count in the corner of each thumbnail, green when verified."""
+
+    def paint(self, painter, option, index):
+        super(ThumbnailDelegate, self).paint(painter, option, index)
+        count = index.data(ThumbnailModel.BadgeRole)
+        if count is None:
+            return
+        text = str(count)
+        rect = QRect(option.rect.right() - 6 - 8 * len(text) - 8, option.rect.top() + 4, 8 * len(text) + 8, 16)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(40, 160, 60) if index.data(ThumbnailModel.VerifiedRole) else QColor(200, 60, 40))
+        painter.drawRoundedRect(rect, 8, 8)
+        painter.setPen(Qt.white)
+        painter.drawText(rect, Qt.AlignCenter, text)
+        painter.restore()
+
+
+def create_thumbnail_view(model, parent=None):
+    """A QListView laid out as a uniform grid, suitable for 100k+ items."""
+    view = QListView(parent)
+    view.setViewMode(QListView.IconMode)
+    view.setResizeMode(QListView.Adjust)
+    view.setMovement(QListView.Static)
+    view.setUniformItemSizes(True)
+    view.setLayoutMode(QListView.Batched)
+    view.setBatchSize(2000)
+    view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    view.setGridSize(QSize(THUMBNAIL_SIZE + 16, THUMBNAIL_SIZE + 28))
+    view.setTextElideMode(Qt.ElideMiddle)
+    view.setModel(model)
+    view.setItemDelegate(ThumbnailDelegate(view))
+    return view
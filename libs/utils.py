@@ -97,15 +97,31 @@ def util_qt_strlistclass():
     return QStringList if have_qstring() else list
 
 
+def natural_sort_key(text):
+    """Key that orders strings in natural alphanumeric order."""
+    return [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', text)]
+
+
 def natural_sort(list, key=lambda s:s):
     """
     Sort the list into natural alphanumeric order.
     """
-    def get_alphanum_key_func(key):
-        convert = lambda text: int(text) if text.isdigit() else text
-        return lambda s: [convert(c) for c in re.split('([0-9]+)', key(s))]
-    sort_key = get_alphanum_key_func(key)
-    list.sort(key=sort_key)
+    list.sort(key=lambda s: natural_sort_key(key(s)))
+
+
+def natural_insert_position(sorted_list, item, key=lambda s:s):
+    """
+    Position at which item keeps a natural_sort()ed list sorted (after equal items).
+    """
+    item_key = natural_sort_key(key(item))
+    lo, hi = 0, len(sorted_list)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if item_key < natural_sort_key(key(sorted_list[mid])):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
 
 
 # QT4 has a trimmed method, in QT5 this is called strip
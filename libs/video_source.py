@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Frames of a video file, decoded on demand.
+
+Opening a video builds an index of its frames once, by demuxing the file
+without decoding: the timestamp of every frame and which frames are
+keyframes. Like the archive index it is stored, under ~/.redlabelVideos,
+and reused while the video keeps its mtime and size. A frame is decoded by
+seeking to the keyframe before it and decoding forward; stepping to the
+next frame continues from the current position instead of seeking again.
+Decoded frames are kept in a 'video frames' cache of the CacheManager, and
+the frames after the current one are decoded in the background (see
+libs.storage.prefetch), so stepping through a video with d and a rarely
+waits.
+
+Frames are addressed by virtual paths (see libs.storage) such as
+``/data/cam1.mp4/frame_000123.png``, numbered in presentation order from
+0. Their annotations are named after them, in any format, e.g.
+``cam1_annotations/frame_000123.xml``; no image is ever written to disk.
+
+Reading videos needs PyAV (``pip install av``).
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, Qt
+    from PyQt5.QtGui import QImage
+except ImportError:
+    from PyQt4.QtCore import QBuffer, QByteArray, QIODevice, Qt
+    from PyQt4.QtGui import QImage
+
+from libs.cache_manager import PRIORITY_NORMAL, CacheManager
+from libs.constants import DEFAULT_ENCODING
+from libs.image_array import pixel_rows
+from libs.image_info import ImageInfo
+from libs.storage import READ_AHEAD, ImageSource, register_source, source_at
+
+VIDEO_EXTS = ('.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.ts')
+
+# Bumped when the layout of the stored index changes.
+INDEX_VERSION = 1
+
+# Decoded frames kept in memory over all videos; about 200 1080p frames.
+FRAME_CACHE_BYTES = 400 * 1024 * 1024
+
+FRAME_PREFIX = 'frame_'
+FRAME_EXT = '.png'
+
+
+def default_index_dir():
+    return os.path.join(os.path.expanduser("~"), '.redlabelVideos')
+
+
+def video_support():
+    """True if PyAV is installed."""
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def is_video(path):
+    """True if path is a video file by its extension."""
+    return bool(path) and path.lower().endswith(VIDEO_EXTS) and os.path.isfile(path)
+
+
+def _scan_frames(path):
+    """Width, height, sorted frame timestamps and keyframe numbers of the first video stream."""
+    import av
+    with av.open(path) as container:
+        if not container.streams.video:
+            raise ValueError('%s has no video stream' % path)
+        stream = container.streams.video[0]
+        timestamps, keyframe_pts = [], []
+        for packet in container.demux(stream):
+            pts = packet.pts if packet.pts is not None else packet.dts
+            # The final packet of the demuxer is empty and carries no frame.
+            if pts is None or packet.size == 0:
+                continue
+            timestamps.append(pts)
+            if packet.is_keyframe:
+                keyframe_pts.append(pts)
+        width, height = stream.codec_context.width, stream.codec_context.height
+    # Packets come in decode order; frames are numbered in presentation order.
+    timestamps = sorted(set(timestamps))
+    numbers = dict((pts, number) for number, pts in enumerate(timestamps))
+    keyframes = sorted(numbers[pts] for pts in set(keyframe_pts))
+    if not keyframes or keyframes[0] != 0:
+        keyframes.insert(0, 0)
+    return {'width': width, 'height': height, 'pts': timestamps, 'keyframes': keyframes}
+
+
+def _image_from_frame(frame):
+    """Copy a decoded av.VideoFrame into a new RGB32 QImage."""
+    image = QImage(frame.width, frame.height, QImage.Format_RGB32)
+    pixel_rows(image, writable=True).reshape(frame.height, frame.width, 4)[...] = frame.to_ndarray(format='bgra')
+    return image
+
+
+class Video(ImageSource):
+    """The frame index of one video file, and decoding of its frames."""
+
+    def __init__(self, path, index_dir=None):
+        self.path = self.root = os.path.abspath(path)
+        st = os.stat(self.path)
+        self.mtime_ns, self.size = st.st_mtime_ns, st.st_size
+        digest = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        self.index_path = os.path.join(index_dir or default_index_dir(), digest + '.json')
+        index = self._load_index()
+        if index is None:
+            index = _scan_frames(self.path)
+            self._save_index(index)
+        self.width, self.height = index['width'], index['height']
+        self._pts = index['pts']
+        self._numbers = dict((pts, number) for number, pts in enumerate(self._pts))
+        self._keyframes = index['keyframes']
+        self._digits = max(6, len(str(len(self._pts) - 1)))
+        self.cache = CacheManager.instance().register('video frames', PRIORITY_NORMAL, FRAME_CACHE_BYTES)
+        # The container and decoder state are used by one thread at a time.
+        self._lock = threading.Lock()
+        self._container = None
+        self._frames = None
+        self._position = None
+        self._pending = {}
+        self._pending_lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self):
+        return len(self._pts)
+
+    def __contains__(self, name):
+        return self.frame_number(name) is not None
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding=DEFAULT_ENCODING) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get('version') != INDEX_VERSION or saved.get('path') != self.path or \
+                saved.get('mtime_ns') != self.mtime_ns or saved.get('size') != self.size:
+            return None
+        return saved
+
+    def _save_index(self, index):
+        data = dict(index, version=INDEX_VERSION, path=self.path, mtime_ns=self.mtime_ns, size=self.size)
+        tmp_path = self.index_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp_path, 'w', encoding=DEFAULT_ENCODING) as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def frame_name(self, number):
+        return '%s%0*d%s' % (FRAME_PREFIX, self._digits, number, FRAME_EXT)
+
+    def frame_number(self, name):
+        """The frame number of a frame name, or None if it names no frame."""
+        if not (name.startswith(FRAME_PREFIX) and name.endswith(FRAME_EXT)):
+            return None
+        digits = name[len(FRAME_PREFIX):-len(FRAME_EXT)]
+        if len(digits) != self._digits or not digits.isdigit():
+            return None
+        number = int(digits)
+        return number if number < len(self._pts) else None
+
+    def names(self):
+        """Names of the frames, in presentation order."""
+        return [self.frame_name(number) for number in range(len(self._pts))]
+
+    def stat(self, name):
+        """(mtime_ns, size) of the video; frames change only with it."""
+        return self.mtime_ns, self.size
+
+    def probe(self, name):
+        return ImageInfo(self.width, self.height, 3, 1)
+
+    def _decode_frame(self, number):
+        """Decode frame number, seeking only if it is behind or past the next keyframe."""
+        import av
+        key = (self.path, number)
+        with self._lock:
+            image = self.cache.get(key)
+            if image is not None:
+                return image
+            if self._container is None:
+                self._container = av.open(self.path)
+                self._container.streams.video[0].thread_type = 'AUTO'
+            keyframe = self._keyframes[bisect.bisect_right(self._keyframes, number) - 1]
+            if self._position is None or not keyframe <= self._position < number:
+                stream = self._container.streams.video[0]
+                self._container.seek(self._pts[keyframe], stream=stream, backward=True, any_frame=False)
+                self._frames = self._container.decode(stream)
+                self._position = None
+                # Frames decoded on the way are kept for stepping back with a.
+                keep_from = number - READ_AHEAD
+            else:
+                keep_from = number
+            try:
+                for frame in self._frames:
+                    position = self._numbers.get(frame.pts)
+                    if position is None:
+                        continue
+                    self._position = position
+                    if keep_from <= position < number and (self.path, position) not in self.cache:
+                        self.cache.put((self.path, position), _image_from_frame(frame))
+                    elif position == number:
+                        image = _image_from_frame(frame)
+                        self.cache.put(key, image)
+                        return image
+                    elif position > number:
+                        break
+            except av.error.FFmpegError as e:
+                self._position = None
+                raise OSError('%s: frame %d: %s' % (self.path, number, e))
+            self._position = None
+        raise OSError('%s: frame %d cannot be decoded' % (self.path, number))
+
+    def _frame_image(self, name):
+        number = self.frame_number(name)
+        if number is None:
+            raise KeyError(name)
+        with self._pending_lock:
+            future = self._pending.get(number)
+        if future is not None and not future.cancelled():
+            return future.result()
+        return self._decode_frame(number)
+
+    def decode(self, name, max_size=None):
+        image = self._frame_image(name)
+        if max_size and (image.width() > max_size or image.height() > max_size):
+            return image.scaled(max_size, max_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        return image
+
+    def read(self, name):
+        """The frame as PNG bytes, for readers that need a file; the decoders use decode()."""
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        self._frame_image(name).save(buffer, 'PNG')
+        return bytes(data)
+
+    def prefetch(self, names):
+        """Decode the uncached frames in the background, dropping earlier requests not yet started."""
+        numbers = [number for number in map(self.frame_number, names) if number is not None]
+        with self._pending_lock:
+            for number, future in list(self._pending.items()):
+                if number not in numbers and future.cancel():
+                    del self._pending[number]
+            for number in numbers:
+                if number in self._pending or (self.path, number) in self.cache:
+                    continue
+                future = self._pending[number] = self._executor.submit(self._decode_frame, number)
+                future.add_done_callback(lambda _future, number=number: self._decoded(number))
+
+    def _decoded(self, number):
+        with self._pending_lock:
+            self._pending.pop(number, None)
+
+    def close(self):
+        """Stop decoding in the background and close the file."""
+        with self._pending_lock:
+            for future in self._pending.values():
+                future.cancel()
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            if self._container is not None:
+                self._container.close()
+                self._container = None
+                self._frames = None
+                self._position = None
+
+    def default_save_dir(self):
+        """<video name>_annotations next to the video."""
+        return os.path.splitext(self.path)[0] + '_annotations'
+
+
+_videos_lock = threading.Lock()
+
+
+def get_video(path, index_dir=None):
+    """The Video at path, indexed on first use and again whenever the file changes.
+
+    The video is registered with libs.storage, so its frame paths can be
+    decoded like image files. Raises ImportError without PyAV, OSError
+    for unreadable files and ValueError for files without a video stream.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    with _videos_lock:
+        video = source_at(path)
+        if not isinstance(video, Video) or (video.mtime_ns, video.size) != (st.st_mtime_ns, st.st_size):
+            if isinstance(video, Video):
+                video.close()
+            video = Video(path, index_dir)
+            register_source(video)
+        return video
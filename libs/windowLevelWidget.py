@@ -0,0 +1,61 @@
+try:
+    from PyQt5.QtGui import *
+    from PyQt5.QtCore import *
+    from PyQt5.QtWidgets import *
+except ImportError:
+    from PyQt4.QtGui import *
+    from PyQt4.QtCore import *
+
+
+class WindowLevelWidget(QWidget):
+    """Level (window centre) and window width sliders for 16-bit images."""
+
+    window_changed = pyqtSignal(float, float)  # level, window
+    auto_requested = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(WindowLevelWidget, self).__init__(parent)
+        self.level_slider = self._slider(0, 65535)
+        self.window_slider = self._slider(1, 65535)
+        self.value_label = QLabel('')
+        self.value_label.setStyleSheet("color: #666; font-size: 11px;")
+        auto_button = QPushButton('Auto')
+        auto_button.setToolTip('Window the 0.5-99.5 percentile range of the image')
+        auto_button.clicked.connect(self.auto_requested)
+
+        layout = QGridLayout(self)
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.addWidget(QLabel('Level'), 0, 0)
+        layout.addWidget(self.level_slider, 0, 1)
+        layout.addWidget(QLabel('Window'), 1, 0)
+        layout.addWidget(self.window_slider, 1, 1)
+        layout.addWidget(self.value_label, 2, 0, 1, 2)
+        layout.addWidget(auto_button, 0, 2, 2, 1)
+
+    def _slider(self, minimum, maximum):
+        slider = QSlider(Qt.Horizontal)
+        slider.setRange(minimum, maximum)
+        slider.valueChanged.connect(self._on_slider_moved)
+        return slider
+
+    def set_range(self, maximum):
+        """Limit both sliders to sample values up to maximum, e.g. 4095 for 12-bit data."""
+        for slider in (self.level_slider, self.window_slider):
+            slider.blockSignals(True)
+            slider.setMaximum(maximum)
+            slider.blockSignals(False)
+
+    def set_window(self, level, window):
+        """Show level and window without emitting window_changed."""
+        for slider, value in ((self.level_slider, level), (self.window_slider, window)):
+            slider.blockSignals(True)
+            slider.setValue(int(round(value)))
+            slider.blockSignals(False)
+        self._update_label()
+
+    def _update_label(self):
+        self.value_label.setText('L %d  W %d' % (self.level_slider.value(), self.window_slider.value()))
+
+    def _on_slider_moved(self, _value):
+        self._update_label()
+        self.window_changed.emit(float(self.level_slider.value()), float(self.window_slider.value()))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+A work queue that shares one image set between many annotators.
+
+The queue hands out images in batches under leases. A lease lasts
+lease_seconds and is kept alive by heartbeats from the client. When a
+lease expires, e.g. because a workstation crashed, its unfinished images
+go back to the queue. A saved annotation is sent to the queue with the
+lease it was made under; the queue writes it to its save directory, in
+the same subdirectories as the image, and marks the image done. Saves
+under a lost lease are refused, so two annotators never overwrite each
+other's work.
+
+WorkQueue keeps its state in an SQLite database. WorkQueueServer serves
+it as JSON over HTTP with the standard library only, and
+WorkQueueClient is the matching client. Images are named by their
+'/'-separated path relative to the image directory, which each client
+resolves against its own copy or mount of the data.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from libs.constants import DEFAULT_ENCODING
+from libs.sharding import is_sharded, shard_path
+
+DEFAULT_PORT = 8765
+LEASE_SECONDS = 600
+BATCH_SIZE = 20
+# Completions counted for the images-per-hour rate of each client.
+THROUGHPUT_WINDOW = 600
+
+ANNOTATION_EXTS = ('.xml', '.txt')
+CLASSES_FILE = 'classes.txt'
+
+PENDING, LEASED, DONE = 'pending', 'leased', 'done'
+
+
+class LeaseError(Exception):
+    """The lease does not exist (any more) or belongs to another client."""
+
+
+class WorkQueue:
+    """Images, leases and per-client counters in one SQLite database."""
+
+    def __init__(self, db_path, save_dir, lease_seconds=LEASE_SECONDS):
+        self.save_dir = save_dir
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, state TEXT NOT NULL, lease TEXT,
+                                               client TEXT, done REAL);
+            CREATE INDEX IF NOT EXISTS images_state ON images (state);
+            CREATE INDEX IF NOT EXISTS images_lease ON images (lease);
+            CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, client TEXT NOT NULL, expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS clients (name TEXT PRIMARY KEY, leased INTEGER NOT NULL DEFAULT 0,
+                                                completed INTEGER NOT NULL DEFAULT 0,
+                                                expired INTEGER NOT NULL DEFAULT 0, last_seen REAL);
+        ''')
+        self._conn.commit()
+
+    def add_images(self, names):
+        """Queue names that are not known yet; returns how many were added."""
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO images (name, state) VALUES (?, 'pending')",
+                                   ((name,) for name in names))
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def _seen(self, client, now, **increments):
+        self._conn.execute('INSERT OR IGNORE INTO clients (name) VALUES (?)', (client,))
+        updates = ''.join(', %s = %s + %d' % (column, column, value) for column, value in increments.items())
+        self._conn.execute('UPDATE clients SET last_seen = ?%s WHERE name = ?' % updates, (now, client))
+
+    def _expire(self, now):
+        for lease_id, client in self._conn.execute('SELECT id, client FROM leases WHERE expires < ?', (now,)).fetchall():
+            returned = self._conn.execute("UPDATE images SET state = 'pending', lease = NULL, client = NULL "
+                                          "WHERE lease = ? AND state = 'leased'", (lease_id,)).rowcount
+            self._conn.execute('DELETE FROM leases WHERE id = ?', (lease_id,))
+            self._conn.execute('UPDATE clients SET expired = expired + ? WHERE name = ?', (returned, client))
+
+    def _check_lease(self, client, lease_id, now):
+        row = self._conn.execute('SELECT client FROM leases WHERE id = ? AND expires >= ?', (lease_id, now)).fetchone()
+        if row is None or row[0] != client:
+            raise LeaseError('lease %s is not held by %s' % (lease_id, client))
+
+    def lease(self, client, count=BATCH_SIZE):
+        """Lease up to count pending images: {'lease', 'expires', 'images'}; no lease if none are left."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            names = [row[0] for row in self._conn.execute(
+                "SELECT name FROM images WHERE state = 'pending' ORDER BY rowid LIMIT ?", (count,))]
+            lease_id, expires = None, None
+            if names:
+                lease_id, expires = uuid.uuid4().hex, now + self.lease_seconds
+                self._conn.execute('INSERT INTO leases VALUES (?, ?, ?)', (lease_id, client, expires))
+                self._conn.executemany("UPDATE images SET state = 'leased', lease = ?, client = ? WHERE name = ?",
+                                       ((lease_id, client, name) for name in names))
+            self._seen(client, now, leased=len(names))
+            self._conn.commit()
+        return {'lease': lease_id, 'expires': expires, 'images': names}
+
+    def heartbeat(self, client, lease_id):
+        """Extend a lease; returns its new expiry time. Raises LeaseError if it was lost."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._check_lease(client, lease_id, now)
+            expires = now + self.lease_seconds
+            self._conn.execute('UPDATE leases SET expires = ? WHERE id = ?', (expires, lease_id))
+            self._seen(client, now)
+            self._conn.commit()
+        return expires
+
+    def release(self, client, lease_id):
+        """Give the unfinished images of a lease back to the queue."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE images SET state = 'pending', lease = NULL, client = NULL "
+                               "WHERE lease = ? AND client = ? AND state = 'leased'", (lease_id, client))
+            self._conn.execute('DELETE FROM leases WHERE id = ? AND client = ?', (lease_id, client))
+            self._seen(client, now)
+            self._conn.commit()
+
+    def complete(self, client, lease_id, name, files):
+        """Store the annotation files of a leased image and mark it done.
+
+        files maps file names (the image's name with .xml or .txt, and
+        classes.txt) to their text. Raises LeaseError if the lease was lost
+        and ValueError for files the queue does not accept.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._check_lease(client, lease_id, now)
+            row = self._conn.execute('SELECT lease, state FROM images WHERE name = ?', (name,)).fetchone()
+            if row is None or row[0] != lease_id:
+                raise LeaseError('%s is not part of lease %s' % (name, lease_id))
+            self._write_files(name, files)
+            if row[1] != DONE:
+                self._conn.execute("UPDATE images SET state = 'done', done = ? WHERE name = ?", (now, name))
+                self._seen(client, now, completed=1)
+            else:
+                # A second save of the same image replaces the first.
+                self._seen(client, now)
+            self._conn.commit()
+
+    def _write_files(self, name, files):
+        # Annotations mirror the image tree, so a/1.jpg and b/1.jpg do not overwrite each other.
+        parts = name.split('/')
+        if not isinstance(files, dict) or any(part in ('', '.', '..') for part in parts):
+            raise ValueError('unexpected annotation files for %s' % name)
+        stem = os.path.splitext(parts[-1])[0]
+        sharded = is_sharded(self.save_dir)
+        writes = []
+        for filename, text in files.items():
+            if not isinstance(text, str):
+                raise ValueError('annotation file %r is not text' % filename)
+            if filename == CLASSES_FILE:
+                writes.append((os.path.join(self.save_dir, CLASSES_FILE), self._merged_classes(text)))
+                continue
+            base, ext = os.path.splitext(filename)
+            if base != stem or ext.lower() not in ANNOTATION_EXTS:
+                raise ValueError('unexpected annotation file %r for %s' % (filename, name))
+            writes.append((self.annotation_path(name, ext, sharded), text))
+        for path, text in writes:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding=DEFAULT_ENCODING) as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+
+    def annotation_path(self, name, ext, sharded=None):
+        """Where the ext annotation of the image called name is stored."""
+        parts = name.split('/')
+        if sharded is None:
+            sharded = is_sharded(self.save_dir)
+        return shard_path(os.path.join(self.save_dir, *parts[:-1]), os.path.splitext(parts[-1])[0], ext, sharded)
+
+    def _merged_classes(self, text):
+        """The uploaded classes.txt if it only appends to the stored one; YOLO class ids must not move."""
+        path = os.path.join(self.save_dir, CLASSES_FILE)
+        try:
+            with open(path, 'r', encoding=DEFAULT_ENCODING) as f:
+                current = f.read().split()
+        except OSError:
+            return text
+        uploaded = text.split()
+        if uploaded[:len(current)] != current:
+            raise ValueError('classes.txt does not extend the classes of the queue: %s' % ', '.join(current))
+        return text
+
+    def stats(self):
+        """Image counts by state and, per client, leased/completed/expired counts and images per hour."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            counts = dict((state, 0) for state in (PENDING, LEASED, DONE))
+            counts.update(self._conn.execute('SELECT state, count(*) FROM images GROUP BY state').fetchall())
+            recent = dict(self._conn.execute('SELECT client, count(*) FROM images WHERE done >= ? GROUP BY client',
+                                             (now - THROUGHPUT_WINDOW,)).fetchall())
+            clients = [{'name': name, 'leased': leased, 'completed': completed, 'expired': expired,
+                        'last_seen': last_seen, 'per_hour': recent.get(name, 0) * 3600.0 / THROUGHPUT_WINDOW}
+                       for name, leased, completed, expired, last_seen in self._conn.execute(
+                           'SELECT name, leased, completed, expired, last_seen FROM clients ORDER BY name')]
+            self._conn.commit()
+        counts['clients'] = clients
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _QueueRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.server.queue.stats())
+        else:
+            self._reply(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        queue = self.server.queue
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            if not isinstance(request, dict):
+                raise ValueError('the request must be a JSON object')
+            client = request['client']
+            if self.path == '/lease':
+                result = queue.lease(client, int(request.get('count', BATCH_SIZE)))
+            elif self.path == '/heartbeat':
+                result = {'expires': queue.heartbeat(client, request['lease'])}
+            elif self.path == '/release':
+                queue.release(client, request['lease'])
+                result = {}
+            elif self.path == '/complete':
+                queue.complete(client, request['lease'], request['image'], request.get('files', {}))
+                result = queue.stats()
+                del result['clients']
+            else:
+                return self._reply(404, {'error': 'unknown path %s' % self.path})
+        except LeaseError as e:
+            return self._reply(409, {'error': str(e)})
+        except (KeyError, TypeError, ValueError) as e:
+            return self._reply(400, {'error': str(e)})
+        except (OSError, sqlite3.Error) as e:
+            return self._reply(500, {'error': str(e)})
+        self._reply(200, result)
+
+
+class WorkQueueServer(ThreadingHTTPServer):
+    """Serves a WorkQueue over HTTP; call serve_forever() to run it."""
+
+    daemon_threads = True
+
+    def __init__(self, queue, host='127.0.0.1', port=DEFAULT_PORT):
+        super(WorkQueueServer, self).__init__((host, port), _QueueRequestHandler)
+        self.queue = queue
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+
+def default_client_name():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueueClient:
+    """Talks to a WorkQueueServer and keeps the current lease alive from a background thread."""
+
+    def __init__(self, url, name=None, timeout=10):
+        self.url = url.rstrip('/')
+        self.name = name or default_client_name()
+        self.timeout = timeout
+        self.lease_id = None
+        self.lease_lost = False
+        self._heartbeat_stop = None
+
+    def _call(self, path, data=None):
+        if data is None:
+            request = Request(self.url + path)
+        else:
+            data = dict(data, client=self.name)
+            request = Request(self.url + path, json.dumps(data).encode('utf-8'),
+                              {'Content-Type': 'application/json'})
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except HTTPError as e:
+            try:
+                message = json.loads(e.read().decode('utf-8')).get('error', e.reason)
+            except ValueError:
+                message = e.reason
+            if e.code == 409:
+                raise LeaseError(message)
+            if e.code == 400:
+                raise ValueError(message)
+            raise OSError('work queue: HTTP %d %s' % (e.code, message))
+        except URLError as e:
+            raise OSError('work queue %s: %s' % (self.url, e.reason))
+
+    def lease(self, count=BATCH_SIZE):
+        """Lease the next batch, releasing the current one; returns its image names (empty when done)."""
+        self.release()
+        result = self._call('/lease', {'count': count})
+        self.lease_id = result['lease']
+        self.lease_lost = False
+        if self.lease_id is not None:
+            self._start_heartbeat(max(1.0, (result['expires'] - time.time()) / 3.0))
+        return result['images']
+
+    def release(self):
+        self._stop_heartbeat()
+        lease_id, self.lease_id = self.lease_id, None
+        if lease_id is not None and not self.lease_lost:
+            try:
+                self._call('/release', {'lease': lease_id})
+            except (OSError, LeaseError):
+                pass
+
+    def complete(self, image, files):
+        """Send the annotation files of image; returns the queue's image counts."""
+        if self.lease_id is None:
+            raise LeaseError('no lease')
+        try:
+            return self._call('/complete', {'lease': self.lease_id, 'image': image, 'files': files})
+        except LeaseError:
+            self.lease_lost = True
+            raise
+
+    def stats(self):
+        return self._call('/stats')
+
+    def _start_heartbeat(self, interval):
+        stop = self._heartbeat_stop = threading.Event()
+        lease_id = self.lease_id
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self._call('/heartbeat', {'lease': lease_id})
+                except LeaseError:
+                    self.lease_lost = True
+                    return
+                except OSError:
+                    # The server may be restarting; the lease survives a missed beat or two.
+                    pass
+
+        threading.Thread(target=beat, name='work-queue-heartbeat', daemon=True).start()
+
+    def _stop_heartbeat(self):
+        if self._heartbeat_stop is not None:
+            self._heartbeat_stop.set()
+            self._heartbeat_stop = None
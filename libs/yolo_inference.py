@@ -5,12 +5,32 @@ YOLO Model Inference for RedLabel
 
 This module provides YOLO model integration for automatic annotation,
 including model detection, inference pipeline, and label generation.
+
+ultralytics imports torch, which takes seconds; it is only looked up
+here, and imported by YOLOModelLoader off the GUI thread. Loaded models
+stay resident in a ModelCache, so switching back to one is instant.
+
+Large images can be predicted in overlapping tiles (see
+YOLOInferenceEngine.tile_size), so that small objects are not lost when
+the whole image is shrunk to the model's input size.
+
+Models run through PyTorch by default, or exported to ONNX and run
+through ONNX Runtime (see libs.onnx_backend and
+YOLOInferenceEngine.backend), which is faster on the CPU.
 """
 
 import os
 import glob
+import hashlib
+import importlib.util
+import queue
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 
+import numpy as np
+
 try:
     from PyQt5.QtGui import *
     from PyQt5.QtCore import *
@@ -19,6 +39,13 @@ except ImportError:
     from PyQt4.QtGui import *
     from PyQt4.QtCore import *
 
+from libs.cache_manager import file_key
+from libs.high_bit_depth import HighBitDepthImage
+from libs.image_array import qimage_to_bgr
+from libs.image_decoder import decode_image
+from libs.sharding import annotation_path, is_sharded
+from libs.yolo_io import CLASSES_LOCK, TXT_EXT, read_class_file
+
 
 class YOLOModelDetector:
     """Detect and manage YOLO model files (.pt) in the application directory."""
@@ -56,37 +83,341 @@ class YOLOModelDetector:
         return self.selected_model
 
 
+# Loaded models kept resident, bounded by count and by parameter memory.
+MODEL_CACHE_SIZE = 3
+MODEL_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# Size of the blank image a freshly loaded model is run on once.
+WARM_UP_SIZE = 640
+
+# Ways of running a model: ultralytics on PyTorch, or an ONNX export on ONNX Runtime.
+BACKEND_PYTORCH = 'pytorch'
+BACKEND_ONNX = 'onnx'
+BACKEND_NAMES = {BACKEND_PYTORCH: 'PyTorch', BACKEND_ONNX: 'ONNX Runtime (CPU)'}
+
+# Detections of single images remembered by PredictionCache.
+PREDICTION_CACHE_SIZE = 2000
+
+# Images decoded ahead of the model, and predictions waiting to be written, in a batch run.
+PIPELINE_QUEUE_SIZE = 4
+
+# Least time between two progress reports of a batch run, in seconds.
+PROGRESS_INTERVAL = 0.25
+
+# Tiled inference: side of a tile, fraction of it shared with its neighbours,
+# crops passed to the model per call, the overlap at which detections from
+# different crops are merged, and how close to a tile border (in pixels) a
+# box must end to count as cut off by it.
+DEFAULT_TILE_SIZE = 640
+DEFAULT_TILE_OVERLAP = 0.2
+TILE_BATCH_SIZE = 8
+TILE_MERGE_THRESHOLD = 0.5
+TILE_EDGE_MARGIN = 2
+
+
+def tile_windows(width, height, tile_size, overlap=DEFAULT_TILE_OVERLAP):
+    """(x1, y1, x2, y2) windows of at most tile_size covering an image.
+
+    Neighbouring windows share at least overlap of a tile, and the last
+    window of a row or column ends at the image border.
+    """
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        stride = max(1, tile_size * (1 - overlap))
+        count = int(np.ceil((length - tile_size) / stride)) + 1
+        return sorted(set(np.linspace(0, length - tile_size, count).round().astype(int).tolist()))
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def non_max_suppression(boxes, scores, classes, threshold, metric='iou'):
+    """Indices of the boxes kept by class-aware greedy NMS, best score first.
+
+    boxes is an (N, 4) array of x1, y1, x2, y2. A box is dropped if it
+    overlaps a better box of the same class by threshold or more, measured
+    as intersection over union ('iou') or over the smaller box ('ios').
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if not len(boxes):
+        return np.zeros(0, dtype=int)
+    # Shifting each class to its own region keeps boxes of different classes apart.
+    shift = (boxes.max() + 1) * np.asarray(classes, dtype=np.float64)
+    boxes = boxes + shift[:, None]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+    keep = []
+    while len(order):
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0])
+        height = np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1])
+        intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+        if metric == 'ios':
+            denominator = np.minimum(areas[best], areas[rest])
+        else:
+            denominator = areas[best] + areas[rest] - intersection
+        overlap = intersection / np.maximum(denominator, 1e-9)
+        order = rest[overlap < threshold]
+    return np.asarray(keep, dtype=int)
+
+
+def merge_tile_detections(boxes, scores, classes, windows, width, height, threshold=TILE_MERGE_THRESHOLD):
+    """Indices of the detections kept when merging the crops of a width x height image, best score first.
+
+    windows holds the (x1, y1, x2, y2) crop each box was found in. A box
+    that ends at a crop border inside the image may be a cut-off part of
+    an object; it is dropped if it lies mostly (intersection over its own
+    area) inside a larger box of the same class, whatever their scores.
+    The rest are merged by IoU, so a small object inside a larger one
+    stays unless it ends at a crop border.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    windows = np.asarray(windows, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    classes = np.asarray(classes).reshape(-1)
+    inner_low = windows[:, :2] > 0
+    inner_high = windows[:, 2:] < (width, height)
+    cut = ((inner_low & (boxes[:, :2] <= windows[:, :2] + TILE_EDGE_MARGIN)) |
+           (inner_high & (boxes[:, 2:] >= windows[:, 2:] - TILE_EDGE_MARGIN))).any(axis=1)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    dropped = np.zeros(len(boxes), dtype=bool)
+    for class_id in np.unique(classes[cut]):
+        # Cut boxes of the class against all boxes of the class, in one matrix.
+        members = np.flatnonzero(classes == class_id)
+        cut_members = members[cut[members]]
+        inner, outer = boxes[cut_members, None, :], boxes[None, members, :]
+        overlap_width = np.minimum(inner[..., 2], outer[..., 2]) - np.maximum(inner[..., 0], outer[..., 0])
+        overlap_height = np.minimum(inner[..., 3], outer[..., 3]) - np.maximum(inner[..., 1], outer[..., 1])
+        intersection = np.clip(overlap_width, 0, None) * np.clip(overlap_height, 0, None)
+        cut_areas = areas[cut_members, None]
+        inside = (areas[None, members] > cut_areas) & (intersection >= threshold * np.maximum(cut_areas, 1e-9))
+        dropped[cut_members] = inside.any(axis=1)
+    candidates = np.flatnonzero(~dropped)
+    keep = non_max_suppression(boxes[candidates], scores[candidates], classes[candidates], threshold)
+    return candidates[keep]
+
+
+def model_nbytes(model, default=0):
+    """Memory held by the parameters and buffers of a YOLO model, or default if it cannot be told."""
+    try:
+        module = model.model
+        return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+    except Exception:
+        return default
+
+
+class ModelCache:
+    """An LRU of loaded models keyed by path, file hash and backend.
+
+    A model file replaced on disk gets a new key, so the stale model is
+    never returned. Hashes are remembered per (path, mtime, size), so a
+    file is only read again when it changes.
+    """
+
+    def __init__(self, max_models=MODEL_CACHE_SIZE, max_bytes=MODEL_CACHE_BYTES):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (model, nbytes)
+        self._digests = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, model_path, hash_file=True):
+        """(path, sha1 of the file); raises OSError if it cannot be read.
+
+        Without hash_file, None is returned instead of reading a file whose
+        hash is not known yet.
+        """
+        path = os.path.abspath(model_path)
+        st = os.stat(path)
+        stamp = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            digest = self._digests.get(stamp)
+        if digest is None:
+            if not hash_file:
+                return None
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha1.update(chunk)
+            digest = sha1.hexdigest()
+            with self._lock:
+                self._digests[stamp] = digest
+        return path, digest
+
+    def get(self, model_path, hash_file=True, backend=BACKEND_PYTORCH):
+        """The resident model loaded from model_path for backend, or None."""
+        try:
+            key = self.key(model_path, hash_file)
+        except OSError:
+            return None
+        if key is None:
+            return None
+        key += (backend,)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, model_path, model, nbytes=None, backend=BACKEND_PYTORCH):
+        """Keep model resident, evicting the least recently used models beyond the limits."""
+        key = self.key(model_path) + (backend,)
+        if nbytes is None:
+            nbytes = model_nbytes(model, os.path.getsize(model_path))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (model, nbytes)
+            self.bytes += nbytes
+            while len(self._entries) > 1 and (len(self._entries) > self.max_models or self.bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+class PredictionCache:
+    """Detections keyed by (image digest, model digest, confidence threshold), least recently used dropped first."""
+
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            detections = self._entries.get(key)
+            if detections is not None:
+                self._entries.move_to_end(key)
+            return detections
+
+    def put(self, key, detections):
+        with self._lock:
+            self._entries[key] = detections
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
 class YOLOInferenceEngine:
     """Handle YOLO model inference and label generation."""
     
-    def __init__(self):
+    def __init__(self, model_cache=None):
         self.model = None
         self.model_path = None
+        self.model_cache = model_cache if model_cache is not None else ModelCache()
+        self.prediction_cache = PredictionCache()
+        # Images larger than tile_size are predicted in tiles; 0 predicts them whole.
+        self.tile_size = 0
+        self.tile_overlap = DEFAULT_TILE_OVERLAP
+        # Models loaded from now on run through this backend.
+        self.backend = BACKEND_PYTORCH
         self.is_ultralytics_available = self._check_ultralytics()
+        self.is_onnxruntime_available = importlib.util.find_spec('onnxruntime') is not None
         
     def _check_ultralytics(self):
-        """Check if ultralytics YOLO is available."""
-        try:
-            import ultralytics
-            return True
-        except ImportError:
-            return False
+        """Check if ultralytics YOLO is installed, without importing it."""
+        return importlib.util.find_spec('ultralytics') is not None
     
-    def load_model(self, model_path):
-        """Load a YOLO model from the given path."""
-        if not self.is_ultralytics_available:
+    def create_model(self, model_path, backend=None):
+        """Load a YOLO model from the given path without making it current.
+
+        backend defaults to the engine's. A resident model is returned as
+        is. A model read from disk is run once on a blank image, so that
+        the first real prediction does not pay for setting up the
+        predictor, and is kept in the model cache. Only the thread-safe
+        model cache is touched, so this can run in a worker thread.
+        """
+        backend = backend or self.backend
+        if backend == BACKEND_ONNX and not self.is_onnxruntime_available:
+            raise ImportError("onnxruntime package is required for the ONNX backend. Install with: pip install onnxruntime")
+        if backend != BACKEND_ONNX and not self.is_ultralytics_available:
             raise ImportError("ultralytics package is required for YOLO inference. Install with: pip install ultralytics")
         
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found: {model_path}")
         
+        model = self.model_cache.get(model_path, backend=backend)
+        if model is not None:
+            return model
+        
+        if backend == BACKEND_ONNX:
+            model, nbytes = self._create_onnx_model(model_path)
+        else:
+            try:
+                from ultralytics import YOLO
+                model = YOLO(model_path)
+            except Exception as e:
+                raise RuntimeError(f"Failed to load YOLO model: {e}")
+            nbytes = None
+        self.warm_up(model)
+        self.model_cache.put(model_path, model, nbytes, backend)
+        return model
+    
+    def _create_onnx_model(self, model_path):
+        """An ONNX Runtime session for the model and its size, exporting the model first if needed."""
+        from libs.onnx_backend import ONNXModel, export_onnx, onnx_cache_path
+        onnx_path = onnx_cache_path(model_path, self.model_cache.key(model_path)[1])
+        if not os.path.exists(onnx_path):
+            if not self.is_ultralytics_available:
+                raise ImportError("ultralytics package is required to export the model to ONNX. "
+                                  "Install with: pip install ultralytics")
+            try:
+                export_onnx(model_path, onnx_path)
+            except Exception as e:
+                raise RuntimeError(f"Failed to export YOLO model to ONNX: {e}")
         try:
-            from ultralytics import YOLO
-            self.model = YOLO(model_path)
-            self.model_path = model_path
-            return True
+            return ONNXModel(onnx_path), os.path.getsize(onnx_path)
         except Exception as e:
-            raise RuntimeError(f"Failed to load YOLO model: {e}")
+            raise RuntimeError(f"Failed to load ONNX model: {e}")
+    
+    def warm_up(self, model):
+        """Run model once on a blank image; failures are left to the first real prediction."""
+        try:
+            model(np.zeros((WARM_UP_SIZE, WARM_UP_SIZE, 3), np.uint8), verbose=False)
+        except Exception:
+            pass
+    
+    def model_digest(self):
+        """File hash of the current model, or None if no model is loaded."""
+        if self.model is None:
+            return None
+        try:
+            key = self.model_cache.key(self.model_path, hash_file=False)
+        except OSError:
+            return None
+        return None if key is None else key[1]
+    
+    def resident_model(self, model_path):
+        """The loaded model for model_path if it is resident, else None; never reads the file.
+
+        Quick enough for the GUI thread.
+        """
+        return self.model_cache.get(model_path, hash_file=False, backend=self.backend)
+    
+    def set_model(self, model, model_path):
+        """Make a model returned by create_model() the current one."""
+        self.model = model
+        self.model_path = model_path
+    
+    def load_model(self, model_path):
+        """Load a YOLO model from the given path."""
+        self.set_model(self.create_model(model_path), model_path)
+        return True
     
     def get_class_names(self):
         """Get the list of class names from the loaded model."""
@@ -96,19 +427,71 @@ class YOLOInferenceEngine:
         # Get class names from the model
         return list(self.model.names.values())
     
-    def predict_image(self, image_path, conf_threshold=0.25):
-        """Run inference on a single image."""
-        if self.model is None:
+    def predict_image(self, image, conf_threshold=0.25, model=None, tile_size=None, tile_overlap=None):
+        """Run inference on a single image.
+
+        image is a file path, an already decoded QImage or a BGR NumPy
+        array; decoded images are passed to the model without re-reading
+        the file or copying the pixels. model, tile_size and tile_overlap
+        default to the engine's current ones.
+        """
+        model = model or self.model
+        if model is None:
             raise RuntimeError("No model loaded. Call load_model() first.")
+        tile_size = self.tile_size if tile_size is None else tile_size
+        tile_overlap = self.tile_overlap if tile_overlap is None else tile_overlap
         
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image file not found: {image_path}")
+        if isinstance(image, QImage):
+            source, name = qimage_to_bgr(image), "decoded image"
+        elif isinstance(image, str):
+            if not os.path.exists(image):
+                raise FileNotFoundError(f"Image file not found: {image}")
+            source, name = image, image
+            if tile_size:
+                decoded = decode_image(image)
+                if decoded is None:
+                    raise RuntimeError(f"Could not decode {image}")
+                source = qimage_to_bgr(decoded)
+        else:
+            source, name = image, "decoded image"
         
         try:
-            results = self.model(image_path, conf=conf_threshold)
+            if tile_size and max(source.shape[:2]) > tile_size:
+                return self._predict_tiled(model, source, conf_threshold, tile_size, tile_overlap)
+            results = model(source, conf=conf_threshold)
             return self._parse_results(results[0])
         except Exception as e:
-            raise RuntimeError(f"Inference failed for {image_path}: {e}")
+            raise RuntimeError(f"Inference failed for {name}: {e}")
+    
+    def _predict_tiled(self, model, source, conf_threshold, tile_size, tile_overlap):
+        """Predict the whole image and its overlapping tiles, and merge the detections.
+
+        The whole image still finds the objects larger than a tile. Tiles
+        are views of the image, passed to the model in batches. An object
+        cut by a tile border is found whole in a neighbouring tile or in the
+        whole image, and merge_tile_detections() keeps that box over the cut one.
+        """
+        height, width = source.shape[:2]
+        windows = [(0, 0, width, height)] + tile_windows(width, height, tile_size, tile_overlap)
+        boxes, confidences, class_ids, box_windows = [], [], [], []
+        names = {}
+        for start in range(0, len(windows), TILE_BATCH_SIZE):
+            batch = windows[start:start + TILE_BATCH_SIZE]
+            crops = [source[y1:y2, x1:x2] for x1, y1, x2, y2 in batch]
+            for window, result in zip(batch, model(crops, conf=conf_threshold, verbose=False)):
+                if result.boxes is None:
+                    continue
+                x1, y1 = window[:2]
+                boxes.append(result.boxes.xyxy.cpu().numpy().reshape(-1, 4) + (x1, y1, x1, y1))
+                box_windows.append(np.tile(window, (len(boxes[-1]), 1)))
+                confidences.append(result.boxes.conf.cpu().numpy().reshape(-1))
+                class_ids.append(result.boxes.cls.cpu().numpy().astype(int).reshape(-1))
+                names = result.names
+        if not boxes:
+            return []
+        boxes, confidences, class_ids = np.concatenate(boxes), np.concatenate(confidences), np.concatenate(class_ids)
+        keep = merge_tile_detections(boxes, confidences, class_ids, np.concatenate(box_windows), width, height)
+        return [self._detection(boxes[i], confidences[i], class_ids[i], names) for i in keep]
     
     def _parse_results(self, result):
         """Parse YOLO results into standardized format."""
@@ -119,20 +502,21 @@ class YOLOInferenceEngine:
             confidences = result.boxes.conf.cpu().numpy()
             class_ids = result.boxes.cls.cpu().numpy().astype(int)
             
-            for i, (box, conf, cls_id) in enumerate(zip(boxes, confidences, class_ids)):
-                x1, y1, x2, y2 = box
-                class_name = result.names[cls_id] if cls_id < len(result.names) else f"class_{cls_id}"
-                
-                detection = {
-                    'bbox': [float(x1), float(y1), float(x2), float(y2)],
-                    'confidence': float(conf),
-                    'class_id': int(cls_id),
-                    'class_name': class_name
-                }
-                detections.append(detection)
+            for box, conf, cls_id in zip(boxes, confidences, class_ids):
+                detections.append(self._detection(box, conf, cls_id, result.names))
         
         return detections
     
+    def _detection(self, box, conf, cls_id, names):
+        x1, y1, x2, y2 = box
+        class_name = names[cls_id] if cls_id < len(names) else f"class_{cls_id}"
+        return {
+            'bbox': [float(x1), float(y1), float(x2), float(y2)],
+            'confidence': float(conf),
+            'class_id': int(cls_id),
+            'class_name': class_name
+        }
+    
     def get_class_names(self):
         """Get the class names from the loaded model."""
         if self.model is None:
@@ -144,54 +528,298 @@ class YOLOInferenceEngine:
             return []
 
 
+class YOLOModelLoader(QThread):
+    """Worker thread importing ultralytics and, if given a path, loading a model.
+
+    Without a model path it only imports ultralytics (and torch), so that a
+    model picked later loads quickly.
+    """
+    
+    model_loaded = pyqtSignal(str, object)  # model_path, model
+    load_failed = pyqtSignal(str, str)  # model_path, error_message
+    
+    def __init__(self, inference_engine, model_path=None):
+        super().__init__()
+        self.inference_engine = inference_engine
+        self.model_path = model_path
+        self.backend = inference_engine.backend
+    
+    def run(self):
+        try:
+            if self.model_path is None:
+                import ultralytics  # noqa: F401
+            else:
+                model = self.inference_engine.create_model(self.model_path, self.backend)
+                self.model_loaded.emit(self.model_path, model)
+        except Exception as e:
+            self.load_failed.emit(self.model_path or '', str(e))
+
+
+class YOLOImageWorker(QThread):
+    """Worker thread predicting one decoded image, e.g. the one on the canvas."""
+    
+    prediction_ready = pyqtSignal(object, list)  # cache key, detections
+    prediction_failed = pyqtSignal(str)  # error_message
+    
+    def __init__(self, inference_engine, image, key, conf_threshold=0.25):
+        super().__init__()
+        self.inference_engine = inference_engine
+        # The model and tiling are fixed now; changing them meanwhile does not change the result.
+        self.model = inference_engine.model
+        self.tile_size = inference_engine.tile_size
+        self.tile_overlap = inference_engine.tile_overlap
+        self.image = image
+        self.key = key
+        self.conf_threshold = conf_threshold
+    
+    def run(self):
+        try:
+            detections = self.inference_engine.predict_image(self.image, self.conf_threshold, self.model,
+                                                             self.tile_size, self.tile_overlap)
+        except Exception as e:
+            self.prediction_failed.emit(str(e))
+            return
+        if self.key is not None:
+            self.inference_engine.prediction_cache.put(self.key, detections)
+        self.prediction_ready.emit(self.key, detections)
+
+
+class YOLOLabelWriter:
+    """Writes detections as YOLO label files in a save directory.
+
+    Classes are numbered by classes.txt, which is read again whenever a
+    save from the GUI rewrote it; new classes are appended to it.
+    """
+    
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self.classes_path = os.path.join(save_dir, "classes.txt")
+        self.sharded = is_sharded(save_dir)
+        self.class_count = 0
+        self.class_ids = {}
+        self._classes_stat = None
+        with CLASSES_LOCK:
+            self._read_classes()
+    
+    def _classes_file_stat(self):
+        try:
+            stat = os.stat(self.classes_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def _read_classes(self):
+        """Read classes.txt if it changed since it was last read; called with CLASSES_LOCK held."""
+        stat = self._classes_file_stat()
+        if stat == self._classes_stat:
+            return
+        class_names = read_class_file(self.classes_path)
+        self._classes_stat = stat
+        self.class_count = len(class_names)
+        self.class_ids = {}
+        for class_id, class_name in enumerate(class_names):
+            self.class_ids.setdefault(class_name, class_id)
+    
+    def class_id(self, class_name):
+        """Index of class_name in classes.txt, appending it if new; called with CLASSES_LOCK held."""
+        if class_name not in self.class_ids:
+            with open(self.classes_path, 'a') as f:
+                f.write(f"{class_name}\n")
+            self.class_ids[class_name] = self.class_count
+            self.class_count += 1
+            self._classes_stat = self._classes_file_stat()
+        return self.class_ids[class_name]
+    
+    def write(self, image_path, detections, image_size):
+        """Write the label file of image_path, whose size is (width, height); returns its path."""
+        img_width, img_height = image_size
+        yolo_lines = []
+        with CLASSES_LOCK:
+            self._read_classes()
+            for detection in detections:
+                x1, y1, x2, y2 = detection['bbox']
+                x_center = (x1 + x2) / 2.0 / img_width
+                y_center = (y1 + y2) / 2.0 / img_height
+                width = (x2 - x1) / img_width
+                height = (y2 - y1) / img_height
+                yolo_lines.append(f"{self.class_id(detection['class_name'])} "
+                                  f"{x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}")
+        label_path = annotation_path(self.save_dir, image_path, TXT_EXT, self.sharded, create=True)
+        with open(label_path, 'w') as f:
+            f.write('\n'.join(yolo_lines))
+        return label_path
+
+
 class YOLOInferenceWorker(QThread):
-    """Worker thread for running YOLO inference on multiple images."""
+    """Worker thread running YOLO inference on multiple images and writing their label files.
+
+    Images are decoded, predicted and written in three threads connected
+    by bounded queues, so the model does not wait for the disk and
+    decoding stays only a few images ahead. Images without detections get
+    no label file. The GUI thread only receives progress and the images
+    labeled meanwhile, at most every PROGRESS_INTERVAL seconds.
+    """
     
-    progress_updated = pyqtSignal(int)  # Current image index
-    inference_completed = pyqtSignal(str, list)  # image_path, detections
+    progress_updated = pyqtSignal(int)  # Images done
+    labels_written = pyqtSignal(list)  # Image paths labeled since the last signal
     inference_failed = pyqtSignal(str, str)  # image_path, error_message
     finished_all = pyqtSignal()
     
-    def __init__(self, inference_engine, image_paths, conf_threshold=0.25):
-        super().__init__()
+    def __init__(self, inference_engine, image_paths, save_dir, conf_threshold=0.25, image_cache=None, parent=None):
+        super().__init__(parent)
         self.inference_engine = inference_engine
         self.image_paths = image_paths
+        self.save_dir = save_dir
         self.conf_threshold = conf_threshold
+        # Decoded images the GUI already holds, keyed by file_key().
+        self.image_cache = image_cache
         self._is_cancelled = False
+        self._label_writer = None
+        self._lock = threading.Lock()
+        self._done = 0
+        self._labeled = []
+        self._last_report = 0.0
     
     def cancel(self):
-        """Cancel the inference process."""
+        """Cancel the inference process; images already predicted are still written."""
         self._is_cancelled = True
     
-    def run(self):
-        """Run inference on all images."""
-        for i, image_path in enumerate(self.image_paths):
-            if self._is_cancelled:
+    def _decode(self, image_path):
+        """Decode image_path once for the whole run, or reuse the GUI's decoded copy."""
+        image = None
+        if self.image_cache is not None:
+            key = file_key(image_path)
+            if key is not None:
+                image = self.image_cache.get(key)
+            if isinstance(image, HighBitDepthImage):
+                # The 8-bit rendering, copied as window/level re-renders it in place.
+                image = image.display.copy()
+            elif not isinstance(image, QImage):
+                image = None
+        if image is None:
+            image = decode_image(image_path)
+        if image is None:
+            raise RuntimeError(f"Could not decode {image_path}")
+        return image
+    
+    def _decode_stage(self, decoded, stopped):
+        try:
+            for image_path in self.image_paths:
+                if self._is_cancelled or stopped.is_set():
+                    break
+                try:
+                    decoded.put((image_path, self._decode(image_path), None))
+                except Exception as e:
+                    decoded.put((image_path, None, str(e)))
+        finally:
+            decoded.put(None)
+    
+    def _write_stage(self, predicted):
+        while True:
+            item = predicted.get()
+            if item is None:
                 break
-            
+            image_path, detections, image_size = item
             try:
-                detections = self.inference_engine.predict_image(image_path, self.conf_threshold)
-                self.inference_completed.emit(image_path, detections)
+                labeled = self._write(image_path, detections, image_size)
             except Exception as e:
-                self.inference_failed.emit(image_path, str(e))
-            
-            self.progress_updated.emit(i + 1)
-        
-        self.finished_all.emit()
+                self._finish(image_path, str(e))
+                continue
+            self._finish(image_path, labeled=labeled)
+        try:
+            self._write_done()
+        except Exception as e:
+            self.inference_failed.emit('', str(e))
+    
+    def _write(self, image_path, detections, image_size):
+        """Store the detections of one image, in the writer thread; True if it got a label file."""
+        if not detections:
+            return False
+        if self._label_writer is None:
+            self._label_writer = YOLOLabelWriter(self.save_dir)
+        self._label_writer.write(image_path, detections, image_size)
+        return True
+    
+    def _write_done(self):
+        """Called in the writer thread after the last image."""
+    
+    def _finish(self, image_path, error_message=None, labeled=False):
+        """Count image_path as done; called from the inference and writer threads."""
+        if error_message is not None:
+            self.inference_failed.emit(image_path, error_message)
+        with self._lock:
+            self._done += 1
+            if labeled:
+                self._labeled.append(image_path)
+            if time.monotonic() - self._last_report >= PROGRESS_INTERVAL:
+                self._report()
+    
+    def _report(self):
+        self._last_report = time.monotonic()
+        self.progress_updated.emit(self._done)
+        if self._labeled:
+            self.labels_written.emit(self._labeled)
+            self._labeled = []
+    
+    def run(self):
+        """Run inference on all images."""
+        decoded = queue.Queue(PIPELINE_QUEUE_SIZE)
+        predicted = queue.Queue(PIPELINE_QUEUE_SIZE)
+        stopped = threading.Event()
+        decoder = threading.Thread(target=self._decode_stage, args=(decoded, stopped), daemon=True)
+        writer = threading.Thread(target=self._write_stage, args=(predicted,), daemon=True)
+        decoder.start()
+        writer.start()
+        try:
+            while True:
+                item = decoded.get()
+                if item is None:
+                    break
+                image_path, image, error_message = item
+                if image is None:
+                    self._finish(image_path, error_message)
+                    continue
+                if self._is_cancelled:
+                    continue
+                try:
+                    detections = self.inference_engine.predict_image(image, self.conf_threshold)
+                    image_size = (image.width(), image.height())
+                except Exception as e:
+                    self._finish(image_path, str(e))
+                    continue
+                predicted.put((image_path, detections, image_size))
+        finally:
+            predicted.put(None)
+            # The decoder may be blocked on a full queue if the loop ended early.
+            stopped.set()
+            while decoder.is_alive():
+                try:
+                    decoded.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            decoder.join()
+            writer.join()
+            with self._lock:
+                self._report()
+            self.finished_all.emit()
 
 
 class YOLOModelDialog(QDialog):
     """Dialog for selecting and configuring YOLO models."""
     
-    def __init__(self, parent=None, model_detector=None):
+    def __init__(self, parent=None, model_detector=None, tile_size=0, tile_overlap=DEFAULT_TILE_OVERLAP,
+                 backend=BACKEND_PYTORCH):
         super().__init__(parent)
         self.model_detector = model_detector or YOLOModelDetector()
         self.selected_model_path = None
         self.confidence_threshold = 0.25
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.backend = backend
         
         self.setWindowTitle("YOLO Model Configuration")
         self.setModal(True)
-        self.resize(500, 300)
+        self.resize(500, 390)
         
         self._setup_ui()
         self._populate_models()
@@ -238,6 +866,45 @@ class YOLOModelDialog(QDialog):
         self.confidence_spin.setDecimals(2)
         config_layout.addRow("Confidence Threshold:", self.confidence_spin)
         
+        # Inference backend; ONNX Runtime is offered only when installed
+        self.backend_combo = QComboBox()
+        for backend, name in BACKEND_NAMES.items():
+            self.backend_combo.addItem(name, backend)
+        if importlib.util.find_spec('onnxruntime') is None:
+            index = self.backend_combo.findData(BACKEND_ONNX)
+            self.backend_combo.model().item(index).setEnabled(False)
+            self.backend_combo.setToolTip("Install onnxruntime to run models through ONNX Runtime")
+            self.backend = BACKEND_PYTORCH
+        else:
+            self.backend_combo.setToolTip("ONNX Runtime exports the model once and predicts faster on the CPU")
+        self.backend_combo.setCurrentIndex(max(0, self.backend_combo.findData(self.backend)))
+        config_layout.addRow("Inference Backend:", self.backend_combo)
+        
+        # Tiled inference for small objects in large images
+        self.tile_check = QCheckBox("Predict large images in tiles")
+        self.tile_check.setToolTip("Finds small objects that are lost when a large image is shrunk to the model's input size")
+        self.tile_check.setChecked(bool(self.tile_size))
+        config_layout.addRow(self.tile_check)
+        
+        self.tile_size_spin = QSpinBox()
+        self.tile_size_spin.setRange(128, 8192)
+        self.tile_size_spin.setSingleStep(32)
+        self.tile_size_spin.setSuffix(" px")
+        self.tile_size_spin.setValue(self.tile_size or DEFAULT_TILE_SIZE)
+        config_layout.addRow("Tile Size:", self.tile_size_spin)
+        
+        self.tile_overlap_spin = QDoubleSpinBox()
+        self.tile_overlap_spin.setRange(0.0, 0.5)
+        self.tile_overlap_spin.setSingleStep(0.05)
+        self.tile_overlap_spin.setDecimals(2)
+        self.tile_overlap_spin.setValue(self.tile_overlap)
+        config_layout.addRow("Tile Overlap:", self.tile_overlap_spin)
+        
+        self.tile_check.toggled.connect(self.tile_size_spin.setEnabled)
+        self.tile_check.toggled.connect(self.tile_overlap_spin.setEnabled)
+        self.tile_size_spin.setEnabled(self.tile_check.isChecked())
+        self.tile_overlap_spin.setEnabled(self.tile_check.isChecked())
+        
         layout.addWidget(config_group)
         
         # Selected model info
@@ -321,3 +988,15 @@ class YOLOModelDialog(QDialog):
     def get_confidence_threshold(self):
         """Get the confidence threshold value."""
         return self.confidence_spin.value()
+    
+    def get_backend(self):
+        """Get the backend models are run through."""
+        return self.backend_combo.currentData()
+    
+    def get_tile_size(self):
+        """Get the tile size, or 0 if images are predicted whole."""
+        return self.tile_size_spin.value() if self.tile_check.isChecked() else 0
+    
+    def get_tile_overlap(self):
+        """Get the fraction of a tile shared with its neighbours."""
+        return self.tile_overlap_spin.value()
@@ -2,12 +2,27 @@
 # -*- coding: utf8 -*-
 import codecs
 import os
+import threading
 
 from libs.constants import DEFAULT_ENCODING
+from libs.sharding import save_dir_root
 
 TXT_EXT = '.txt'
 ENCODE_METHOD = DEFAULT_ENCODING
 
+# Held while classes.txt is read or written: saves from the GUI rewrite it
+# while batch inference may be adding classes from another thread.
+CLASSES_LOCK = threading.RLock()
+
+
+def read_class_file(classes_file):
+    """Class names in classes_file, one per line, or [] if it does not exist."""
+    try:
+        with open(classes_file, 'r', encoding=ENCODE_METHOD) as f:
+            return [line.strip() for line in f]
+    except FileNotFoundError:
+        return []
+
 class YOLOWriter:
 
     def __init__(self, folder_name, filename, img_size, database_src='Unknown', local_img_path=None):
@@ -46,35 +61,37 @@ class YOLOWriter:
 
         return class_index, x_center, y_center, w, h
 
-    def save(self, class_list=[], target_file=None):
-
-        out_file = None  # Update yolo .txt
-        out_class_file = None   # Update class list .txt
+    def save(self, class_list=None, target_file=None):
+        # A copy, so the caller's list (e.g. the GUI's label history) is left as it is.
+        class_list = list(class_list or [])
 
         if target_file is None:
-            out_file = open(
-            self.filename + TXT_EXT, 'w', encoding=ENCODE_METHOD)
+            target_file = self.filename + TXT_EXT
             classes_file = os.path.join(os.path.dirname(os.path.abspath(self.filename)), "classes.txt")
-            out_class_file = open(classes_file, 'w')
-
         else:
-            out_file = codecs.open(target_file, 'w', encoding=ENCODE_METHOD)
-            classes_file = os.path.join(os.path.dirname(os.path.abspath(target_file)), "classes.txt")
-            out_class_file = open(classes_file, 'w')
+            classes_file = os.path.join(save_dir_root(target_file), "classes.txt")
+
+        with CLASSES_LOCK:
+            # Keep the classes added meanwhile by others, e.g. batch inference.
+            for c in read_class_file(classes_file):
+                if c and c not in class_list:
+                    class_list.append(c)
 
+            out_file = codecs.open(target_file, 'w', encoding=ENCODE_METHOD)  # Update yolo .txt
+            out_class_file = open(classes_file, 'w')  # Update class list .txt
 
-        for box in self.box_list:
-            class_index, x_center, y_center, w, h = self.bnd_box_to_yolo_line(box, class_list)
-            # print (classIndex, x_center, y_center, w, h)
-            out_file.write("%d %.6f %.6f %.6f %.6f\n" % (class_index, x_center, y_center, w, h))
+            for box in self.box_list:
+                class_index, x_center, y_center, w, h = self.bnd_box_to_yolo_line(box, class_list)
+                # print (classIndex, x_center, y_center, w, h)
+                out_file.write("%d %.6f %.6f %.6f %.6f\n" % (class_index, x_center, y_center, w, h))
 
-        # print (classList)
-        # print (out_class_file)
-        for c in class_list:
-            out_class_file.write(c+'\n')
+            # print (classList)
+            # print (out_class_file)
+            for c in class_list:
+                out_class_file.write(c+'\n')
 
-        out_class_file.close()
-        out_file.close()
+            out_class_file.close()
+            out_file.close()
 
 
 
@@ -87,7 +104,7 @@ class YoloReader:
         self.file_path = file_path
 
         if class_list_path is None:
-            dir_path = os.path.dirname(os.path.realpath(self.file_path))
+            dir_path = save_dir_root(os.path.realpath(self.file_path))
             self.class_list_path = os.path.join(dir_path, "classes.txt")
         else:
             self.class_list_path = class_list_path
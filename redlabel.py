@@ -43,6 +43,7 @@ This file now uses a modular architecture with separate mixins for:
 - File operations (MainWindowFileOpsMixin)
 - Canvas operations (MainWindowCanvasMixin)
 - YOLO inference (MainWindowYOLOMixin)
+- Annotation index and file filter (MainWindowIndexMixin)
 """
 import argparse
 import codecs
@@ -68,20 +69,26 @@ except ImportError:
 from gui.main_window_core import MainWindowCore
 from gui.main_window_ui import MainWindowUIMixin
 from gui.main_window_actions import MainWindowActionsMixin
-from gui.main_window_file_ops import MainWindowFileOpsMixin
+from gui.main_window_file_ops import MainWindowFileOpsMixin, read
 from gui.main_window_canvas import MainWindowCanvasMixin
 from gui.main_window_yolo import MainWindowYOLOMixin
+from gui.main_window_index import MainWindowIndexMixin
+from gui.main_window_queue import MainWindowQueueMixin
 
 # Import required libs
 from libs.resources import *
 from libs.constants import *
 from libs.utils import *
+from libs.cache_manager import CacheManager
+from libs.cache_stats_dialog import CacheStatsDialog
+from libs.object_store import is_object_url
 
 __appname__ = 'RedLabel'
 
 
 class MainWindow(MainWindowCore, MainWindowUIMixin, MainWindowActionsMixin, 
-                MainWindowFileOpsMixin, MainWindowCanvasMixin, MainWindowYOLOMixin):
+                MainWindowFileOpsMixin, MainWindowCanvasMixin, MainWindowYOLOMixin, MainWindowIndexMixin,
+                MainWindowQueueMixin):
     """Main application window combining all functionality through mixins."""
 
     def __init__(self, default_filename=None, default_prefdef_class_file=None, default_save_dir=None):
@@ -136,6 +143,7 @@ class MainWindow(MainWindowCore, MainWindowUIMixin, MainWindowActionsMixin,
         from libs.pascal_voc_io import XML_EXT
         from libs.yolo_io import TXT_EXT
         from libs.create_ml_io import JSON_EXT
+        from libs.packed_io import PACKED_EXT
         from libs.labelFile import LabelFile
         
         if save_format == FORMAT_PASCALVOC:
@@ -153,9 +161,14 @@ class MainWindow(MainWindowCore, MainWindowUIMixin, MainWindowActionsMixin,
             self.actions.save_format.setIcon(new_icon("format_createml"))
             self.label_file_format = LabelFileFormat.CREATE_ML
             LabelFile.suffix = JSON_EXT
+        elif save_format == FORMAT_PACKED:
+            self.actions.save_format.setText(FORMAT_PACKED)
+            self.actions.save_format.setIcon(new_icon("labels"))
+            self.label_file_format = LabelFileFormat.PACKED
+            LabelFile.suffix = PACKED_EXT
 
     def change_format(self):
-        """Cycle through annotation formats: PASCAL VOC -> YOLO -> CreateML -> PASCAL VOC."""
+        """Cycle through annotation formats: PASCAL VOC -> YOLO -> CreateML -> Packed -> PASCAL VOC."""
         from libs.labelFile import LabelFileFormat
         
         if self.label_file_format == LabelFileFormat.PASCAL_VOC:
@@ -163,6 +176,8 @@ class MainWindow(MainWindowCore, MainWindowUIMixin, MainWindowActionsMixin,
         elif self.label_file_format == LabelFileFormat.YOLO:
             self.set_format(FORMAT_CREATEML)
         elif self.label_file_format == LabelFileFormat.CREATE_ML:
+            self.set_format(FORMAT_PACKED)
+        elif self.label_file_format == LabelFileFormat.PACKED:
             self.set_format(FORMAT_PASCALVOC)
         else:
             raise ValueError('Unknown label file format.')
@@ -205,6 +220,17 @@ class MainWindow(MainWindowCore, MainWindowUIMixin, MainWindowActionsMixin,
         msg = u'Name:{0} \nApp Version:{1} \n{2} '.format(__appname__, __version__, sys.version_info)
         QMessageBox.information(self, u'Information', msg)
 
+    def show_cache_stats_dialog(self):
+        """Show memory use and hit rates of the image caches."""
+        if self.cache_stats_dialog is None:
+            self.cache_stats_dialog = CacheStatsDialog(CacheManager.instance(), self)
+            self.cache_stats_dialog.budget_changed.connect(self._on_cache_budget_changed)
+        self.cache_stats_dialog.show()
+        self.cache_stats_dialog.raise_()
+
+    def _on_cache_budget_changed(self, budget):
+        self.settings[SETTING_CACHE_BUDGET] = budget
+
     def show_shortcuts_dialog(self):
         """Show keyboard shortcuts."""
         self.show_tutorial_dialog(browser='default', link='https://github.com/srijan-paul/RedLabel#keyboard-shortcuts')
@@ -228,16 +254,6 @@ def inverted(color):
     return QColor(*[255 - v for v in color.getRgb()])
 
 
-def read(filename, default=None):
-    """Read image file."""
-    try:
-        reader = QImageReader(filename)
-        reader.setAutoTransform(True)
-        return reader.read()
-    except:
-        return default
-
-
 def get_main_app(argv=None):
     """
     Standard boilerplate Qt application code.
@@ -257,7 +273,8 @@ def get_main_app(argv=None):
     argparser.add_argument("save_dir", nargs="?")
     args = argparser.parse_args(argv[1:])
 
-    args.image_dir = args.image_dir and os.path.normpath(args.image_dir)
+    if not is_object_url(args.image_dir):
+        args.image_dir = args.image_dir and os.path.normpath(args.image_dir)
     args.class_file = args.class_file and os.path.normpath(args.class_file)
     args.save_dir = args.save_dir and os.path.normpath(args.save_dir)
 
@@ -0,0 +1,110 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from PyQt5.QtGui import QColor, QImage
+
+from libs.active_learning import SCORING_CONF, YOLOScoringWorker, uncertainty_scores
+from libs.annotation_index import AnnotationIndex
+from libs.yolo_inference import YOLOInferenceEngine
+
+
+class Tensor:
+
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class BrightnessModel:
+    """Gives one box per image whose confidence is the brightness (or darkness) of the image."""
+
+    names = {0: 'thing'}
+
+    def __init__(self, invert=False):
+        self.invert = invert
+        self.thresholds = []
+
+    def __call__(self, source, conf=0.25, verbose=True):
+        self.thresholds.append(conf)
+        confidence = source.mean() / 255.0
+        if self.invert:
+            confidence = 1.0 - confidence
+        count = int(confidence >= conf)
+        return [types.SimpleNamespace(names=self.names, boxes=types.SimpleNamespace(
+            xyxy=Tensor(np.zeros((count, 4), np.float32) + [0, 0, 4, 4]),
+            conf=Tensor(np.full(count, confidence)), cls=Tensor(np.zeros(count))))]
+
+
+class TestUncertaintyScores(unittest.TestCase):
+
+    def test_scores(self):
+        scores = uncertainty_scores([[0.9, 0.5, 0.1], [], [0.99], [0.5]], 0.25)
+        score, entropy, least_confidence, disagreement = scores.T
+        self.assertEqual(scores.shape, (4, 4))
+        self.assertEqual(scores[1].tolist(), [0, 0, 0, 0])
+        self.assertAlmostEqual(entropy[3], 1.0)
+        self.assertAlmostEqual(least_confidence[0], 0.5)
+        self.assertAlmostEqual(disagreement[0], 1 / 3.0)
+        self.assertEqual(disagreement[2], 0)
+        self.assertTrue(np.allclose(score, (entropy + least_confidence + disagreement) / 3))
+        self.assertEqual(list(np.argsort(-score)), [3, 0, 2, 1])
+
+
+class TestScoringWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for index in list(AnnotationIndex._indexes.values()):
+            index.close()
+        shutil.rmtree(self.dir)
+
+    def test_scores_are_stored_per_model(self):
+        paths = []
+        for i, brightness in enumerate((250, 128, 10, 40)):
+            sub_dir = os.path.join(self.dir, 'images', 'ab'[i % 2])
+            os.makedirs(sub_dir, exist_ok=True)
+            paths.append(os.path.join(sub_dir, 'img%d.png' % (i // 2)))
+            image = QImage(8, 8, QImage.Format_RGB32)
+            image.fill(QColor(brightness, brightness, brightness))
+            image.save(paths[-1])
+        names = ['a/img0.png', 'b/img0.png', 'a/img1.png', 'b/img1.png']
+        index = AnnotationIndex.for_directory(self.dir)
+        image_dir = os.path.join(self.dir, 'images')
+        models = {}
+        for digest, model in (('digest', BrightnessModel()), ('other', BrightnessModel(invert=True))):
+            engine = YOLOInferenceEngine()
+            engine.set_model(model, 'model.pt')
+            worker = YOLOScoringWorker(engine, paths, index, digest, image_dir, 0.25)
+            worker.start()
+            worker.wait()
+            models[digest] = model
+        self.assertEqual(set(models['digest'].thresholds), {SCORING_CONF})
+        scores = index.scores('digest')
+        # Unsure (0.16, 0.5) before sure (0.98) before nothing found (0.04).
+        self.assertEqual(sorted(scores, key=lambda name: -scores[name]), [names[3], names[1], names[0], names[2]])
+        # The second model did not replace the scores of the first.
+        other = index.scores('other')
+        self.assertEqual(set(other), set(names))
+        self.assertNotEqual(other, scores)
+        self.assertEqual(index.scored_names('digest'), set(names))
+        self.assertEqual(index.scores('third'), {})
+        self.assertFalse([name for name in os.listdir(self.dir) if name.endswith('.txt')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.annotation_index import INDEX_FILENAME, AnnotationIndex, QueryError
+from libs.pascal_voc_io import PascalVocWriter
+
+
+class TestAnnotationIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for index in list(AnnotationIndex._indexes.values()):
+            index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_voc(self, name, boxes, verified=False):
+        writer = PascalVocWriter('tests', name + '.jpg', (100, 200, 3))
+        for label, x_min, y_min, x_max, y_max in boxes:
+            writer.add_bnd_box(x_min, y_min, x_max, y_max, label, 0)
+        writer.verified = verified
+        writer.save(os.path.join(self.tmp_dir, name + '.xml'))
+
+    def test_queries(self):
+        self.write_voc('a', [('dog', 10, 10, 60, 60)], verified=True)
+        self.write_voc('b', [('cat', 10, 10, 15, 60), ('dog', 0, 0, 50, 50)])
+        self.write_voc('c', [])
+        images = ['/img/%s.jpg' % n for n in 'abcd']
+
+        index = AnnotationIndex.for_directory(self.tmp_dir)
+        self.assertEqual(3, index.update(images))
+        self.assertEqual([0, 1], index.filter(images, 'class:dog'))
+        self.assertEqual([1], index.filter(images, 'class:dog unverified'))
+        self.assertEqual([1], index.filter(images, 'small:10'))
+        self.assertEqual([2], index.filter(images, 'empty'))
+        self.assertEqual([3], index.filter(images, 'unlabeled'))
+        self.assertRaises(QueryError, index.filter, images, 'size:3')
+
+    def test_incremental_update(self):
+        self.write_voc('a', [('dog', 10, 10, 60, 60)])
+        self.write_voc('b', [('dog', 10, 10, 60, 60)])
+        index = AnnotationIndex.for_directory(self.tmp_dir)
+        index.update()
+        self.assertEqual(0, index.update())
+
+        time.sleep(0.01)
+        self.write_voc('a', [('cat', 10, 10, 60, 60)])
+        os.remove(os.path.join(self.tmp_dir, 'b.xml'))
+        self.assertEqual(1, index.update())
+        self.assertEqual({'a'}, index.names('class:cat'))
+        self.assertEqual(set(), index.names('class:dog'))
+
+    def test_unrelated_json_is_skipped(self):
+        self.write_voc('a', [('dog', 10, 10, 60, 60)])
+        with open(os.path.join(self.tmp_dir, 'instances.json'), 'w') as f:
+            f.write('{"images": [], "annotations": [], "categories": []}')
+        index = AnnotationIndex.for_directory(self.tmp_dir)
+        self.assertEqual(2, index.update())
+        self.assertEqual({'a'}, index.names())
+        self.assertEqual({'a': 1}, index.box_counts())
+        # Kept as unreadable, so it is not parsed again.
+        self.assertEqual(0, index.update())
+
+    def test_scores_from_before_models_are_dropped(self):
+        conn = sqlite3.connect(os.path.join(self.tmp_dir, INDEX_FILENAME))
+        conn.execute('CREATE TABLE scores (name TEXT PRIMARY KEY, model TEXT NOT NULL, score REAL NOT NULL, '
+                     'entropy REAL, least_confidence REAL, disagreement REAL)')
+        conn.execute("INSERT INTO scores VALUES ('a', 'one', 0.5, 0, 0, 0)")
+        conn.commit()
+        conn.close()
+        index = AnnotationIndex.for_directory(self.tmp_dir)
+        self.assertEqual({}, index.scores('one'))
+        index.save_scores('one', [('a', 0.5, 0, 0, 0)])
+        index.save_scores('two', [('a', 0.25, 0, 0, 0)])
+        self.assertEqual(({'a': 0.5}, {'a': 0.25}), (index.scores('one'), index.scores('two')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QColor, QImage
+
+from libs import storage
+from libs.archive_source import Archive, get_archive, is_archive
+from libs.storage import image_stat, split_member_path
+from libs.cache_manager import file_key
+from libs.image_decoder import DecoderSelector
+from libs.image_info import probe_image
+
+
+def png_bytes(width, height):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QColor(200, 10, 10))
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, 'PNG')
+    return bytes(data)
+
+
+class TestArchiveSource(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.tmp, 'index')
+        self.files = {'train/a.png': png_bytes(6, 4), 'train/b.png': png_bytes(3, 5), 'notes.txt': b'hello ' * 100}
+
+    def tearDown(self):
+        storage._sources.clear()
+        shutil.rmtree(self.tmp)
+
+    def make_zip(self):
+        path = os.path.join(self.tmp, 'set.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for i, (name, data) in enumerate(sorted(self.files.items())):
+                archive.writestr(name, data, zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED)
+        return path
+
+    def make_tar(self):
+        path = os.path.join(self.tmp, 'set.tar')
+        with tarfile.open(path, 'w') as archive:
+            for name, data in sorted(self.files.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return path
+
+    def test_read_members(self):
+        for path in (self.make_zip(), self.make_tar()):
+            self.assertTrue(is_archive(path))
+            archive = Archive(path, self.index_dir)
+            self.assertEqual(sorted(self.files), sorted(archive.names()))
+            for name, data in self.files.items():
+                self.assertEqual(data, archive.read(name))
+            self.assertTrue(os.path.isfile(archive.index_path))
+
+    def test_index_is_reused_until_the_archive_changes(self):
+        path = self.make_zip()
+        index_path = Archive(path, self.index_dir).index_path
+        with open(index_path) as f:
+            index = f.read()
+        with open(index_path, 'w') as f:
+            f.write(index.replace('notes.txt', 'notes.TXT'))
+        self.assertIn('notes.TXT', Archive(path, self.index_dir))
+        self.files['c.png'] = png_bytes(2, 2)
+        os.remove(path)
+        self.make_zip()
+        archive = Archive(path, self.index_dir)
+        self.assertIn('notes.txt', archive)
+        self.assertIn('c.png', archive)
+
+    def test_member_paths(self):
+        archive = get_archive(self.make_tar(), self.index_dir)
+        path = archive.member_path('train/b.png')
+        self.assertEqual((archive, 'train/b.png'), split_member_path(path))
+        self.assertIsNone(split_member_path(archive.member_path('train/missing.png')))
+        self.assertEqual((archive.mtime_ns, len(self.files['train/b.png'])), image_stat(path))
+        self.assertEqual((path,) + image_stat(path), file_key(path))
+        self.assertEqual((3, 5), probe_image(path)[:2])
+        image = DecoderSelector().decode(path)
+        self.assertEqual((3, 5), (image.width(), image.height()))
+        self.assertEqual(QColor(200, 10, 10).rgb(), image.pixel(1, 1))
+
+    def test_damaged_member_is_unreadable(self):
+        path = self.make_zip()
+        archive = get_archive(path, self.index_dir)
+        offset, stored_size = archive._members['train/a.png'][:2]
+        with open(path, 'r+b') as f:
+            f.seek(offset + stored_size // 2)
+            f.write(b'\x00\xff\x00\xff')
+        member = archive.member_path('train/a.png')
+        self.assertRaises(OSError, archive.read, 'train/a.png')
+        self.assertIsNone(probe_image(member))
+        self.assertIsNone(DecoderSelector().decode(member))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.pascal_voc_io import PascalVocReader, PascalVocWriter
+from libs.yolo_io import YOLOWriter, YoloReader
+from libs.bulk_io import read_pascal_voc_dir, read_yolo_dir
+
+
+class FakeImage:
+    """Stands in for the QImage YoloReader reads its size from."""
+
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def isGrayscale(self):
+        return False
+
+
+class TestBulkPascalVoc(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_matches_single_file_reader(self):
+        for i in range(3):
+            writer = PascalVocWriter('tests', 'img%d.jpg' % i, (512, 512, 3))
+            writer.add_bnd_box(60, 40, 430, 504, 'person', i == 1)
+            if i:
+                writer.add_bnd_box(113, 40, 450, 403, 'face', 0)
+            writer.verified = i == 2
+            writer.save(os.path.join(self.tmp_dir, 'img%d.xml' % i))
+        with open(os.path.join(self.tmp_dir, 'broken.xml'), 'w') as f:
+            f.write('<annotation>')
+
+        bulk = read_pascal_voc_dir(self.tmp_dir, class_list=['face'])
+
+        self.assertEqual(['face', 'person'], bulk.classes)
+        self.assertEqual(5, len(bulk))
+        self.assertEqual([0, 0, 1, 3, 5], bulk.offsets.tolist())
+        self.assertEqual([1, 2, 2, 3, 3], bulk.file_ids.tolist())
+        self.assertEqual([False, False, False, True], bulk.verified.tolist())
+        self.assertEqual([False, True, False, False, False], bulk.difficult.tolist())
+        self.assertEqual([60, 40, 430, 504], bulk.boxes[0].tolist())
+        self.assertEqual(1, len(bulk.errors))
+        for i, path in enumerate(bulk.files[1:], 1):
+            self.assertEqual(PascalVocReader(path).get_shapes(), bulk.get_shapes(i))
+
+
+class TestBulkYolo(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_matches_single_file_reader(self):
+        sizes = [(512, 512), (480, 640), (1000, 333)]
+        class_list = []
+        for i, (height, width) in enumerate(sizes):
+            writer = YOLOWriter('tests', 'img%d' % i, (height, width, 3))
+            writer.add_bnd_box(60, 40, 301, 199, 'person', 0)
+            writer.add_bnd_box(0, 7, 250, 333, 'face', 0)
+            writer.save(class_list, os.path.join(self.tmp_dir, 'img%d.txt' % i))
+        with open(os.path.join(self.tmp_dir, 'bad.txt'), 'w') as f:
+            f.write('0 0.5 0.5\n')
+        with open(os.path.join(self.tmp_dir, 'unknown.txt'), 'w') as f:
+            f.write('7 0.5 0.5 0.1 0.1\n')
+
+        bulk = read_yolo_dir(self.tmp_dir)
+
+        self.assertTrue(bulk.normalized)
+        self.assertEqual(['person', 'face'], bulk.classes[:2])
+        self.assertEqual(8, len(bulk.classes))
+        self.assertEqual([0, 0, 2, 4, 6, 7], bulk.offsets.tolist())
+        self.assertEqual(['bad.txt', 'unknown.txt'], sorted(os.path.basename(p) for p, _ in bulk.errors))
+
+        dims = [(1, 1), (512, 512), (480, 640), (1000, 333), (1, 1)]
+        pixels = bulk.to_pixels(dims)
+        for i, (height, width) in enumerate(sizes, 1):
+            reader = YoloReader(bulk.files[i], FakeImage(width, height))
+            start, end = bulk.offsets[i], bulk.offsets[i + 1]
+            self.assertEqual(reader.get_shapes(), bulk.get_shapes(i, pixels[start:end]))
+            self.assertEqual(pixels[start:end].tolist(), bulk.pixel_boxes(i, height, width).tolist())
+
+    def test_undecodable_file_is_an_error(self):
+        with open(os.path.join(self.tmp_dir, 'binary.txt'), 'wb') as f:
+            f.write(b'\xff\xfe\x00\x81 0.5 0.5 0.1 0.1\n')
+        with open(os.path.join(self.tmp_dir, 'good.txt'), 'w') as f:
+            f.write('0 0.5 0.5 0.1 0.1\n')
+        with open(os.path.join(self.tmp_dir, 'classes.txt'), 'w') as f:
+            f.write('car\n')
+
+        bulk = read_yolo_dir(self.tmp_dir)
+
+        self.assertEqual(['binary.txt'], [os.path.basename(p) for p, _ in bulk.errors])
+        self.assertEqual([0, 0, 1], bulk.offsets.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.cache_manager import CacheManager, PRIORITY_HIGH, PRIORITY_LOW
+
+
+class TestCacheManager(unittest.TestCase):
+
+    def test_lru_and_stats(self):
+        manager = CacheManager(budget=300)
+        cache = manager.register('images')
+        self.assertIs(cache, manager.register('images'))
+        for key in 'abc':
+            cache.put(key, key, nbytes=100)
+        self.assertEqual('a', cache.get('a'))
+        self.assertIsNone(cache.get('x'))
+        cache.put('d', 'd', nbytes=100)
+        # b was least recently used.
+        self.assertNotIn('b', cache)
+        self.assertEqual(300, manager.total_bytes)
+        stats = cache.stats()
+        self.assertEqual((1, 1, 1, 3), (stats['hits'], stats['misses'], stats['evictions'], stats['entries']))
+
+    def test_priorities_and_pins(self):
+        manager = CacheManager(budget=300)
+        thumbnails = manager.register('thumbnails', PRIORITY_LOW)
+        images = manager.register('images', PRIORITY_HIGH)
+        thumbnails.put('t1', 1, nbytes=100)
+        thumbnails.put('t2', 2, nbytes=100)
+        images.put('i1', 1, nbytes=100, pin=True)
+        images.put('i2', 2, nbytes=50)
+        # The low-priority cache pays first.
+        self.assertEqual(['t2'], [k for k in ('t1', 't2') if k in thumbnails])
+        images.put('i3', 3, nbytes=200)
+        # Pinned i1 and the new entry survive; everything else goes.
+        self.assertEqual(0, len(thumbnails))
+        self.assertEqual(['i1', 'i3'], [k for k in ('i1', 'i2', 'i3') if k in images])
+        images.unpin()
+        manager.set_budget(200)
+        self.assertEqual(['i3'], [k for k in ('i1', 'i2', 'i3') if k in images])
+        self.assertEqual(200, manager.total_bytes)
+
+    def test_per_cache_limit(self):
+        manager = CacheManager(budget=1000)
+        cache = manager.register('thumbnails', max_bytes=150)
+        cache.put('a', 'a', nbytes=100)
+        cache.put('b', 'b', nbytes=100)
+        self.assertEqual(['b'], [k for k in 'ab' if k in cache])
+        self.assertEqual(100, manager.total_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
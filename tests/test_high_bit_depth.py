@@ -0,0 +1,102 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+import numpy as np
+from PyQt5.QtGui import QColor, QImage
+
+from libs.high_bit_depth import HighBitDepthImage, is_high_bit_depth, read_raw
+from libs.image_array import qimage_to_array
+
+
+def gray16(values):
+    """A Grayscale16 QImage holding the uint16 array values."""
+    height, width = values.shape
+    image = QImage(width, height, QImage.Format_Grayscale16)
+    qimage_to_array(image, writable=True)[...] = values
+    return image
+
+
+def set_tiff_tag(path, tag, count, value):
+    """Overwrite the count and SHORT value of an existing tag of a little-endian TIFF."""
+    with open(path, 'r+b') as f:
+        data = f.read()
+        offset = struct.unpack('<I', data[4:8])[0]
+        for i in range(struct.unpack('<H', data[offset:offset + 2])[0]):
+            entry = offset + 2 + 12 * i
+            if struct.unpack('<H', data[entry:entry + 2])[0] == tag:
+                f.seek(entry + 4)
+                f.write(struct.pack('<IHH', count, value, 0))
+                return
+    raise KeyError(tag)
+
+
+class TestHighBitDepth(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.values = (np.arange(48 * 40, dtype=np.uint16) * 2).reshape(40, 48)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def save(self, name, image):
+        path = os.path.join(self.tmp, name)
+        self.assertTrue(image.save(path))
+        return path
+
+    def test_tiff_is_memory_mapped(self):
+        path = self.save('a.tif', gray16(self.values))
+        self.assertTrue(is_high_bit_depth(path))
+        raw = read_raw(path)
+        self.assertIsInstance(raw, np.memmap)
+        np.testing.assert_array_equal(self.values, raw)
+
+    def test_rotated_tiff_is_left_to_qt(self):
+        path = self.save('a.tif', gray16(self.values))
+        set_tiff_tag(path, 274, 1, 3)  # Orientation: rotated 180 degrees
+        raw = read_raw(path)
+        self.assertNotIsInstance(raw, np.memmap)
+        np.testing.assert_array_equal(self.values[::-1, ::-1], raw)
+
+    def test_truncated_tiff_tag(self):
+        path = self.save('a.tif', gray16(self.values))
+        set_tiff_tag(path, 256, 0, 0)  # ImageWidth without a value
+        self.assertFalse(is_high_bit_depth(path))
+
+    def test_png_and_8_bit_files(self):
+        path = self.save('a.png', gray16(self.values))
+        self.assertTrue(is_high_bit_depth(path))
+        np.testing.assert_array_equal(self.values, read_raw(path))
+        image = QImage(8, 8, QImage.Format_RGB32)
+        image.fill(QColor(1, 2, 3))
+        self.assertFalse(is_high_bit_depth(self.save('b.png', image)))
+        self.assertFalse(is_high_bit_depth(self.save('b.tif', image)))
+
+    def test_window_level(self):
+        hdr = HighBitDepthImage(self.values)
+        self.assertEqual(4095, hdr.max_value)
+        self.assertTrue(hdr.set_window(1000, 200))
+        self.assertFalse(hdr.set_window(1000, 200))
+        display = qimage_to_array(hdr.display)
+        self.assertEqual(0, display[0, 0])  # 0 is below 900
+        self.assertEqual(255, display[39, 47])  # 3838 is above 1100
+        row, col = divmod(500, 48)  # 1000, the level
+        self.assertIn(display[row, col], (127, 128))
+
+    def test_colour_channels(self):
+        raw = np.zeros((4, 5, 3), np.uint16)
+        raw[..., 0] = 60000
+        hdr = HighBitDepthImage(raw)
+        hdr.set_window(32768, 65535)
+        self.assertEqual(QColor(hdr.display.pixel(4, 3)).getRgb()[:3], (233, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import gc
+import os
+import sys
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+import numpy as np
+from PyQt5.QtGui import QColor, QImage
+
+from libs.image_array import array_to_qimage, image_digest, qimage_to_array, qimage_to_bgr
+from libs.yolo_inference import YOLOInferenceEngine
+
+
+class TestImageArray(unittest.TestCase):
+
+    def test_qimage_to_bgr_shares_pixels(self):
+        image = QImage(7, 5, QImage.Format_RGB32)
+        image.fill(QColor(10, 20, 30))
+        bgr = qimage_to_bgr(image)
+        self.assertEqual((5, 7, 3), bgr.shape)
+        self.assertEqual([30, 20, 10], bgr[4, 6].tolist())
+        self.assertEqual(int(image.constBits()), bgr.__array_interface__['data'][0])
+        # The view keeps the image alive.
+        del image
+        gc.collect()
+        self.assertEqual([30, 20, 10], bgr[0, 0].tolist())
+
+    def test_writable_view_detaches_shared_image(self):
+        image = QImage(4, 4, QImage.Format_Grayscale8)
+        image.fill(1)
+        other = QImage(image)
+        qimage_to_array(image, writable=True)[0, 0] = 9
+        self.assertEqual(9, qimage_to_array(image)[0, 0])
+        self.assertEqual(1, qimage_to_array(other)[0, 0])
+
+    def test_array_to_qimage(self):
+        array = np.zeros((6, 10, 3), np.uint8)
+        array[..., 2] = 255  # red in BGR
+        image = array_to_qimage(array[1:5, 2:9])
+        self.assertEqual((7, 4), (image.width(), image.height()))
+        self.assertEqual(QColor(255, 0, 0).rgb(), image.pixel(0, 0))
+        gray = array_to_qimage(np.full((3, 5), 77, np.uint8), copy=True)
+        self.assertEqual(77, QColor(gray.pixel(4, 2)).red())
+
+    def test_engine_accepts_decoded_image(self):
+        seen = []
+
+        class Model:
+            def __call__(self, source, conf):
+                seen.append(source)
+                return [type('Result', (), {'boxes': None, 'names': {}})()]
+
+        engine = YOLOInferenceEngine()
+        engine.model = Model()
+        image = QImage(8, 6, QImage.Format_RGB32)
+        self.assertEqual([], engine.predict_image(image))
+        self.assertEqual((6, 8, 3), seen[0].shape)
+
+    def test_image_digest_ignores_row_padding(self):
+        pixels = np.arange(5 * 3 * 3, dtype=np.uint8).reshape(5, 3, 3)
+        image = QImage(3, 5, QImage.Format_RGB888)
+        image.fill(QColor(0, 0, 0))
+        view = qimage_to_array(image, writable=True)
+        view[...] = pixels
+        # Rows of 9 bytes are padded to 12; an image built over other padding bytes must hash the same.
+        padded = np.full((5, 12), 255, np.uint8)
+        padded[:, :9] = pixels.reshape(5, 9)
+        other = QImage(padded.tobytes(), 3, 5, 12, QImage.Format_RGB888)
+        self.assertEqual(image_digest(image), image_digest(other))
+        view[0, 0, 0] = 1
+        self.assertNotEqual(image_digest(image), image_digest(other))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from PyQt5.QtGui import QColor, QImage
+
+from libs.image_decoder import Decoder, DecoderSelector, QtDecoder, image_format
+
+
+class FakeDecoder(Decoder):
+
+    def __init__(self, name, delay=0.0, fails=False):
+        self.name = name
+        self.delay = delay
+        self.fails = fails
+        self.calls = 0
+
+    def decode(self, path, max_size=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        return None if self.fails else QImage(300, 200, QImage.Format_RGB32)
+
+
+class TestImageDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.choices_path = os.path.join(self.tmp_dir, 'choices.json')
+        image = QImage(300, 200, QImage.Format_RGB32)
+        image.fill(QColor('blue'))
+        self.path = os.path.join(self.tmp_dir, 'a.png')
+        image.save(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_image_format(self):
+        self.assertEqual('jpg', image_format('/x/A.JPEG'))
+        self.assertEqual('tiff', image_format('b.tif'))
+
+    def test_qt_decoder_scales(self):
+        image = QtDecoder().decode(self.path, 150)
+        self.assertEqual((150, 100), (image.width(), image.height()))
+
+    def test_fastest_backend_is_chosen_and_remembered(self):
+        fast, slow = FakeDecoder('fast'), FakeDecoder('slow', delay=0.05)
+        selector = DecoderSelector([slow, fast], self.choices_path)
+        self.assertIs(fast, selector.decoder_for(self.path))
+        self.assertFalse(selector.decode(self.path).isNull())
+
+        fast, slow = FakeDecoder('fast'), FakeDecoder('slow')
+        selector = DecoderSelector([slow, fast], self.choices_path)
+        self.assertEqual('fast', selector.decoder_for(self.path).name)
+        self.assertEqual(0, fast.calls + slow.calls)
+
+        # A different set of backends benchmarks again.
+        other = FakeDecoder('other')
+        selector = DecoderSelector([other], self.choices_path)
+        selector.decoder_for(self.path)
+        self.assertTrue(other.calls)
+
+    def test_failing_backend_falls_back_to_qt(self):
+        broken = FakeDecoder('broken', fails=True)
+        selector = DecoderSelector([broken], self.choices_path)
+        self.assertEqual('qt', selector.decoder_for(self.path).name)
+        self.assertFalse(selector.decode(self.path).isNull())
+
+
+if __name__ == '__main__':
+    unittest.main()
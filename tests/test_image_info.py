@@ -0,0 +1,74 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from PyQt5.QtGui import QImage, QColor
+
+from libs.image_info import ImageInfoCache, probe_image
+
+
+def exif_jpeg_header(width, height, orientation):
+    """A JPEG stream cut after its SOF0 segment, with an EXIF orientation tag."""
+    tiff = b'II*\x00' + struct.pack('<I', 8) + struct.pack('<H', 1) + \
+        struct.pack('<HHII', 274, 3, 1, orientation) + struct.pack('<I', 0)
+    app1 = b'Exif\x00\x00' + tiff
+    sof = struct.pack('>BHHB', 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    return (b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+            b'\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof)
+
+
+class TestImageInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_probe_matches_qt(self):
+        color = QImage(37, 21, QImage.Format_RGB32)
+        color.fill(QColor(200, 10, 10))
+        gray = color.convertToFormat(QImage.Format_Grayscale8)
+        cases = [(color, 'color.png'), (color, 'color.jpg'), (color, 'color.bmp'),
+                 (gray, 'gray.png'), (gray, 'gray.jpg')]
+        paths = [os.path.join(dir_name, 'test.512.512.bmp')]
+        for image, name in cases:
+            path = os.path.join(self.tmp_dir, name)
+            self.assertTrue(image.save(path))
+            paths.append(path)
+        for path in paths:
+            image = QImage(path)
+            info = probe_image(path)
+            self.assertEqual([image.height(), image.width(), 1 if image.isGrayscale() else 3],
+                             info.shape, path)
+
+    def test_exif_orientation_swaps_size(self):
+        path = os.path.join(self.tmp_dir, 'rotated.jpg')
+        with open(path, 'wb') as f:
+            f.write(exif_jpeg_header(640, 480, 6))
+        info = probe_image(path)
+        self.assertEqual((480, 640, 3, 6), tuple(info))
+
+    def test_cache_persists_and_revalidates(self):
+        path = os.path.join(self.tmp_dir, 'a.jpg')
+        with open(path, 'wb') as f:
+            f.write(exif_jpeg_header(100, 50, 1))
+        cache = ImageInfoCache(self.tmp_dir)
+        self.assertEqual(100, cache.get(path).width)
+        cache.save()
+
+        reloaded = ImageInfoCache(self.tmp_dir)
+        self.assertIn('a.jpg', reloaded._entries)
+        with open(path, 'wb') as f:
+            f.write(exif_jpeg_header(300, 200, 1) + b'\x00')
+        self.assertEqual(300, reloaded.get(path).width)
+
+
+if __name__ == '__main__':
+    unittest.main()
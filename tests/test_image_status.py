@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.image_status import ImageStatusTracker, LABELED, VERIFIED
+
+
+class TestImageStatusTracker(unittest.TestCase):
+
+    def test_counts_and_navigation(self):
+        paths = ['/img/%d.jpg' % i for i in range(10)]
+        tracker = ImageStatusTracker(paths)
+        tracker.load({'0', '1', '2', '5'}, {'1'}, lambda p: os.path.splitext(os.path.basename(p))[0])
+        self.assertEqual((4, 1), (tracker.labeled_count, tracker.verified_count))
+
+        self.assertEqual(3, tracker.find_next(0, LABELED))
+        self.assertEqual(4, tracker.find_next(3, LABELED))
+        self.assertEqual(4, tracker.find_next(5, LABELED, step=-1))
+        self.assertEqual(2, tracker.find_next(1, VERIFIED))
+
+        tracker.set_path_status('/img/3.jpg', labeled=True, verified=True)
+        tracker.set_status(1, verified=False)
+        self.assertEqual((5, 1), (tracker.labeled_count, tracker.verified_count))
+        # Wraps around past the end of the list.
+        for i in range(6, 10):
+            tracker.set_status(i, labeled=True)
+        self.assertEqual(4, tracker.find_next(8, LABELED))
+        tracker.set_status(4, labeled=True)
+        self.assertIsNone(tracker.find_next(8, LABELED))
+        self.assertEqual([], tracker.unlabeled_paths())
+
+    def test_remap(self):
+        tracker = ImageStatusTracker(['a', 'b', 'c'])
+        tracker.set_status(1, labeled=True, verified=True)
+        tracker.remap(['x', 'b', 'c', 'y'], labeled_paths=['y'])
+        self.assertEqual(1, tracker.index_of('b'))
+        self.assertEqual([0, 3, 0, 1], tracker.flags.tolist())
+        self.assertEqual((2, 1), (tracker.labeled_count, tracker.verified_count))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -97,5 +97,55 @@ class TestCreateMLRW(unittest.TestCase):
         self.assertEqual(365, y_max, 'ymax is wrong')
 
 
+class TestCreateMLStore(unittest.TestCase):
+
+    def test_batched_writes_and_external_changes(self):
+        dir_name = os.path.abspath(os.path.dirname(__file__))
+        libs_path = os.path.join(dir_name, '..', 'libs')
+        sys.path.insert(0, libs_path)
+        from create_ml_io import CreateMLStore
+        import json
+        import tempfile
+
+        json_path = os.path.join(tempfile.mkdtemp(), 'store.json')
+        store = CreateMLStore(json_path, batch_size=3, max_delay=60)
+
+        # A new file is created right away, later puts are batched.
+        store.put({'image': 'a.jpg', 'verified': False, 'annotations': []})
+        store.put({'image': 'b.jpg', 'verified': False, 'annotations': []})
+        with open(json_path) as f:
+            self.assertEqual(['a.jpg'], [r['image'] for r in json.load(f)])
+        self.assertEqual('b.jpg', store.get('b.jpg')['image'])
+        store.flush()
+        with open(json_path) as f:
+            data = f.read()
+        self.assertEqual(json.dumps(json.loads(data)), data)
+        self.assertEqual(['a.jpg', 'b.jpg'], [r['image'] for r in json.loads(data)])
+
+        # An external edit is picked up; pending local records survive it.
+        store.put({'image': 'c.jpg', 'verified': True, 'annotations': []})
+        with open(json_path, 'w') as f:
+            json.dump([{'image': 'z.jpg', 'verified': True, 'annotations': []}], f, indent=1)
+        self.assertIsNone(store.get('a.jpg'))
+        store.flush()
+        with open(json_path) as f:
+            self.assertEqual(['z.jpg', 'c.jpg'], [r['image'] for r in json.load(f)])
+
+    def test_other_json_is_rejected(self):
+        dir_name = os.path.abspath(os.path.dirname(__file__))
+        libs_path = os.path.join(dir_name, '..', 'libs')
+        sys.path.insert(0, libs_path)
+        from create_ml_io import CreateMLStore
+        import json
+        import tempfile
+
+        json_path = os.path.join(tempfile.mkdtemp(), 'instances.json')
+        for data in ({'images': [], 'annotations': []}, [1, 2], [{'image': 'a.jpg'}],
+                     [{'image': 'a.jpg', 'annotations': [{'label': 'car', 'coordinates': [1, 2]}]}]):
+            with open(json_path, 'w') as f:
+                json.dump(data, f)
+            self.assertRaises(ValueError, CreateMLStore, json_path)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,116 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.onnx_backend import ONNXModel, _stale_exports, decode_output, letterbox_batch, onnx_cache_path
+from libs.yolo_inference import BACKEND_ONNX, YOLOInferenceEngine
+
+HAVE_CV2 = importlib.util.find_spec('cv2') is not None
+HAVE_ONNX = all(importlib.util.find_spec(name) is not None for name in ('onnx', 'onnxruntime'))
+
+# Raw output of a YOLO model with two classes and three anchors, in a 640x640 input:
+# a car at (100, 200)-(300, 300), the same car again with a lower score, and a person under the threshold.
+OUTPUT = np.array([
+    [200, 205, 400],
+    [250, 252, 400],
+    [200, 200, 20],
+    [100, 100, 20],
+    [0.9, 0.6, 0.0],
+    [0.0, 0.1, 0.1],
+], np.float32)
+
+
+def write_model(path):
+    """An ONNX model with the inputs, outputs and metadata of a YOLO export, always giving OUTPUT."""
+    import onnx
+    from onnx import TensorProto, helper
+    nodes = [
+        helper.make_node('ReduceMean', ['images'], ['mean'], axes=[1, 2, 3], keepdims=1),
+        helper.make_node('Mul', ['mean', 'zero'], ['zeros']),
+        helper.make_node('Add', ['zeros', 'raw'], ['sum']),
+        helper.make_node('Squeeze', ['sum', 'axis'], ['output0']),
+    ]
+    graph = helper.make_graph(
+        nodes, 'yolo',
+        [helper.make_tensor_value_info('images', TensorProto.FLOAT, ['batch', 3, 'height', 'width'])],
+        [helper.make_tensor_value_info('output0', TensorProto.FLOAT, ['batch', 6, 3])],
+        [helper.make_tensor('zero', TensorProto.FLOAT, [], [0.0]),
+         helper.make_tensor('raw', TensorProto.FLOAT, OUTPUT.shape, OUTPUT.flatten().tolist()),
+         helper.make_tensor('axis', TensorProto.INT64, [1], [1])])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)])
+    model.ir_version = 8
+    helper.set_model_props(model, {'names': "{0: 'car', 1: 'person'}", 'imgsz': '[640, 640]'})
+    onnx.save(model, path)
+
+
+class TestONNXBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_exports_are_named_after_the_model_hash(self):
+        model_path = os.path.join(self.dir, 'yolo11n.pt')
+        path = onnx_cache_path(model_path, 'ab' * 20)
+        self.assertEqual(path, os.path.join(self.dir, 'yolo11n.' + 'ab' * 6 + '.onnx'))
+        old = onnx_cache_path(model_path, 'cd' * 20)
+        for name in (path, old, os.path.join(self.dir, 'yolo11n.onnx'), os.path.join(self.dir, 'yolo11n.x.onnx')):
+            open(name, 'wb').close()
+        self.assertEqual(_stale_exports(model_path, path), [old])
+
+    def test_decode_output(self):
+        # A 1280x640 image letterboxed into 640x640: half size, 160 pixels of padding above.
+        boxes, confidences, class_ids = decode_output(OUTPUT, 0.25, (0.5, 0, 160), (640, 1280))
+        self.assertEqual(boxes.tolist(), [[200, 80, 600, 280]])
+        self.assertEqual(class_ids.tolist(), [0])
+        self.assertAlmostEqual(float(confidences[0]), 0.9, places=5)
+        boxes, _, class_ids = decode_output(OUTPUT, 0.05, (0.5, 0, 160), (640, 1280))
+        self.assertEqual(class_ids.tolist(), [0, 1])
+        self.assertEqual(boxes[1].tolist(), [780, 460, 820, 500])
+
+    @unittest.skipUnless(HAVE_CV2, 'OpenCV is not installed')
+    def test_letterbox_batch(self):
+        images = [np.full((100, 200, 3), 255, np.uint8), np.zeros((64, 64, 4), np.uint8)]
+        images[0][..., 0] = 0
+        batch, transforms = letterbox_batch(images, (64, 64))
+        self.assertEqual(batch.shape, (2, 3, 64, 64))
+        self.assertEqual(batch.dtype, np.float32)
+        self.assertEqual(transforms, [(0.32, 0, 16), (1.0, 0, 0)])
+        # Blue became the last channel and the borders are padding gray.
+        self.assertEqual(batch[0, :, 32, 32].tolist(), [1.0, 1.0, 0.0])
+        self.assertAlmostEqual(float(batch[0, 0, 0, 0]), 114 / 255.0, places=6)
+        self.assertEqual(float(batch[1].max()), 0.0)
+
+    @unittest.skipUnless(HAVE_CV2 and HAVE_ONNX, 'onnx, onnxruntime or OpenCV is not installed')
+    def test_engine_uses_cached_export(self):
+        model_path = os.path.join(self.dir, 'm.pt')
+        with open(model_path, 'wb') as f:
+            f.write(b'weights')
+        engine = YOLOInferenceEngine()
+        engine.backend = BACKEND_ONNX
+        write_model(onnx_cache_path(model_path, engine.model_cache.key(model_path)[1]))
+        self.assertTrue(engine.load_model(model_path))
+        self.assertIsInstance(engine.model, ONNXModel)
+        self.assertEqual(engine.get_class_names(), ['car', 'person'])
+        self.assertIs(engine.resident_model(model_path), engine.model)
+        detections = engine.predict_image(np.zeros((320, 640, 3), np.uint8))
+        self.assertEqual([d['class_name'] for d in detections], ['car'])
+        self.assertEqual(detections[0]['bbox'], [100.0, 40.0, 300.0, 140.0])
+        engine.tile_size = 400
+        # The stand-in finds a car in each crop; none of them ends at a tile border, so all stay.
+        detections = engine.predict_image(np.zeros((320, 640, 3), np.uint8))
+        self.assertEqual(sorted(d['bbox'][0] for d in detections), [62.5, 100.0, 302.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
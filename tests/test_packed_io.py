@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.pascal_voc_io import PascalVocReader, PascalVocWriter
+from libs.packed_io import (PackedReader, PackedStore, PackedWriter, packed_db_path,
+                            import_annotations, export_annotations)
+
+
+class TestPackedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for store in list(PackedStore._stores.values()):
+            store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_read(self):
+        db_path = packed_db_path(self.tmp_dir)
+        writer = PackedWriter('tests', 'img.jpg', (512, 512, 3))
+        writer.add_bnd_box(60, 40, 430, 504, 'person', 1)
+        writer.verified = True
+        writer.save(db_path)
+        # Saving again replaces the image's shapes.
+        writer.add_bnd_box(113, 40, 450, 403, 'face', 0)
+        writer.save(db_path)
+
+        reader = PackedReader(db_path, '/somewhere/img.png')
+        self.assertTrue(reader.verified)
+        self.assertEqual([('person', [(60, 40), (430, 40), (430, 504), (60, 504)], None, None, True),
+                          ('face', [(113, 40), (450, 40), (450, 403), (113, 403)], None, None, False)],
+                         reader.get_shapes())
+        self.assertEqual([], PackedReader(db_path, 'other.jpg').get_shapes())
+
+    def test_import_export_voc(self):
+        source_dir = os.path.join(self.tmp_dir, 'voc')
+        target_dir = os.path.join(self.tmp_dir, 'out')
+        os.makedirs(source_dir)
+        os.makedirs(target_dir)
+        writer = PascalVocWriter('voc', 'img.jpg', (512, 512, 3))
+        writer.add_bnd_box(60, 40, 430, 504, 'person', 0)
+        writer.save(os.path.join(source_dir, 'img.xml'))
+
+        store = PackedStore.open(packed_db_path(self.tmp_dir))
+        self.assertEqual(1, import_annotations(store, source_dir, 'xml'))
+        self.assertEqual(['img'], store.names())
+        self.assertEqual(1, export_annotations(store, target_dir, 'xml'))
+        self.assertEqual(PascalVocReader(os.path.join(source_dir, 'img.xml')).get_shapes(),
+                         PascalVocReader(os.path.join(target_dir, 'img.xml')).get_shapes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.sharding import annotation_names, annotation_path, is_sharded, reshard, save_dir_root
+from libs.yolo_io import YOLOWriter, YoloReader
+
+
+class FakeImage:
+
+    def height(self):
+        return 100
+
+    def width(self):
+        return 200
+
+    def isGrayscale(self):
+        return False
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reshard(self):
+        files = {'a.txt': '0 0.5 0.5 0.1 0.1\n', 'b.v2.xml': '<annotation><filename>b.v2.jpg</filename></annotation>',
+                 'c.json': '[{"image": "c.jpg", "annotations": []}]', 'img.txt': 'not a label',
+                 'classes.txt': 'dog\n', '.hidden.json': 'x', 'README.txt': 'Labels of the dog set.\n',
+                 'config.json': '{"epochs": 3}', 'pom.xml': '<project/>'}
+        for name, text in files.items():
+            with open(os.path.join(self.tmp_dir, name), 'w') as f:
+                f.write(text)
+        self.assertEqual({'a', 'img', 'README'}, annotation_names(self.tmp_dir, '.txt'))
+
+        self.assertEqual(4, reshard(self.tmp_dir, workers=2, image_paths=['/images/img.jpg']))
+        self.assertTrue(is_sharded(self.tmp_dir))
+        self.assertEqual(['.hidden.json', '.redlabel_sharded', 'README.txt', 'classes.txt', 'config.json', 'pom.xml'],
+                         sorted(f for f in os.listdir(self.tmp_dir)
+                                if os.path.isfile(os.path.join(self.tmp_dir, f))))
+        xml_path = annotation_path(self.tmp_dir, '/images/b.v2.jpg', '.xml')
+        self.assertTrue(os.path.isfile(xml_path))
+        self.assertEqual(3, len(os.path.relpath(xml_path, self.tmp_dir).split(os.sep)))
+        self.assertEqual(self.tmp_dir, save_dir_root(xml_path))
+        self.assertEqual({'a', 'img'}, annotation_names(self.tmp_dir, '.txt'))
+
+    def test_yolo_classes_at_root(self):
+        reshard(self.tmp_dir)
+        txt_path = annotation_path(self.tmp_dir, 'img.jpg', '.txt', create=True)
+        writer = YOLOWriter('tests', 'img.jpg', (100, 200, 3))
+        writer.add_bnd_box(20, 10, 120, 60, 'cat', 0)
+        writer.save(['dog', 'cat'], txt_path)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, 'classes.txt')))
+
+        shapes = YoloReader(txt_path, FakeImage()).get_shapes()
+        self.assertEqual('cat', shapes[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from PyQt5.QtGui import QColor, QImage
+
+from libs.thumbnails import ThumbnailCache, make_thumbnail
+
+
+class TestThumbnails(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_image(self, name, width=640, height=480):
+        image = QImage(width, height, QImage.Format_RGB32)
+        image.fill(QColor('red'))
+        path = os.path.join(self.tmp_dir, name)
+        image.save(path)
+        return path
+
+    def test_make_thumbnail_keeps_aspect(self):
+        thumbnail = make_thumbnail(self.make_image('a.jpg'), 128)
+        self.assertEqual((128, 96), (thumbnail.width(), thumbnail.height()))
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = ThumbnailCache(os.path.join(self.tmp_dir, 'cache'), max_bytes=10 ** 6)
+        paths = [self.make_image('%d.png' % i) for i in range(3)]
+        for path in paths:
+            cache.put(path, make_thumbnail(path))
+        self.assertFalse(cache.get(paths[0]).isNull())
+
+        cache.max_bytes = cache.total_bytes - 1
+        cache._touched[cache._key(paths[1])] = 0  # least recently used
+        cache.put(paths[2], make_thumbnail(paths[2]))
+        self.assertIsNone(cache.get(paths[1]))
+        self.assertIsNotNone(cache.get(paths[0]))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import os
 import sys
 import unittest
 from libs.utils import Struct, new_action, new_icon, add_actions, format_shortcut, generate_color_by_text, natural_sort
+from libs.utils import natural_insert_position
 
 class TestUtils(unittest.TestCase):
 
@@ -18,5 +19,11 @@ class TestUtils(unittest.TestCase):
         for idx, val in enumerate(l1):
             self.assertTrue(val == expected_l1[idx])
 
+    def test_naturalInsertPosition_keepsOrder(self):
+        l1 = ['f1', 'f3', 'f11']
+        self.assertEqual(2, natural_insert_position(l1, 'f4'))
+        self.assertEqual(0, natural_insert_position(l1, 'F0', key=lambda x: x.lower()))
+        self.assertEqual(3, natural_insert_position(l1, 'f20'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from PyQt5.QtWidgets import QApplication
+
+from libs import storage
+from libs.image_array import qimage_to_array
+from libs.image_decoder import decode_image
+from libs.image_info import probe_image
+from libs.video_source import Video, get_video, is_video, video_support
+
+FRAMES = 40
+
+
+def make_video(path):
+    """A video of random frames with a keyframe every 8 frames; returns the frames as decoded (BGRA)."""
+    import av
+    with av.open(path, 'w') as container:
+        stream = container.add_stream('mpeg4', rate=25)
+        stream.width, stream.height, stream.pix_fmt = 32, 24, 'yuv420p'
+        stream.codec_context.gop_size = 8
+        for i in range(FRAMES):
+            pixels = np.random.RandomState(i).randint(0, 255, (24, 32, 3)).astype(np.uint8)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(pixels, format='rgb24')):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    with av.open(path) as container:
+        return [frame.to_ndarray(format='bgra') for frame in container.decode(video=0)]
+
+
+@unittest.skipUnless(video_support(), 'PyAV is not installed')
+class TestVideoSource(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.tmp, 'index')
+        self.path = os.path.join(self.tmp, 'cam.mp4')
+        self.frames = make_video(self.path)
+
+    def tearDown(self):
+        for source in storage._sources.values():
+            source.close()
+        storage._sources.clear()
+        shutil.rmtree(self.tmp)
+
+    def assert_frame(self, video, number):
+        image = video.decode(video.frame_name(number))
+        self.assertTrue(np.array_equal(qimage_to_array(image)[..., :3], self.frames[number][..., :3]), number)
+
+    def test_index(self):
+        self.assertTrue(is_video(self.path))
+        video = Video(self.path, self.index_dir)
+        self.assertEqual(len(video), FRAMES)
+        self.assertEqual(video.names()[:2], ['frame_000000.png', 'frame_000001.png'])
+        self.assertIn('frame_000039.png', video)
+        self.assertNotIn('frame_000040.png', video)
+        self.assertNotIn('frame_39.png', video)
+        self.assertTrue(os.path.isfile(video.index_path))
+        self.assertEqual(Video(self.path, self.index_dir)._keyframes, video._keyframes)
+        self.assertEqual(video.default_save_dir(), os.path.join(self.tmp, 'cam_annotations'))
+        video.close()
+
+    def test_random_access_matches_sequential_decode(self):
+        video = Video(self.path, self.index_dir)
+        order = list(range(FRAMES))
+        random.Random(3).shuffle(order)
+        for number in order + list(range(FRAMES - 1, -1, -1)):
+            video.cache.pop((video.path, number))
+            self.assert_frame(video, number)
+        video.close()
+
+    def test_frames_through_storage(self):
+        video = get_video(self.path, self.index_dir)
+        path = video.member_path(video.frame_name(5))
+        self.assertEqual(storage.split_member_path(path), (video, 'frame_000005.png'))
+        self.assertEqual(decode_image(path).size().width(), 32)
+        self.assertEqual(decode_image(path, 16).size().width(), 16)
+        self.assertEqual(probe_image(path)[:2], (32, 24))
+        self.assertIs(get_video(self.path, self.index_dir), video)
+
+    def test_prefetch(self):
+        video = get_video(self.path, self.index_dir)
+        video.cache.clear()
+        video.prefetch(video.names()[10:14])
+        deadline = time.time() + 5
+        while video._pending and time.time() < deadline:
+            time.sleep(0.01)
+        for number in range(10, 14):
+            self.assertIn((video.path, number), video.cache)
+        self.assert_frame(video, 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from libs.sharding import shard_path
+from libs.work_queue import LeaseError, WorkQueue, WorkQueueClient, WorkQueueServer
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = WorkQueue(os.path.join(self.dir, 'queue.db'), self.dir, lease_seconds=0.2)
+        self.assertEqual(self.queue.add_images(['a/1.jpg', 'a/2.jpg', 'b/3.jpg', 'b/2.jpg']), 4)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def test_lease_hands_out_each_image_once(self):
+        first = self.queue.lease('one', 2)
+        second = self.queue.lease('two', 3)
+        self.assertEqual(first['images'], ['a/1.jpg', 'a/2.jpg'])
+        self.assertEqual(second['images'], ['b/3.jpg', 'b/2.jpg'])
+        self.assertEqual(self.queue.lease('three', 2)['images'], [])
+        self.assertEqual(self.queue.add_images(['a/1.jpg']), 0)
+
+    def test_expired_lease_returns_images(self):
+        lease = self.queue.lease('one', 3)['lease']
+        time.sleep(0.3)
+        self.assertEqual(self.queue.lease('two', 3)['images'], ['a/1.jpg', 'a/2.jpg', 'b/3.jpg'])
+        with self.assertRaises(LeaseError):
+            self.queue.complete('one', lease, 'a/1.jpg', {'1.txt': '0 0.5 0.5 0.1 0.1\n'})
+        stats = self.queue.stats()
+        self.assertEqual(dict((c['name'], c['expired']) for c in stats['clients']), {'one': 3, 'two': 0})
+
+    def test_heartbeat_keeps_lease(self):
+        lease = self.queue.lease('one', 1)['lease']
+        for _ in range(3):
+            time.sleep(0.1)
+            self.queue.heartbeat('one', lease)
+        self.queue.complete('one', lease, 'a/1.jpg', {'1.txt': '0 0.5 0.5 0.1 0.1\n'})
+        with self.assertRaises(LeaseError):
+            self.queue.heartbeat('two', lease)
+
+    def test_complete_writes_annotation(self):
+        lease = self.queue.lease('one', 4)['lease']
+        self.queue.complete('one', lease, 'a/2.jpg', {'2.txt': '1 0.5 0.5 0.1 0.1\n', 'classes.txt': 'dog\ncat\n'})
+        self.queue.complete('one', lease, 'b/2.jpg', {'2.txt': '0 0.5 0.5 0.2 0.2\n'})
+        with open(os.path.join(self.dir, 'a', '2.txt')) as f:
+            self.assertEqual(f.read(), '1 0.5 0.5 0.1 0.1\n')
+        with open(os.path.join(self.dir, 'b', '2.txt')) as f:
+            self.assertEqual(f.read(), '0 0.5 0.5 0.2 0.2\n')
+        with self.assertRaises(ValueError):
+            self.queue.complete('one', lease, 'a/1.jpg', {'1.txt': '', 'classes.txt': 'cat\ndog\n'})
+        with self.assertRaises(ValueError):
+            self.queue.complete('one', lease, 'a/1.jpg', {'../1.txt': ''})
+        self.queue.release('one', lease)
+        stats = self.queue.stats()
+        self.assertEqual((stats['pending'], stats['leased'], stats['done']), (2, 0, 2))
+        self.assertEqual(stats['clients'][0]['completed'], 2)
+        self.assertGreater(stats['clients'][0]['per_hour'], 0)
+
+
+class TestWorkQueueServer(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = WorkQueue(os.path.join(self.dir, 'queue.db'), self.dir)
+        self.queue.add_images(['1.jpg', '2.jpg'])
+        self.server = WorkQueueServer(self.queue, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def test_client_round_trip(self):
+        client = WorkQueueClient(self.server.url, 'tester')
+        self.assertEqual(client.lease(1), ['1.jpg'])
+        counts = client.complete('1.jpg', {'1.xml': '<annotation/>'})
+        self.assertEqual((counts['done'], counts['leased'], counts['pending']), (1, 0, 1))
+        with self.assertRaises(ValueError):
+            client.complete('1.jpg', {'1.json': '{}'})
+        self.assertFalse(client.lease_lost)
+        self.assertEqual(client.lease(5), ['2.jpg'])
+        client.release()
+        self.assertEqual(client.stats()['pending'], 1)
+        self.assertTrue(os.path.isfile(shard_path(self.dir, '1', '.xml')))
+
+    def test_malformed_requests_are_answered(self):
+        for body in (b'[1, 2]', b'"client"', b'{"client": "tester", "count": [1]}', b'{"client": '):
+            request = Request(self.server.url + '/lease', body, {'Content-Type': 'application/json'})
+            with self.assertRaises(HTTPError) as raised:
+                urlopen(request, timeout=5)
+            self.assertEqual(raised.exception.code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
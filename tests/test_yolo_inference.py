@@ -0,0 +1,363 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from importlib.machinery import ModuleSpec
+
+import numpy as np
+
+dir_name = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(dir_name, '..'))
+
+from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtGui import QColor, QImage
+
+from libs.cache_manager import file_key
+from libs.high_bit_depth import HighBitDepthImage
+from libs.yolo_inference import (BACKEND_ONNX, ModelCache, PredictionCache, YOLOInferenceEngine,
+                                 YOLOInferenceWorker, YOLOLabelWriter, YOLOModelLoader, merge_tile_detections,
+                                 non_max_suppression, tile_windows)
+from libs.yolo_io import YOLOWriter
+
+
+class StandInYOLO:
+
+    def __init__(self, path):
+        if path.endswith('bad.pt'):
+            raise ValueError('not a model')
+        self.path = path
+        self.names = {0: 'car', 1: 'person'}
+        self.calls = 0
+
+    def __call__(self, source, **kwargs):
+        self.calls += 1
+        return []
+
+
+class TestYOLOModelLoader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QCoreApplication.instance() or QCoreApplication([])
+
+    def setUp(self):
+        self.saved_module = sys.modules.get('ultralytics')
+        module = types.ModuleType('ultralytics')
+        module.__spec__ = ModuleSpec('ultralytics', None)
+        module.YOLO = StandInYOLO
+        sys.modules['ultralytics'] = module
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if self.saved_module is None:
+            sys.modules.pop('ultralytics', None)
+        else:
+            sys.modules['ultralytics'] = self.saved_module
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def model_file(self, name, data=b''):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def load(self, engine, path):
+        loader = YOLOModelLoader(engine, path)
+        results = []
+        loader.model_loaded.connect(lambda *args: results.append(('loaded',) + args))
+        loader.load_failed.connect(lambda *args: results.append(('failed',) + args))
+        loader.start()
+        loader.wait()
+        QCoreApplication.processEvents()
+        return results
+
+    def test_loads_without_touching_engine(self):
+        engine = YOLOInferenceEngine()
+        self.assertTrue(engine.is_ultralytics_available)
+        path = self.model_file('m.pt')
+        [(kind, model_path, model)] = self.load(engine, path)
+        self.assertEqual((kind, model_path, model.path), ('loaded', path, path))
+        self.assertIsNone(engine.model)
+        engine.set_model(model, model_path)
+        self.assertEqual(engine.get_class_names(), ['car', 'person'])
+
+    def test_failure(self):
+        engine = YOLOInferenceEngine()
+        [(kind, model_path, message)] = self.load(engine, self.model_file('bad.pt'))
+        self.assertEqual(kind, 'failed')
+        self.assertIn('not a model', message)
+        [(kind, _, message)] = self.load(engine, os.path.join(self.dir, 'missing.pt'))
+        self.assertEqual(kind, 'failed')
+
+    def test_resident_models_are_reused(self):
+        engine = YOLOInferenceEngine()
+        path = self.model_file('m.pt')
+        self.assertIsNone(engine.resident_model(path))
+        model = engine.create_model(path)
+        self.assertEqual(model.calls, 1)
+        self.assertIs(engine.resident_model(path), model)
+        self.assertIs(engine.create_model(path), model)
+        self.assertEqual(model.calls, 1)
+        self.assertIsNone(engine.model_cache.get(path, backend=BACKEND_ONNX))
+
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(4):
+            self.paths.append(os.path.join(self.dir, '%d.pt' % i))
+            with open(self.paths[-1], 'wb') as f:
+                f.write(b'weights %d' % i)
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+        os.rmdir(self.dir)
+
+    def test_lru_by_count_and_bytes(self):
+        cache = ModelCache(max_models=2, max_bytes=100)
+        for i in range(3):
+            cache.put(self.paths[i], 'model %d' % i, 10)
+            cache.get(self.paths[0])
+        self.assertEqual([cache.get(path) for path in self.paths[:3]], ['model 0', None, 'model 2'])
+        cache.put(self.paths[3], 'model 3', 95)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.bytes, 95)
+        self.assertEqual(cache.get(self.paths[3]), 'model 3')
+
+    def test_changed_file_is_a_new_model(self):
+        cache = ModelCache()
+        cache.put(self.paths[0], 'old')
+        self.assertEqual(cache.get(self.paths[0], hash_file=False), 'old')
+        with open(self.paths[0], 'wb') as f:
+            f.write(b'retrained weights')
+        self.assertIsNone(cache.get(self.paths[0], hash_file=False))
+        self.assertIsNone(cache.get(self.paths[0]))
+
+
+class TestPredictionCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = PredictionCache(max_entries=2)
+        cache.put(('img1', 'model', 0.25), [{'class_name': 'car'}])
+        cache.put(('img2', 'model', 0.25), [])
+        cache.get(('img1', 'model', 0.25))
+        cache.put(('img3', 'model', 0.25), [])
+        self.assertEqual(cache.get(('img1', 'model', 0.25)), [{'class_name': 'car'}])
+        self.assertIsNone(cache.get(('img2', 'model', 0.25)))
+        self.assertIsNone(cache.get(('img1', 'model', 0.5)))
+        self.assertEqual(cache.get(('img3', 'model', 0.25)), [])
+
+
+class Tensor:
+
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class SquareFinder:
+    """Finds white squares on black, missing those under 4 pixels once a crop is shrunk to 640."""
+
+    names = {0: 'dot'}
+
+    def __init__(self):
+        self.crops = 0
+
+    def __call__(self, crops, conf=0.25, verbose=True):
+        results = []
+        for crop in crops if isinstance(crops, list) else [crops]:
+            self.crops += 1
+            scale = min(1.0, 640.0 / max(crop.shape[:2]))
+            boxes = []
+            for ys in self.runs(crop[..., 0].max(axis=1) > 128):
+                for xs in self.runs(crop[ys[0]:ys[1], :, 0].max(axis=0) > 128):
+                    if min(ys[1] - ys[0], xs[1] - xs[0]) * scale >= 4:
+                        boxes.append((xs[0], ys[0], xs[1], ys[1]))
+            boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+            results.append(types.SimpleNamespace(names=self.names, boxes=types.SimpleNamespace(
+                xyxy=Tensor(boxes), conf=Tensor(np.full(len(boxes), 0.9)), cls=Tensor(np.zeros(len(boxes))))))
+        return results
+
+    @staticmethod
+    def runs(mask):
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(int), [0]])))
+        return list(zip(edges[::2], edges[1::2]))
+
+
+class TestTiledInference(unittest.TestCase):
+
+    def test_tile_windows_cover_the_image(self):
+        windows = tile_windows(1500, 700, 640, 0.2)
+        self.assertEqual(sorted(set(x for x, _, _, _ in windows)), [0, 430, 860])
+        self.assertEqual(sorted(set(y for _, y, _, _ in windows)), [0, 60])
+        self.assertTrue(all(x2 - x1 == 640 and y2 - y1 == 640 for x1, y1, x2, y2 in windows))
+        self.assertEqual(tile_windows(300, 200, 640), [(0, 0, 300, 200)])
+
+    def test_non_max_suppression(self):
+        boxes = [(0, 0, 10, 10), (1, 1, 11, 11), (0, 0, 10, 10), (0, 0, 5, 10), (50, 50, 60, 60)]
+        keep = non_max_suppression(boxes, [0.5, 0.9, 0.8, 0.7, 0.6], [0, 0, 1, 0, 0], 0.5)
+        self.assertEqual(keep.tolist(), [1, 2, 3, 4])
+        keep = non_max_suppression(boxes, [0.5, 0.9, 0.8, 0.7, 0.6], [0, 0, 1, 0, 0], 0.5, metric='ios')
+        self.assertEqual(keep.tolist(), [1, 2, 4])
+        self.assertEqual(len(non_max_suppression([], [], [], 0.5)), 0)
+
+    def test_cut_boxes_give_way_to_whole_ones(self):
+        image, left, right = (0, 0, 1000, 600), (0, 0, 600, 600), (400, 0, 1000, 600)
+        boxes = [(300, 100, 600, 300),  # cut by the right border of the left tile, best score
+                 (300, 100, 700, 300),  # the whole object, from the right tile
+                 (320, 150, 360, 190),  # a small object inside it, in no tile border
+                 (920, 400, 940, 420),  # another class, inside the next box
+                 (900, 400, 1000, 450)]  # ending at the image border, which cuts nothing
+        scores = [0.9, 0.6, 0.5, 0.4, 0.8]
+        windows = [left, right, left, image, right]
+        keep = merge_tile_detections(boxes, scores, [0, 0, 0, 1, 1], windows, 1000, 600)
+        self.assertEqual(keep.tolist(), [4, 1, 2, 3])
+
+    def test_small_objects_are_found_in_tiles(self):
+        image = np.zeros((1200, 2000, 3), np.uint8)
+        squares = [(x, y) for x in (100, 420, 900, 1615) for y in (50, 600, 1100)]
+        for x, y in squares:
+            image[y:y + 12, x:x + 12] = 255
+        image[300:500, 1000:1900] = 255
+        engine = YOLOInferenceEngine()
+        model = SquareFinder()
+        self.assertEqual(len(engine.predict_image(image, model=model)), 1)
+        engine.tile_size = 640
+        detections = engine.predict_image(image, model=model)
+        self.assertEqual(model.crops, 1 + 1 + 12)
+        found = sorted(tuple(int(v) for v in d['bbox']) for d in detections)
+        expected = sorted([(x, y, x + 12, y + 12) for x, y in squares] + [(1000, 300, 1900, 500)])
+        self.assertEqual(found, expected)
+        self.assertEqual(detections[0]['class_name'], 'dot')
+
+
+class TestLabelWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.classes_path = os.path.join(self.dir, 'classes.txt')
+        with open(self.classes_path, 'w') as f:
+            f.write('car\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_classes_stay_in_step_with_gui_saves(self):
+        detection = {'bbox': [0, 0, 10, 10], 'confidence': 0.9, 'class_id': 0}
+        writer = YOLOLabelWriter(self.dir)
+        writer.write('/img/a.png', [dict(detection, class_name='dot')], (10, 10))
+        # A save from the GUI rewrites classes.txt in the order of its own list...
+        gui_classes = ['person', 'car']
+        yolo = YOLOWriter('img', 'b.png', (10, 10, 3))
+        yolo.add_bnd_box(0, 0, 5, 5, 'person', 0)
+        yolo.save(gui_classes, os.path.join(self.dir, 'b.txt'))
+        # ...keeping the class the inference added, without adding it to the GUI's list,
+        with open(self.classes_path) as f:
+            self.assertEqual(f.read().split(), ['person', 'car', 'dot'])
+        self.assertEqual(gui_classes, ['person', 'car'])
+        # ...and the inference numbers its next labels by the new file.
+        path = writer.write('/img/c.png', [dict(detection, class_name='car'), dict(detection, class_name='dot')],
+                            (10, 10))
+        with open(path) as f:
+            self.assertEqual([line.split()[0] for line in f.read().splitlines()], ['1', '2'])
+
+
+class TestInferencePipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QCoreApplication.instance() or QCoreApplication([])
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.save_dir = os.path.join(self.dir, 'labels')
+        os.mkdir(self.save_dir)
+        with open(os.path.join(self.save_dir, 'classes.txt'), 'w') as f:
+            f.write('car\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def image(self, name, square):
+        path = os.path.join(self.dir, name)
+        image = QImage(100, 50, QImage.Format_RGB32)
+        image.fill(QColor(0, 0, 0))
+        if square:
+            for x in range(20, 40):
+                for y in range(10, 30):
+                    image.setPixelColor(x, y, QColor(255, 255, 255))
+        image.save(path)
+        return path
+
+    def test_labels_are_written_off_the_gui_thread(self):
+        paths = [self.image('%d.png' % i, i % 2) for i in range(6)]
+        broken = os.path.join(self.dir, 'broken.png')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+        engine = YOLOInferenceEngine()
+        engine.set_model(SquareFinder(), 'finder.pt')
+        worker = YOLOInferenceWorker(engine, paths + [broken], self.save_dir)
+        progress, written, failed = [], [], []
+        worker.progress_updated.connect(progress.append)
+        worker.labels_written.connect(written.extend)
+        worker.inference_failed.connect(lambda path, message: failed.append(path))
+        worker.start()
+        worker.wait()
+        QCoreApplication.processEvents()
+        self.assertEqual(progress[-1], 7)
+        self.assertEqual(sorted(written), paths[1::2])
+        self.assertEqual(failed, [broken])
+        self.assertEqual(sorted(os.listdir(self.save_dir)), ['1.txt', '3.txt', '5.txt', 'classes.txt'])
+        with open(os.path.join(self.save_dir, '3.txt')) as f:
+            self.assertEqual(f.read(), '1 0.300000 0.400000 0.200000 0.400000')
+        with open(os.path.join(self.save_dir, 'classes.txt')) as f:
+            self.assertEqual(f.read(), 'car\ndot\n')
+
+    def test_unmeasurable_image_does_not_stop_the_run(self):
+        class UnmeasurableImage(QImage):
+            def width(self):
+                raise RuntimeError('no size')
+
+        class NothingFinder:
+            def predict_image(self, image, conf_threshold):
+                return []
+
+        paths = [self.image('%d.png' % i, False) for i in range(12)]
+        bad = UnmeasurableImage(10, 10, QImage.Format_RGB32)
+        worker = YOLOInferenceWorker(NothingFinder(), paths, self.save_dir, image_cache={file_key(paths[0]): bad})
+        progress, failed = [], []
+        worker.progress_updated.connect(progress.append)
+        worker.inference_failed.connect(lambda path, message: failed.append((path, message)))
+        worker.start()
+        self.assertTrue(worker.wait(5000))
+        QCoreApplication.processEvents()
+        self.assertEqual(progress[-1], 12)
+        self.assertEqual(failed, [(paths[0], 'no size')])
+
+    def test_cached_16_bit_image_is_predicted_from_a_copy_of_its_rendering(self):
+        path = self.image('a.png', False)
+        hdr = HighBitDepthImage(np.full((50, 100), 1000, np.uint16))
+        hdr.set_window(1000, 2000)
+        worker = YOLOInferenceWorker(YOLOInferenceEngine(), [path], self.save_dir,
+                                     image_cache={file_key(path): hdr, file_key(self.dir): 'not an image'})
+        image = worker._decode(path)
+        self.assertIsInstance(image, QImage)
+        self.assertEqual(QColor(image.pixel(0, 0)).red(), 127)
+        hdr.set_window(2000, 4000)
+        self.assertEqual(QColor(image.pixel(0, 0)).red(), 127)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Name: benchmark_backends.py
+Compares the images per second of a YOLO model run through PyTorch and
+through ONNX Runtime on the same images, and how far their detections
+agree.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    from PyQt5.QtGui import QGuiApplication
+except ImportError:
+    from PyQt4.QtGui import QApplication as QGuiApplication
+
+from libs.image_decoder import decode_image
+from libs.yolo_inference import BACKEND_NAMES, BACKEND_ONNX, BACKEND_PYTORCH, YOLOInferenceEngine
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def image_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTS):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def matched(detections, reference, iou=0.5):
+    """How many reference detections have a detection of the same class overlapping them by iou."""
+    count = 0
+    for ref in reference:
+        x1, y1, x2, y2 = ref["bbox"]
+        for det in detections:
+            if det["class_id"] != ref["class_id"]:
+                continue
+            a1, b1, a2, b2 = det["bbox"]
+            width, height = min(x2, a2) - max(x1, a1), min(y2, b2) - max(y1, b1)
+            if width > 0 and height > 0:
+                intersection = width * height
+                if intersection / ((x2 - x1) * (y2 - y1) + (a2 - a1) * (b2 - b1) - intersection) >= iou:
+                    count += 1
+                    break
+    return count
+
+
+if __name__ == "__main__":
+    arg_p = argparse.ArgumentParser()
+    arg_p.add_argument("model", help="YOLO model (.pt)")
+    arg_p.add_argument("images", nargs="+", help="Images or directories of images")
+    arg_p.add_argument("-r", "--repeat", type=int, default=3,
+                       help="Passes over the images per backend; the fastest counts")
+    arg_p.add_argument("-c", "--conf", type=float, default=0.25, help="Confidence threshold")
+    arg_p.add_argument("-t", "--tile-size", type=int, default=0,
+                       help="Predict images larger than this in tiles, as RedLabel can")
+    args = arg_p.parse_args()
+
+    app = QGuiApplication(sys.argv[:1])
+    paths = list(image_paths(args.images))
+    # Decoding is the same for both backends and is left out of the timing.
+    images = [(path, decode_image(path)) for path in paths]
+    images = [(path, image) for path, image in images if image is not None]
+    if not images:
+        print("No images could be decoded")
+        sys.exit(1)
+    print(f"{len(images)} images, model {os.path.basename(args.model)}")
+
+    results = {}
+    for backend in (BACKEND_PYTORCH, BACKEND_ONNX):
+        engine = YOLOInferenceEngine()
+        engine.backend = backend
+        engine.tile_size = args.tile_size
+        start = time.perf_counter()
+        try:
+            # Exports the model to ONNX on its first run; loading warms the model up.
+            engine.load_model(args.model)
+        except Exception as e:
+            print(f"{BACKEND_NAMES[backend]:<20} unavailable: {e}")
+            continue
+        load_time = time.perf_counter() - start
+        passes = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            detections = [engine.predict_image(image, args.conf) for _, image in images]
+            passes.append(time.perf_counter() - start)
+        best = min(passes)
+        results[backend] = detections
+        print(f"{BACKEND_NAMES[backend]:<20} load {load_time:.2f} s  "
+              f"{len(images) / best:.1f} images/s  {best / len(images) * 1000:.1f} ms/image  "
+              f"{sum(map(len, detections))} detections")
+
+    if len(results) == 2:
+        reference, other = results[BACKEND_PYTORCH], results[BACKEND_ONNX]
+        total = sum(map(len, reference))
+        found = sum(matched(b, a) for a, b in zip(reference, other))
+        print(f"ONNX Runtime finds {found} of {total} PyTorch detections"
+              + (f" ({100.0 * found / total:.1f}%)" if total else ""))
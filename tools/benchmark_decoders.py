@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Name: benchmark_decoders.py
+Times every installed image decoder on sample images and records the
+fastest one per format for RedLabel.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    from PyQt5.QtGui import QGuiApplication
+except ImportError:
+    from PyQt4.QtGui import QApplication as QGuiApplication
+
+from libs.image_decoder import DecoderSelector, default_choices_path, image_format
+
+
+if __name__ == "__main__":
+    # Add the argument parse
+    arg_p = argparse.ArgumentParser()
+    arg_p.add_argument("images",
+                       nargs="+",
+                       help="Sample images, one or more per format")
+    arg_p.add_argument("-r", "--repeat",
+                       type=int,
+                       default=5,
+                       help="Decodes per backend and image; the best time counts")
+    arg_p.add_argument("-s", "--save",
+                       action="store_true",
+                       help=f"Store the fastest backend per format in {default_choices_path()}")
+    args = vars(arg_p.parse_args())
+
+    app = QGuiApplication(sys.argv[:1])
+    selector = DecoderSelector(choices_path=default_choices_path())
+    print("Backends: " + ", ".join(d.name for d in selector.decoders))
+
+    totals = {}
+    for path in args["images"]:
+        fmt = image_format(path)
+        for decoder, seconds in selector.benchmark(path, repeat=args["repeat"]):
+            print(f"{os.path.basename(path)}  {decoder.name:<12} "
+                  + ("failed" if seconds is None else f"{seconds * 1000:.1f} ms"))
+            times = totals.setdefault(fmt, {}).setdefault(decoder, [])
+            times.append(float("inf") if seconds is None else seconds)
+
+    for fmt, times in sorted(totals.items()):
+        fastest = min(times, key=lambda decoder: sum(times[decoder]))
+        print(f"{fmt}: {fastest.name}")
+        if args["save"] and sum(times[fastest]) != float("inf"):
+            selector.remember(fmt, fastest)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Name: benchmark_startup.py
+Measures RedLabel's cold start: the time from launching a fresh process
+until the main window has painted its first frame and the event loop is
+idle, i.e. the window accepts input.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run_child(redlabel_args, wait_model):
+    """Start RedLabel in this process and print the time of each startup stage as JSON."""
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from redlabel import get_main_app
+    try:
+        from PyQt5.QtCore import QEvent, QObject, QTimer
+    except ImportError:
+        from PyQt4.QtCore import QEvent, QObject, QTimer
+    imported = time.perf_counter()
+    times = {"import": imported - start}
+
+    def report():
+        print(json.dumps(times), flush=True)
+        # Background loads may still run; they are not part of the measurement.
+        os._exit(0)
+
+    def model_ready():
+        times["model"] = time.perf_counter() - start
+        report()
+
+    def interactive():
+        times["interactive"] = time.perf_counter() - start
+        loader = win.yolo_model_loader
+        if wait_model and loader is not None:
+            if loader.isFinished():
+                model_ready()
+            loader.finished.connect(model_ready)
+        else:
+            report()
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and "first_paint" not in times:
+                times["first_paint"] = time.perf_counter() - start
+                # Runs once the queued startup work and the paint are done.
+                QTimer.singleShot(0, interactive)
+            return False
+
+    app, win = get_main_app(["redlabel"] + redlabel_args)
+    times["window"] = time.perf_counter() - start
+    first_paint = FirstPaint()
+    app.installEventFilter(first_paint)
+    app.exec_()
+
+
+if __name__ == "__main__":
+    arg_p = argparse.ArgumentParser()
+    arg_p.add_argument("redlabel_args", nargs="*",
+                       help="Arguments for RedLabel, e.g. an image directory")
+    arg_p.add_argument("-n", "--runs", type=int, default=5,
+                       help="Number of fresh processes to start")
+    arg_p.add_argument("-m", "--wait-model", action="store_true",
+                       help="Also measure until the last YOLO model is restored")
+    arg_p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = arg_p.parse_args()
+
+    if args.child:
+        run_child(args.redlabel_args, args.wait_model)
+        sys.exit(1)
+
+    stages = ["import", "window", "first_paint", "interactive"] + (["model"] if args.wait_model else [])
+    results = dict((stage, []) for stage in stages + ["process"])
+    command = [sys.executable, os.path.abspath(__file__), "--child"] + (["-m"] if args.wait_model else [])
+    for run in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run(command + ["--"] + args.redlabel_args, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        elapsed = time.perf_counter() - start
+        try:
+            times = json.loads(output.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            print(f"Run {run + 1} failed:\n{output}")
+            sys.exit(1)
+        # Includes starting the interpreter, which the child cannot see.
+        times["process"] = elapsed
+        print(f"Run {run + 1}: " + "  ".join(f"{stage} {times[stage] * 1000:.0f} ms"
+                                            for stage in stages + ["process"] if stage in times))
+        for stage, seconds in times.items():
+            results[stage].append(seconds)
+
+    print("Median: " + "  ".join(f"{stage} {statistics.median(results[stage]) * 1000:.0f} ms"
+                                 for stage in stages + ["process"] if results[stage]))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Name: reshard.py
+Moves the label files of a flat annotation directory into the
+hash-sharded layout RedLabel reads and writes. Other files, such as
+classes.txt, READMEs or configs, stay where they are.
+"""
+
+import os
+import sys
+import argparse
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from libs.sharding import is_sharded, reshard
+
+
+if __name__ == "__main__":
+    # Add the argument parse
+    arg_p = argparse.ArgumentParser()
+    arg_p.add_argument("-l", "--location",
+                       type=str,
+                       required=True,
+                       help="Annotation directory to reshard")
+    arg_p.add_argument("-w", "--workers",
+                       type=int,
+                       default=None,
+                       help="Number of parallel move threads")
+    args = vars(arg_p.parse_args())
+
+    if not os.path.isdir(args["location"]):
+        print(f"Directory: {args['location']} not exists")
+        exit(1)
+    if is_sharded(args["location"]):
+        print(f"Directory: {args['location']} is already sharded, moving new flat files only")
+
+    def progress(done, total):
+        if done % 10000 == 0 or done == total:
+            print(f"{done}/{total} files checked")
+
+    start = time.time()
+    moved = reshard(args["location"], workers=args["workers"], progress=progress)
+    print(f"Moved {moved} files in {time.time() - start:.1f}s")
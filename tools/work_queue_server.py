@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Name: work_queue_server.py
+Shares the images of a directory between several RedLabel instances:
+hands them out in leased batches and collects the saved annotations.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from libs.utils import natural_sort
+from libs.work_queue import DEFAULT_PORT, LEASE_SECONDS, WorkQueue, WorkQueueServer
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+
+
+def image_names(image_dir):
+    """'/'-separated paths of the images below image_dir."""
+    names = []
+    for root, _, files in os.walk(image_dir):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTS):
+                names.append(os.path.relpath(os.path.join(root, file), image_dir).replace(os.sep, '/'))
+    natural_sort(names, key=lambda x: x.lower())
+    return names
+
+
+if __name__ == "__main__":
+    arg_p = argparse.ArgumentParser()
+    arg_p.add_argument("image_dir", help="Directory of the images to annotate")
+    arg_p.add_argument("-s", "--save-dir", default=None,
+                       help="Directory the annotations are written to (default: image_dir)")
+    arg_p.add_argument("--host", default="127.0.0.1",
+                       help="Address to listen on; 0.0.0.0 accepts other workstations")
+    arg_p.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    arg_p.add_argument("-l", "--lease", type=int, default=LEASE_SECONDS,
+                       help="Seconds a batch stays leased without heartbeats")
+    args = arg_p.parse_args()
+
+    if not os.path.isdir(args.image_dir):
+        print(f"Directory: {args.image_dir} not exists")
+        exit(1)
+    save_dir = args.save_dir or args.image_dir
+    os.makedirs(save_dir, exist_ok=True)
+    queue = WorkQueue(os.path.join(save_dir, '.redlabel_queue.db'), save_dir, lease_seconds=args.lease)
+    added = queue.add_images(image_names(args.image_dir))
+    counts = queue.stats()
+    print(f"{added} new images queued; {counts['pending']} pending, {counts['done']} done")
+
+    server = WorkQueueServer(queue, args.host, args.port)
+    print(f"Serving {args.image_dir} at {server.url}; Ctrl+C stops")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass